@@ -0,0 +1,142 @@
+"""
+Minimal in-process ASGI client: HTTP requests and websockets without network and threads.
+"""
+from asyncio import Queue, Task, get_event_loop, wait_for, wait
+from contextvars import Context
+from json import dumps, loads
+from typing import Any, Optional, Tuple, List
+from urllib.parse import urlsplit
+
+from starlette.types import ASGIApp
+from websockets import ConnectionClosed
+
+
+def _spawn(coro) -> Task:
+    # each connection is served in a clean context (as by a server): database connections are bound to context
+    return Context().run(get_event_loop().create_task, coro)
+
+
+def _scope(kind: str, url: str, method: str = 'GET', headers: Optional[List[Tuple[bytes, bytes]]] = None) -> dict:
+    parts = urlsplit(url)
+    scope = {
+        'type': kind,
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'scheme': 'http' if kind == 'http' else 'ws',
+        'path': parts.path,
+        'raw_path': parts.path.encode(),
+        'root_path': '',
+        'query_string': parts.query.encode(),
+        'headers': [(b'host', b'bench')] + (headers or []),
+        'server': ('bench', 80),
+        'client': ('bench', 1),
+    }
+    if kind == 'http':
+        scope['method'] = method
+    else:
+        scope['subprotocols'] = []
+    return scope
+
+
+async def request(app: ASGIApp, method: str, url: str, body: Any = None) -> Tuple[int, bytes]:
+    """
+    Make HTTP request. Body (if defined) is serialized to JSON.
+
+    :return: status code and response body
+    """
+    payload = dumps(body).encode() if body is not None else b''
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    sent = False
+    status = 0
+    chunks = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+        # wait forever: client is not disconnecting
+        await get_event_loop().create_future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    await _spawn(app(_scope('http', url, method, headers), receive, send))
+    return status, b''.join(chunks)
+
+
+class WebSocket:
+    """
+    Websocket connection to ASGI application
+
+    .. code-block:: python
+
+        async with WebSocket(app, '/internal/journals/updates') as ws:
+            message = await ws.receive_json()
+    """
+
+    def __init__(self, app: ASGIApp, url: str):
+        self.__app = app
+        self.__url = url
+        self.__to_app: Queue = Queue()
+        self.__from_app: Queue = Queue()
+        self.__task: Optional[Task] = None
+        self.closed = False
+
+    async def connect(self, timeout: float = 5):
+        self.__task = _spawn(self.__app(_scope('websocket', self.__url), self.__to_app.get, self.__send))
+        await self.__to_app.put({'type': 'websocket.connect'})
+        message = await wait_for(self.__from_app.get(), timeout)
+        if message['type'] != 'websocket.accept':
+            raise ConnectionError(f'websocket rejected: {message}')
+
+    async def __send(self, message):
+        if self.closed:
+            # as server does for disconnected client
+            raise ConnectionClosed(1000, 'closed by client')
+        await self.__from_app.put(message)
+
+    async def send_json(self, data: Any):
+        await self.__to_app.put({'type': 'websocket.receive', 'text': dumps(data)})
+
+    async def receive_text(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Next text message or None if connection closed by server
+        """
+        message = await wait_for(self.__from_app.get(), timeout)
+        if message['type'] == 'websocket.close':
+            self.closed = True
+            return None
+        return message.get('text')
+
+    async def receive_json(self, timeout: Optional[float] = None) -> Any:
+        text = await self.receive_text(timeout)
+        return loads(text) if text is not None else None
+
+    async def close(self, timeout: float = 5):
+        """
+        Disconnect and wait for the application handler to finish (it will be cancelled after timeout)
+        """
+        if self.__task is None:
+            return
+        self.closed = True
+        await self.__to_app.put({'type': 'websocket.disconnect', 'code': 1000})
+        done, _ = await wait([self.__task], timeout=timeout)
+        if not done:
+            self.__task.cancel()
+        try:
+            await self.__task
+        except BaseException:
+            pass
+        self.__task = None
+
+    async def __aenter__(self) -> 'WebSocket':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,154 @@
+"""
+Helpers for benchmarks: temporary databases, seeded datasets, latency statistics and reports.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from json import dumps, loads
+from pathlib import Path
+from platform import python_version
+from random import Random
+from sqlite3 import sqlite_version
+from subprocess import run, PIPE, DEVNULL
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List, Dict, Iterator, AsyncIterator, Optional
+
+from databases import Database
+
+from binp.db import migrate
+from binp.journals import Journal, Journals, Record
+
+OPERATIONS = ('sync_users', 'import_orders', 'send_report', 'cleanup', 'refresh_cache')
+LABELS = ('critical', 'nightly', 'manual', 'retry', 'external')
+
+
+@asynccontextmanager
+async def database(directory: Optional[Path] = None) -> AsyncIterator[Database]:
+    """
+    Temporary migrated SQLite database
+    """
+    with TemporaryDirectory(dir=directory) as tmp:
+        db = Database(f'sqlite:///{Path(tmp) / "bench.db"}')
+        await db.connect()
+        try:
+            online = await migrate(db)
+            if online is not None:
+                await online
+            yield db
+        finally:
+            await db.disconnect()
+
+
+def generate_journals(count: int, seed: int = 42, records: int = 3, fields: int = 3,
+                      failed_ratio: float = 0.1) -> Iterator[Journal]:
+    """
+    Deterministic dataset: the same seed produces the same journals
+    """
+    rnd = Random(seed)
+    started = datetime(2021, 1, 1)
+    for i in range(count):
+        started_at = started + timedelta(seconds=i * 10)
+        duration = rnd.expovariate(1 / 2)
+        yield Journal(
+            id=i + 1,
+            operation=rnd.choice(OPERATIONS),
+            description='generated journal',
+            started_at=started_at,
+            finished_at=started_at + timedelta(seconds=duration),
+            duration=duration,
+            error='generated error' if rnd.random() < failed_ratio else None,
+            labels=rnd.sample(LABELS, rnd.randint(0, 2)),
+            records=[Record(message=f'step {j}', created_at=started_at,
+                            params={f'field_{k}': rnd.randint(0, 1000) for k in range(fields)})
+                     for j in range(records)],
+        )
+
+
+async def seed(db: Database, count: int, seed_value: int = 42, **kwargs) -> Journals:
+    """
+    Fill database with generated journals (by bulk import)
+    """
+    journals = Journals(db)
+    await journals.load(generate_journals(count, seed_value, **kwargs), batch_size=5000)
+    return journals
+
+
+def stats(samples: List[float]) -> Dict[str, float]:
+    """
+    Latency statistics in milliseconds
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000,
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+class Stopwatch:
+    """
+    Collect durations of repeated operations
+
+    .. code-block:: python
+
+        watch = Stopwatch()
+        for _ in range(100):
+            with watch:
+                do_something()
+        print(watch.stats())
+    """
+
+    def __init__(self):
+        self.samples: List[float] = []
+        self.__started = 0.0
+
+    def __enter__(self):
+        self.__started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.samples.append(perf_counter() - self.__started)
+
+    def stats(self) -> Dict[str, float]:
+        return stats(self.samples)
+
+
+def environment() -> Dict[str, str]:
+    """
+    Description of environment to compare runs: commit, python and SQLite versions
+    """
+    commit = run(['git', 'rev-parse', '--short', 'HEAD'], stdout=PIPE, stderr=DEVNULL, text=True).stdout.strip()
+    return {
+        'commit': commit,
+        'python': python_version(),
+        'sqlite': sqlite_version,
+        'time': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def save_report(path: Path, params: dict, results: Dict[str, dict]):
+    path.write_text(dumps({'environment': environment(), 'params': params, 'results': results}, indent=2))
+
+
+def compare(previous: Path, results: Dict[str, dict]) -> List[str]:
+    """
+    Relative change of each numeric metric against previous report
+    """
+    old = loads(previous.read_text())['results']
+    lines = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = old.get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not base:
+                continue
+            lines.append(f'{name}.{metric}: {base:.3f} -> {value:.3f} ({(value - base) / base * 100:+.1f}%)')
+    return lines
@@ -0,0 +1,188 @@
+"""
+In-process load test of the internal API: websocket subscribers of journal updates and concurrent
+action invocations through ASGI (without network). Reports latency percentiles, memory growth and dropped events.
+
+    python -m benchmarks.load --clients 100 --writers 10 --duration 10 --output load.json
+
+Each writer invokes a journaled action (``POST /action/write``) in a loop, each client listens
+``/journals/updates``. Event latency is the time between journal update (emit) and receiving the pushed
+journal by client. Events not received by a client (connected before the update) are counted as dropped.
+"""
+from argparse import ArgumentParser
+from asyncio import Queue, get_event_loop, gather, sleep, wait
+from dataclasses import dataclass, asdict
+from json import loads
+from pathlib import Path
+from resource import getrusage, RUSAGE_SELF
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from binp.action import Action
+from binp.api import create_internal
+from binp.journals import Journals
+from binp.kv import KV
+from binp.service import Service
+from benchmarks.asgi import WebSocket, request
+from benchmarks.common import database, stats, save_report
+
+
+@dataclass
+class LoadConfig:
+    #: number of websocket clients
+    clients: int = 100
+    #: number of concurrent writers (action invocations)
+    writers: int = 10
+    #: duration of the load in seconds
+    duration: float = 10
+    #: records added by each action call
+    records: int = 2
+    #: maximum time to wait for the rest of pushes after the load, not received events are dropped
+    drain: float = 5
+
+
+def rss_mb() -> float:
+    """
+    Current resident memory of the process (Linux)
+    """
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    from os import sysconf
+    return pages * sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+class StampedQueue(Queue):
+    """
+    Queue that remembers when each event was emitted
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stamps: Dict[Tuple[int, bool], float] = {}
+
+    def put_nowait(self, item):
+        if item is not None:
+            # journal is updated on start and on finish - finish is always the last one
+            key = (item, (item, False) in self.stamps)
+            self.stamps[key] = perf_counter()
+        super().put_nowait(item)
+
+
+async def load_test(config: LoadConfig) -> Dict[str, float]:
+    async with database() as db:
+        journals = Journals(db)
+        actions = Action()
+
+        @actions(name='write')
+        @journals(operation='write')
+        async def write():
+            for i in range(config.records):
+                await journals.record('step', index=i)
+
+        app = create_internal(journals, KV(db=db), actions, Service())
+        # warm-up: construct application and routes
+        await request(app, 'GET', '/actions/')
+
+        rss_start = rss_mb()
+        emitted = StampedQueue()
+        with journals.journal_updated.subscribe(emitted):
+            sockets = [WebSocket(app, '/journals/updates') for _ in range(config.clients)]
+            for socket in sockets:
+                await socket.connect()
+
+            invoke_latency: List[float] = []
+            failures = 0
+            deadline = perf_counter() + config.duration
+
+            async def writer():
+                nonlocal failures
+                while perf_counter() < deadline:
+                    started = perf_counter()
+                    status, _ = await request(app, 'POST', '/action/write')
+                    invoke_latency.append(perf_counter() - started)
+                    if status != 200:
+                        failures += 1
+
+            event_latency: List[float] = []
+            received: List[int] = [0] * len(sockets)
+            rss_peak = rss_start
+
+            async def client(index: int, socket: WebSocket):
+                while True:
+                    text = await socket.receive_text()
+                    if text is None:
+                        break
+                    now = perf_counter()
+                    journal = loads(text)
+                    stamp = emitted.stamps.get((journal['id'], journal['finished_at'] is not None))
+                    if stamp is not None:
+                        event_latency.append(now - stamp)
+                    received[index] += 1
+                    if not writing and received[index] >= len(emitted.stamps):
+                        break
+
+            async def monitor():
+                nonlocal rss_peak
+                while perf_counter() < deadline:
+                    rss_peak = max(rss_peak, rss_mb())
+                    await sleep(0.2)
+
+            writing = True
+            clients = [get_event_loop().create_task(client(i, socket)) for i, socket in enumerate(sockets)]
+            started = perf_counter()
+            await gather(monitor(), *[writer() for _ in range(config.writers)])
+            elapsed = perf_counter() - started
+            writing = False
+            # give clients limited time to receive the rest of events, everything else is dropped
+            drain_started = perf_counter()
+            _, pending = await wait(clients, timeout=config.drain)
+            drain_time = perf_counter() - drain_started
+            for task in pending:
+                task.cancel()
+            rss_end = rss_mb()
+            for socket in sockets:
+                socket.closed = True
+            # wake up idle handlers (as on shutdown)
+            journals.journal_updated.close()
+            await gather(*[socket.close() for socket in sockets])
+
+    expected = len(emitted.stamps)
+    result = {
+        'clients': config.clients,
+        'writers': config.writers,
+        'invocations': len(invoke_latency),
+        'invocations_per_sec': len(invoke_latency) / elapsed,
+        'failures': failures,
+        'events': expected,
+        'pushes': sum(received),
+        'dropped': expected * config.clients - sum(received),
+        'drain_sec': drain_time,
+        'rss_start_mb': rss_start,
+        'rss_peak_mb': max(rss_peak, rss_end),
+        'rss_growth_mb': rss_end - rss_start,
+        'max_rss_mb': getrusage(RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    result.update({f'invoke.{key}': value for key, value in stats(invoke_latency).items()})
+    result.update({f'event.{key}': value for key, value in stats(event_latency).items()})
+    return result
+
+
+def main():
+    defaults = LoadConfig()
+    parser = ArgumentParser(description='in-process load test of internal API')
+    parser.add_argument('--clients', type=int, default=defaults.clients, help='websocket clients')
+    parser.add_argument('--writers', type=int, default=defaults.writers, help='concurrent action invocations')
+    parser.add_argument('--duration', type=float, default=defaults.duration, help='load duration in seconds')
+    parser.add_argument('--records', type=int, default=defaults.records, help='records per action call')
+    parser.add_argument('--output', type=Path, help='save results as JSON')
+    args = parser.parse_args()
+
+    config = LoadConfig(clients=args.clients, writers=args.writers, duration=args.duration, records=args.records)
+    result = get_event_loop().run_until_complete(load_test(config))
+    for metric, value in result.items():
+        print(f'{metric:30} {value:14.3f}')
+    if args.output is not None:
+        save_report(args.output, asdict(config), {'load': result})
+
+
+if __name__ == '__main__':
+    main()
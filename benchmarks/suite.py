@@ -0,0 +1,389 @@
+"""
+Benchmark suite: journals, KV, events and API. Results are printed and could be saved as JSON
+to compare runs across commits.
+
+    python -m benchmarks.suite --size 10000 --output before.json
+    python -m benchmarks.suite --size 10000 --output after.json --compare before.json
+    python -m benchmarks.suite --only kv,emitter_fanout
+
+All datasets are generated from the seed, so runs with the same parameters are comparable.
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop, gather, Queue, wait_for, Event, TimeoutError
+from contextlib import nullcontext
+from pathlib import Path
+from random import Random
+from time import perf_counter
+from typing import Dict, Callable, Awaitable, List
+from unittest.mock import patch
+
+from binp.action import Action
+from binp.api import create_internal
+from binp.events import Emitter
+from binp.journals import Journals
+from binp.kv import KV
+from binp.service import Service
+from binp.tasks import Tasks
+from benchmarks.asgi import WebSocket
+from benchmarks.common import database, seed, Stopwatch, save_report, compare, OPERATIONS, LABELS
+from benchmarks.load import LoadConfig, load_test
+
+BENCHMARKS: Dict[str, Callable[..., Awaitable[Dict[str, float]]]] = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def flatten(prefix: str, metrics: Dict[str, float]) -> Dict[str, float]:
+    return {f'{prefix}.{key}': value for key, value in metrics.items()}
+
+
+@benchmark
+async def journal_calls(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    Throughput of journaled calls with one record (all calls and 1-in-100 sampled)
+    """
+    calls = max(100, size // 10)
+    async with database() as db:
+        journal = Journals(db)
+
+        @journal(operation='bench')
+        async def call():
+            await journal.record('step', value=1)
+
+        @journal(operation='bench_sampled', sample=100)
+        async def sampled_call():
+            await journal.record('step', value=1)
+
+        started = perf_counter()
+        for _ in range(calls):
+            await call()
+        elapsed = perf_counter() - started
+
+        started = perf_counter()
+        for _ in range(calls):
+            await sampled_call()
+        sampled_elapsed = perf_counter() - started
+    return {'calls': calls, 'calls_per_sec': calls / elapsed, 'sampled_calls_per_sec': calls / sampled_elapsed}
+
+
+@benchmark
+async def journal_write(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    Throughput of journaled calls with several records by ``INSERT ... RETURNING`` and legacy write path
+    (``INSERT`` + ``SELECT last_insert_rowid()`` in transaction)
+    """
+    calls = max(100, size // 10)
+    params = {f'field_{i}': i for i in range(4)}
+    result = {'calls': calls}
+    for name, write_path in (('legacy', patch('binp.journals.returning', lambda _: False)),
+                             ('returning', nullcontext())):
+        async with database() as db:
+            journal = Journals(db)
+
+            @journal(operation='bench')
+            async def call():
+                for i in range(3):
+                    await journal.record(f'record {i}', **(params if i % 2 == 0 else {}))
+
+            with write_path:
+                started = perf_counter()
+                for _ in range(calls):
+                    await call()
+                result[f'{name}.calls_per_sec'] = calls / (perf_counter() - started)
+    return result
+
+
+@benchmark
+async def record_latency(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    Latency distribution of record() with three fields
+    """
+    records = max(100, size // 10)
+    watch = Stopwatch()
+    async with database() as db:
+        journal = Journals(db)
+
+        @journal(operation='bench')
+        async def call():
+            for i in range(records):
+                with watch:
+                    await journal.record('step', index=i, name='bench', value=0.5)
+
+        await call()
+    return watch.stats()
+
+
+@benchmark
+async def journal_reads(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    Latency of history, search and get depending on number of journals
+    """
+    samples = max(10, min(100, size // 10))
+    result = {}
+    sizes = sorted({min(1000, size), min(10000, size), size})
+    for count in sizes:
+        rnd = Random(seed_value)
+        async with database() as db:
+            journals = await seed(db, count, seed_value)
+            watches = {name: Stopwatch() for name in ('history', 'history_deep', 'search_operation',
+                                                      'search_labels', 'get')}
+            for _ in range(samples):
+                with watches['history']:
+                    await journals.history(0, 20)
+                with watches['history_deep']:
+                    await journals.history(rnd.randrange(count), 20)
+                with watches['search_operation']:
+                    await journals.search(operation=rnd.choice(OPERATIONS))
+                with watches['search_labels']:
+                    await journals.search(labels=[rnd.choice(LABELS)], failed=False)
+                with watches['get']:
+                    await journals.get(rnd.randint(1, count))
+            for name, watch in watches.items():
+                metrics = watch.stats()
+                result[f'{count}.{name}.p50_ms'] = metrics['p50_ms']
+                result[f'{count}.{name}.p99_ms'] = metrics['p99_ms']
+    return result
+
+
+@benchmark
+async def journal_size(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    Database size per journal (with records and fields)
+    """
+    async with database() as db:
+        await seed(db, size, seed_value)
+        page_size = (await db.fetch_one('PRAGMA page_size'))[0]
+        pages = (await db.fetch_one('PRAGMA page_count'))[0]
+    return {'journals': size, 'pages': pages, 'bytes_per_journal': pages * page_size / size}
+
+
+@benchmark
+async def kv(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    KV set and get operations per second
+    """
+    operations = max(100, size // 10)
+    rnd = Random(seed_value)
+    keys = [f'key_{i}' for i in range(operations)]
+    async with database() as db:
+        storage = KV(db=db)
+        started = perf_counter()
+        for key in keys:
+            await storage.set(**{key: {'value': rnd.random(), 'name': key}})
+        set_elapsed = perf_counter() - started
+        rnd.shuffle(keys)
+        started = perf_counter()
+        for key in keys:
+            await storage.get(key)
+        get_elapsed = perf_counter() - started
+    return {'set_per_sec': operations / set_elapsed, 'get_per_sec': operations / get_elapsed}
+
+
+@benchmark
+async def task_queue(size: int, seed_value: int, workers: int = 8) -> Dict[str, float]:
+    """
+    Durable tasks: concurrent enqueues (ex: from parallel requests, saved by batches), sequential enqueues
+    and processing by pool of workers
+    """
+    count = max(100, size // 10)
+    rnd = Random(seed_value)
+    payloads = [{'id': i, 'value': rnd.random()} for i in range(count)]
+    async with database() as db:
+        services = Service()
+        # enqueue first, then measure processing of the backlog
+        services.standby()
+        tasks = Tasks(services=services, db=db)
+        processed = 0
+        done = Event()
+
+        @tasks(name='bench', workers=workers, poll_interval=0.1)
+        async def handle(payload):
+            nonlocal processed
+            processed += 1
+            if processed == count * 2:
+                done.set()
+
+        started = perf_counter()
+        await gather(*[handle.enqueue(payload) for payload in payloads])
+        concurrent_elapsed = perf_counter() - started
+        started = perf_counter()
+        for payload in payloads:
+            await handle.enqueue(payload)
+        sequential_elapsed = perf_counter() - started
+        started = perf_counter()
+        services.start('bench')
+        await wait_for(done.wait(), 600)
+        process_elapsed = perf_counter() - started
+        await services.shutdown()
+        await tasks.close()
+    return {
+        'tasks': count,
+        'enqueue_concurrent_per_sec': count / concurrent_elapsed,
+        'enqueue_sequential_per_sec': count / sequential_elapsed,
+        'process_per_sec': count * 2 / process_elapsed,
+    }
+
+
+@benchmark
+async def emitter_fanout(size: int, seed_value: int, subscribers: int = 1000) -> Dict[str, float]:
+    """
+    Delivery of events from one emitter to many subscribers (each subscriber is a separate task)
+    """
+    events = max(10, size // 1000)
+    emitter: Emitter[int] = Emitter()
+    received = []
+
+    async def subscriber(queue: Queue):
+        count = 0
+        while count < events:
+            await queue.get()
+            count += 1
+        received.append(count)
+
+    queues: List[Queue] = []
+    contexts = [emitter.subscribe() for _ in range(subscribers)]
+    for context in contexts:
+        queues.append(context.__enter__())
+    tasks = [get_event_loop().create_task(subscriber(queue)) for queue in queues]
+    started = perf_counter()
+    for i in range(events):
+        emitter.emit(i)
+    emit_elapsed = perf_counter() - started
+    await gather(*tasks)
+    elapsed = perf_counter() - started
+    for context in contexts:
+        context.__exit__(None, None, None)
+    deliveries = events * subscribers
+    return {
+        'subscribers': subscribers,
+        'events': events,
+        'emit_per_sec': events / emit_elapsed,
+        'deliveries_per_sec': deliveries / elapsed,
+        'lost': deliveries - sum(received),
+    }
+
+
+@benchmark
+async def keyed_fanout(size: int, seed_value: int, subscribers: int = 1000) -> Dict[str, float]:
+    """
+    Emitting events for random keys with many subscribers, each subscribed to own key
+    (ex: many opened journal views). Emit cost should not depend on number of subscribers.
+    """
+    events = max(100, size // 10)
+    rnd = Random(seed_value)
+    keys = [rnd.randrange(subscribers) for _ in range(events)]
+    emitter: Emitter[int] = Emitter()
+    contexts = [emitter.subscribe(key=key) for key in range(subscribers)]
+    queues: List[Queue] = [context.__enter__() for context in contexts]
+    started = perf_counter()
+    for key in keys:
+        emitter.emit(key)
+    elapsed = perf_counter() - started
+    received = sum(queue.qsize() for queue in queues)
+    for context in contexts:
+        context.__exit__(None, None, None)
+    return {
+        'subscribers': subscribers,
+        'events': events,
+        'emit_per_sec': events / elapsed,
+        'lost': events - received,
+    }
+
+
+@benchmark
+async def websocket_push(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    Journal updates pushed to websocket clients (/journals/updates) of internal API in-process
+    """
+    clients = max(5, min(50, size // 100))
+    calls = max(20, size // 500)
+    async with database() as db:
+        journal = Journals(db)
+        app = create_internal(journal, KV(db=db), Action(), Service())
+        sockets = [WebSocket(app, '/journals/updates') for _ in range(clients)]
+        for socket in sockets:
+            await socket.connect()
+
+        @journal(operation='bench')
+        async def call():
+            pass
+
+        # journal is updated twice: on start and on finish
+        expected = calls * 2
+
+        async def consume(socket: WebSocket) -> int:
+            count = 0
+            try:
+                while count < expected:
+                    await socket.receive_text(timeout=10)
+                    count += 1
+            except TimeoutError:
+                pass
+            return count
+
+        consumers = [get_event_loop().create_task(consume(socket)) for socket in sockets]
+        started = perf_counter()
+        for _ in range(calls):
+            await call()
+        received = await wait_for(gather(*consumers), 60)
+        elapsed = perf_counter() - started
+        # wake up idle handlers (as on shutdown)
+        journal.journal_updated.close()
+        await gather(*[socket.close() for socket in sockets])
+    return {
+        'clients': clients,
+        'calls': calls,
+        'pushes_per_sec': sum(received) / elapsed,
+        'lost': expected * clients - sum(received),
+    }
+
+
+@benchmark
+async def load(size: int, seed_value: int) -> Dict[str, float]:
+    """
+    Websocket clients and concurrent writers through internal API (see benchmarks.load)
+    """
+    return await load_test(LoadConfig(clients=max(5, min(100, size // 100)),
+                                      writers=max(2, min(10, size // 1000)),
+                                      duration=max(1.0, min(10.0, size / 2000))))
+
+
+async def run(names: List[str], size: int, seed_value: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name in names:
+        started = perf_counter()
+        results[name] = await BENCHMARKS[name](size, seed_value)
+        print(f'{name} ({perf_counter() - started:.1f}s)')
+        for metric, value in results[name].items():
+            print(f'    {metric:40} {value:14.3f}')
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='binp benchmarks')
+    parser.add_argument('--size', type=int, default=10000, help='dataset size (number of journals)')
+    parser.add_argument('--seed', type=int, default=42, help='seed for generated datasets')
+    parser.add_argument('--only', default='', help='comma-separated benchmarks: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--output', type=Path, help='save results as JSON')
+    parser.add_argument('--compare', type=Path, help='previous JSON results to compare with')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.only.split(',') if name.strip()] or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    results = get_event_loop().run_until_complete(run(names, args.size, args.seed))
+    if args.output is not None:
+        save_report(args.output, {'size': args.size, 'seed': args.seed}, results)
+    if args.compare is not None:
+        print('compared to', args.compare)
+        for line in compare(args.compare, results):
+            print('   ', line)
+
+
+if __name__ == '__main__':
+    main()
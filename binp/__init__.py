@@ -1,29 +1,147 @@
+from asyncio import wait_for, TimeoutError
 from dataclasses import dataclass, field
 from functools import cached_property
+from importlib import import_module
+from logging import getLogger
+from time import monotonic
+from typing import Optional, TYPE_CHECKING
 
-from fastapi import FastAPI
+from .db import close
 
-from .action import Action
-from .api import create_app
-from .journals import Journals
-from .kv import KV
-from .service import Service
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+
+    from .action import Action
+    from .api import create_app
+    from .cache import Cache
+    from .cluster import Cluster
+    from .journals import Journals
+    from .kv import KV
+    from .schedule import Schedule
+    from .service import Service
+    from .tasks import Tasks
+
+# public names are imported on first access to keep ``import binp`` cheap (FastAPI and others are heavy)
+_lazy = {
+    'Action': '.action',
+    'Cache': '.cache',
+    'create_app': '.api',
+    'Cluster': '.cluster',
+    'Journals': '.journals',
+    'KV': '.kv',
+    'Schedule': '.schedule',
+    'Service': '.service',
+    'Tasks': '.tasks',
+}
+
+
+def __getattr__(name: str):
+    module = _lazy.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+_load = __getattr__
+
+
+def _new(name: str, method: Optional[str] = None):
+    def factory():
+        value = _load(name)
+        return getattr(value, method)() if method else value()
+
+    return factory
 
 
 @dataclass(frozen=True)
 class BINP:
     #: Key-Value default storage
-    kv: KV = field(default_factory=KV)
+    kv: 'KV' = field(default_factory=_new('KV'))
     #: Journal for operation tracing
-    journal: Journals = field(default_factory=Journals)
+    journal: 'Journals' = field(default_factory=_new('Journals', 'from_env'))
     #: UI exposed actions (buttons)
-    action: Action = field(default_factory=Action)
+    action: 'Action' = field(default_factory=_new('Action'))
     #: Background services
-    service: Service = field(default_factory=Service)
+    service: 'Service' = field(default_factory=_new('Service'))
+    #: Maximum time (in seconds) for graceful shutdown
+    shutdown_timeout: float = 10
+    #: Multi-worker deployment support (by default enabled by CLUSTER=true environment variable)
+    cluster: Optional['Cluster'] = field(default_factory=_new('Cluster', 'from_env'))
+
+    def __post_init__(self):
+        if self.cluster is not None:
+            self.cluster.attach(self.service)
+
+    @cached_property
+    def schedule(self) -> 'Schedule':
+        """
+        Time-based jobs (cron or interval), journaled and exposed as services.
+        """
+        schedule = _load('Schedule')(self.journal, self.service)
+        if self.cluster is not None:
+            self.cluster.follow(schedule)
+        return schedule
 
     @cached_property
-    def app(self) -> FastAPI:
+    def task(self) -> 'Tasks':
+        """
+        Durable background tasks (saved to the default database), executed by pool of workers and journaled.
+        """
+        return _load('Tasks')(self.journal, self.service)
+
+    @cached_property
+    def cache(self) -> 'Cache':
+        """
+        Memoization of async functions results (optionally persisted to KV), exposed with statistics in internal API.
+        """
+        return _load('Cache')(self.kv)
+
+    @cached_property
+    def app(self) -> 'FastAPI':
+        """
+        Creates FastAPI applications and caches result. Startup and shutdown handlers are registered automatically.
+        """
+        app = _load('create_app')(self.journal, self.kv, self.action, self.service, caches=self.cache)
+        app.add_event_handler('startup', self.startup)
+        app.add_event_handler('shutdown', self.shutdown)
+        return app
+
+    async def startup(self):
+        """
+        Prepare databases of journals and KV storage before the first request (default database is connected
+        and migrated, custom databases are used as-is) and join cluster (if enabled).
+        """
+        await self.journal.database()
+        await self.kv.database()
+        if self.cluster is not None:
+            await self.cluster.start()
+
+    async def shutdown(self):
         """
-        Creates FastAPI applications and caches result.
+        Graceful shutdown: stops scheduler and services (in reverse order), drains background actions,
+        saves pending tasks, finishes pending journals, notifies subscribers, leaves cluster (if enabled)
+        and closes the default database.
+        All steps share ``shutdown_timeout``.
         """
-        return create_app(self.journal, self.kv, self.action, self.service)
+        logger = getLogger(self.__class__.__qualname__)
+        deadline = monotonic() + self.shutdown_timeout
+        if 'schedule' in self.__dict__:
+            self.schedule.stop()
+        await self.service.shutdown(max(0.0, deadline - monotonic()))
+        await self.action.drain(max(0.0, deadline - monotonic()))
+        if 'task' in self.__dict__:
+            try:
+                await wait_for(self.task.close(), max(0.0, deadline - monotonic()))
+            except TimeoutError:
+                logger.warning("pending tasks not saved in time")
+        await self.journal.close()
+        self.journal.journal_updated.close()
+        self.journal.record_added.close()
+        self.service.service_changed.close()
+        self.kv.key_changed.close()
+        if self.cluster is not None:
+            await self.cluster.stop()
+        await close()
+        logger.info("shutdown complete")
@@ -0,0 +1,76 @@
+"""
+Command line tools for journals maintenance. Database and blobs are defined by ``DB_URL``, ``BLOBS_DIR``
+and ``BLOB_THRESHOLD`` environment (as for application).
+
+    python -m binp export [--records] [--format ndjson|csv] [--gzip] > journals.ndjson
+    python -m binp import [--batch-size 1000] [--rebuild-indexes] journals.ndjson[.gz]
+
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from logging import basicConfig, INFO
+from sys import stdin, stdout
+from typing import AsyncIterator, BinaryIO
+
+from binp.db import close
+from binp.export import Format, serialize, parse_ndjson
+from binp.journals import Journals
+
+#: size of chunks to read from input
+READ_SIZE = 1024 * 1024
+
+
+async def read_chunks(source: BinaryIO) -> AsyncIterator[bytes]:
+    while True:
+        chunk = source.read(READ_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def import_journals(args):
+    source = stdin.buffer if args.file == '-' else open(args.file, 'rb')
+    try:
+        await Journals.from_env().load(parse_ndjson(read_chunks(source)), batch_size=args.batch_size,
+                              rebuild_indexes=args.rebuild_indexes)
+    finally:
+        source.close()
+
+
+async def export_journals(args):
+    journals = Journals.from_env().export(records=args.records)
+    async for chunk in serialize(journals, Format(args.format), args.gzip):
+        stdout.buffer.write(chunk)
+    stdout.buffer.flush()
+
+
+def main():
+    parser = ArgumentParser(prog='binp', description='journals maintenance')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('import', help='bulk import journals from NDJSON (plain or gzip)')
+    cmd.add_argument('file', help='source file, - for stdin')
+    cmd.add_argument('--batch-size', type=int, default=1000, help='journals per transaction')
+    cmd.add_argument('--rebuild-indexes', action='store_true', help='drop indexes before import and create after')
+    cmd.set_defaults(handler=import_journals)
+
+    cmd = commands.add_parser('export', help='export journals to stdout')
+    cmd.add_argument('--format', choices=[x.value for x in Format], default=Format.ndjson.value)
+    cmd.add_argument('--records', action='store_true', help='include records')
+    cmd.add_argument('--gzip', action='store_true', help='compress output')
+    cmd.set_defaults(handler=export_journals)
+
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+
+    async def run():
+        try:
+            await args.handler(args)
+        finally:
+            await close()
+
+    get_event_loop().run_until_complete(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,141 @@
-from dataclasses import dataclass
+from asyncio import Semaphore, Future, Task, get_event_loop, shield, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from inspect import signature, Parameter
 from logging import getLogger
-from typing import List, Callable, Awaitable, Optional, Dict
+from typing import List, Callable, Awaitable, Optional, Dict, Set, Tuple, Type, Any, Mapping, Union
 
+from pydantic import Extra, create_model
 from pydantic.main import BaseModel
 
+from binp.journals import journal_opened
+
+
+class ActionBusy(RuntimeError):
+    """
+    Action has no free execution slots and the wait queue is full
+    """
+
+
+# base class for action input models built from handler signature (no doc-string to keep schema clean)
+class ActionParams(BaseModel):
+    class Config:
+        extra = Extra.forbid
+
+
+def params_model(name: str, fn: Callable[..., Awaitable]) -> Type[ActionParams]:
+    """
+    Build pydantic model from function signature. Each argument will become model field with the same
+    annotation (or Any) and default value (or required).
+
+    Arguments which can't be model fields (private names or names of model attributes, ex: ``json``)
+    are rejected by ValueError.
+    """
+    fields: Dict[str, Any] = {}
+    for param in signature(fn).parameters.values():
+        if param.kind in (Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD):
+            continue
+        if param.name.startswith('_'):
+            raise ValueError(f'argument {param.name!r} of action {name}: names starting with underscore '
+                             f'are not supported')
+        if hasattr(ActionParams, param.name):
+            raise ValueError(f'argument {param.name!r} of action {name}: name is reserved by pydantic model')
+        annotation = Any if param.annotation is Parameter.empty else param.annotation
+        default = ... if param.default is Parameter.empty else param.default
+        fields[param.name] = (annotation, default)
+    return create_model(name, __base__=ActionParams, **fields)
+
 
 @dataclass
 class ActionHandler:
     name: str
     description: str
-    handler: Callable[[], Awaitable]
+    handler: Callable[..., Awaitable]
+    #: input model of handler
+    params: Type[ActionParams] = ActionParams
+    #: maximum number of parallel executions (None - unlimited)
+    max_concurrency: Optional[int] = None
+    #: share in-flight execution with concurrent callers with same arguments
+    single_flight: bool = False
+    #: maximum number of callers waiting for a free slot (None - unlimited)
+    queue_size: Optional[int] = None
+    waiting: int = 0
+    slots: Optional[Semaphore] = field(default=None, repr=False)
+    inflight: Dict[str, Future] = field(default_factory=dict, repr=False)
+    #: JSON schema of input model or None if handler has no arguments
+    schema: Optional[Dict[str, Any]] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.params.__fields__:
+            self.schema = self.params.schema()
+
+    def parse(self, values: Union[Mapping[str, Any], ActionParams, None] = None) -> ActionParams:
+        """
+        Validate raw arguments (already validated arguments are returned as-is). Raises pydantic ValidationError.
+        """
+        if isinstance(values, self.params):
+            return values
+        return self.params.parse_obj(values or {})
+
+    def saturated(self, args: ActionParams) -> bool:
+        """
+        New invocation will not start immediately: it will wait for a free slot or join in-flight execution.
+        """
+        if self.single_flight and self.__key(args) in self.inflight:
+            return True
+        return self.slots is not None and self.slots.locked()
 
-    async def __call__(self):
-        return await self.handler()
+    def full(self, args: ActionParams) -> bool:
+        """
+        New invocation will be rejected: no free slots and wait queue is full.
+        """
+        if self.single_flight and self.__key(args) in self.inflight:
+            return False
+        return self.slots is not None and self.slots.locked() and \
+            self.queue_size is not None and self.waiting >= self.queue_size
+
+    async def __call__(self, args: Optional[ActionParams] = None):
+        if args is None:
+            args = self.parse()
+        if not self.single_flight:
+            return await self.__run(args)
+        key = self.__key(args)
+        task = self.inflight.get(key)
+        if task is None:
+            task = get_event_loop().create_task(self.__run(args))
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+            self.inflight[key] = task
+        # shield shared execution from cancellation of a single caller
+        return await shield(task)
+
+    async def __run(self, args: ActionParams):
+        kwargs = {name: getattr(args, name) for name in args.__fields__}
+        if self.max_concurrency is None:
+            return await self.handler(**kwargs)
+        if self.slots is None:
+            # created on first use: before Python 3.10 semaphore is bound to the loop at creation time
+            self.slots = Semaphore(self.max_concurrency)
+        if self.slots.locked() and self.queue_size is not None and self.waiting >= self.queue_size:
+            raise ActionBusy(f'action {self.name} is busy')
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            return await self.handler(**kwargs)
+        finally:
+            self.slots.release()
+
+    @staticmethod
+    def __key(args: ActionParams) -> str:
+        return args.json(sort_keys=True)
 
 
 class ActionInfo(BaseModel):
     name: str
     description: str
+    #: JSON schema of action arguments (None if action has no arguments)
+    parameters: Optional[Dict[str, Any]] = None
 
 
 class Action:
@@ -64,6 +182,55 @@ class Action:
            await sleep(3)
            print("done")
 
+    :Concurrency:
+
+    By default, each invocation starts a new copy of the action. Expensive actions could be limited:
+
+    * ``max_concurrency`` - maximum number of parallel executions, others are waiting in a queue;
+    * ``queue_size`` - maximum number of waiting invocations, others are rejected by ``ActionBusy`` (HTTP 429);
+    * ``single_flight`` - concurrent invocations share the same in-flight execution and result.
+
+    .. code-block:: python
+
+       from binp import BINP
+       from asyncio import sleep
+
+       binp = BINP()
+
+       @binp.action(single_flight=True)
+       async def refresh():
+           await sleep(3)
+
+       @binp.action(max_concurrency=2, queue_size=10)
+       @binp.journal
+       async def rebuild():
+           await sleep(30)
+
+    :Arguments:
+
+    Action could declare arguments: input model is built from the function signature once, at
+    registration time. Arguments are validated by pydantic before invocation and JSON schema
+    is exposed in ``ActionInfo.parameters``, so one parametric action could replace several variants.
+
+    .. code-block:: python
+
+       from binp import BINP
+
+       binp = BINP()
+
+       @binp.action
+       @binp.journal
+       async def deploy(target: str, force: bool = False):
+           print("deploying to", target)
+
+       # from code
+       await binp.action.invoke(deploy.__qualname__, {'target': 'staging'})
+
+    Arguments without annotations are accepted as-is (``Any``). Unknown arguments are rejected.
+    Argument names starting with underscore or used by pydantic models (ex: ``json``) are not allowed.
+
+    Action could be started in background by ``submit``: it returns as soon as the action
+    opened a journal (if it is journaled), so long-running actions are not holding the caller.
 
     :Conflicts:
 
@@ -72,14 +239,22 @@ class Action:
 
     def __init__(self):
         self.__actions: Dict[str, ActionHandler] = {}
+        self.__background: Set[Task] = set()
 
-    def __call__(self, func: Optional[Callable[[], Awaitable]] = None, *, name: Optional[str] = None,
-                 description: Optional[str] = None):
+    def __call__(self, func: Optional[Callable[..., Awaitable]] = None, *, name: Optional[str] = None,
+                 description: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 single_flight: bool = False,
+                 queue_size: Optional[int] = None):
         """
         Decorator that expose function as an action in UI (ex: button)
         """
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError('max_concurrency should be positive')
+        if queue_size is not None and queue_size < 0:
+            raise ValueError('queue_size should not be negative')
 
-        def trace_operation(fn: Callable[[], Awaitable]):
+        def trace_operation(fn: Callable[..., Awaitable]):
             nonlocal name
             nonlocal description
 
@@ -91,7 +266,11 @@ class Action:
                 old = self.__actions[name]
                 getLogger(self.__class__.__qualname__).warning("redefining UI action %r: %s => %s", name,
                                                                old.handler.__qualname__, fn.__qualname__)
-            self.__actions[name] = ActionHandler(name=name, description=description, handler=fn)
+            self.__actions[name] = ActionHandler(name=name, description=description, handler=fn,
+                                                 params=params_model(fn.__name__, fn),
+                                                 max_concurrency=max_concurrency,
+                                                 single_flight=single_flight,
+                                                 queue_size=queue_size)
 
             return fn
 
@@ -99,23 +278,111 @@ class Action:
             return trace_operation
         return trace_operation(func)
 
-    async def invoke(self, name: str) -> bool:
+    def validate(self, name: str, params: Optional[Mapping[str, Any]] = None) -> Optional[ActionParams]:
+        """
+        Validate arguments of action without invoking it. Validated arguments could be passed to ``invoke``
+        or ``submit`` as params.
+
+        :param name: action name
+        :param params: action arguments (raises pydantic ValidationError if they are not valid)
+        :return: validated arguments or None if action not found
+        """
+        handler = self.__actions.get(name)
+        if handler is None:
+            return None
+        return handler.parse(params)
+
+    async def invoke(self, name: str, params: Union[Mapping[str, Any], ActionParams, None] = None) -> bool:
         """
         Invoke action by name or ignore. If handler will raise an error, the error will NOT be suppressed.
+        Concurrency limits of the action are respected: the call may wait for a free slot or
+        raise ``ActionBusy`` if the wait queue is full.
 
         :param name: action name
+        :param params: action arguments, validated by action input model (raises pydantic ValidationError),
+                       or arguments returned by ``validate``
         :return: true if action invoked
         """
         handler = self.__actions.get(name)
         if handler is None:
             getLogger(self.__class__.__qualname__).warning("attempt to invoke unknown action %r", name)
             return False
-        await handler()
+        await handler(handler.parse(params))
         return True
 
+    async def submit(self, name: str, params: Union[Mapping[str, Any], ActionParams, None] = None) \
+            -> Tuple[bool, Optional[int]]:
+        """
+        Invoke action by name in background (fire-and-forget).
+
+        Returns as soon as the action opened a journal or finished. If action has to wait for a free slot
+        (or joins in-flight execution) it returns immediately without journal ID. Errors raised
+        in the background are reported to log, except ``ActionBusy`` which is raised to the caller.
+
+        :param name: action name
+        :param params: action arguments, validated by action input model (raises pydantic ValidationError),
+                       or arguments returned by ``validate``
+        :return: pair of flag (true if action found) and ID of the journal opened by action (if any)
+        """
+        handler = self.__actions.get(name)
+        if handler is None:
+            getLogger(self.__class__.__qualname__).warning("attempt to invoke unknown action %r", name)
+            return False, None
+        args = handler.parse(params)
+        if handler.full(args):
+            raise ActionBusy(f'action {name} is busy')
+
+        loop = get_event_loop()
+        opened: Future = loop.create_future()
+
+        def notify(journal_id: int):
+            if not opened.done():
+                opened.set_result(journal_id)
+
+        async def run():
+            journal_opened.set(notify)
+            return await handler(args)
+
+        queued = handler.saturated(args)
+        task = loop.create_task(run())
+        self.__background.add(task)
+        task.add_done_callback(self.__forget)
+        if queued:
+            return True, None
+        await wait({opened, task}, return_when=FIRST_COMPLETED)
+        if opened.done():
+            return True, opened.result()
+        opened.cancel()
+        return True, None
+
+    async def drain(self, timeout: float = 10):
+        """
+        Wait for background actions to complete (ex: on shutdown). Actions still running after timeout are cancelled.
+
+        :param timeout: maximum time (in seconds) to wait
+        """
+        if not self.__background:
+            return
+        _, pending = await wait(set(self.__background), timeout=timeout)
+        if not pending:
+            return
+        getLogger(self.__class__.__qualname__).warning("cancelling %d background actions", len(pending))
+        for task in pending:
+            task.cancel()
+        await wait(pending)
+
     @property
     def actions(self) -> List[ActionInfo]:
         """
         Copy of list of defined actions prepared for serialization.
         """
-        return [ActionInfo(name=x.name, description=x.description) for x in self.__actions.values()]
+        return [ActionInfo(name=x.name, description=x.description, parameters=x.schema)
+                for x in self.__actions.values()]
+
+    def __forget(self, task: Task):
+        self.__background.discard(task)
+        if task.cancelled():
+            return
+        ex = task.exception()
+        if ex is not None:
+            getLogger(self.__class__.__qualname__).warning("background action failed: %s", ex, exc_info=ex)
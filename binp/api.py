@@ -1,27 +1,46 @@
-from asyncio import Queue
+from asyncio import Queue, wait_for, wait, ensure_future, TimeoutError, FIRST_COMPLETED
+from contextlib import ExitStack
 from os import getenv
 from pathlib import Path
 from time import monotonic
-from typing import List, Optional
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Callable, AsyncIterator
+from uuid import uuid4
 
-from fastapi import FastAPI, HTTPException, Response, WebSocket
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Response, WebSocket, Body, Query as Parameter, Request, Header
+from fastapi.responses import StreamingResponse, FileResponse
+from pydantic import ValidationError
+from starlette.types import ASGIApp
 from pydantic.main import BaseModel
 from websockets import ConnectionClosed
 
-from binp.action import ActionInfo, Action
-from binp.journals import Headline, Journal, Journals
+from binp.action import ActionInfo, Action, ActionBusy
+from binp.assets import IMMUTABLE
+from binp.cache import Cache, CacheInfo
+from binp.events import Emitter, EventsLost
+from binp.export import Format, serialize, parse_ndjson
+from binp.journals import Headline, Journal, Journals, ImportStats, OperationStats
 from binp.kv import KV
 from binp.service import Info, Service
+from binp.stream import Stream
+
+
+#: unique for the process: versions of journals and services are valid only within the process
+_INSTANCE = uuid4().hex[:8]
+#: interval (in seconds) of keep-alive comments in server-sent events
+KEEPALIVE = 15
 
 
 class InvokeResult(BaseModel):
     name: str
     duration: float
+    #: journal opened by action (only for background invocations)
+    journal_id: Optional[int] = None
 
 
 class ServiceControl(BaseModel):
-    running: bool
+    running: Optional[bool] = None
+    paused: Optional[bool] = None
 
 
 class Query(BaseModel):
@@ -31,8 +50,170 @@ class Query(BaseModel):
     labels: Optional[List[str]] = None
 
 
-def create_app(journals: Journals, kv: KV, actions: Action, services: Service, page_limit: int = 20) -> FastAPI:
+class DeferredApp:
+    """
+    ASGI application constructed on the first call
+    """
+
+    def __init__(self, factory: Callable[[], ASGIApp]):
+        self.__factory = factory
+        self.__app: Optional[ASGIApp] = None
+
+    async def __call__(self, scope, receive, send):
+        if self.__app is None:
+            self.__app = self.__factory()
+        await self.__app(scope, receive, send)
+
+
+def _allow_dev_origins(app: FastAPI):
+    from fastapi.middleware.cors import CORSMiddleware
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost",
+            "http://localhost:8000",
+            "http://localhost:5000",
+            "http://127.0.0.1:5000",
+        ],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
+def _not_modified(request: Request, response: Response, version: str) -> Optional[Response]:
+    """
+    Set ETag of the content version. Returns 304 (Not Modified) response if the client already has the version.
+    """
+    etag = f'"{_INSTANCE}-{version}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    response.headers.update(headers)
+    known = request.headers.get('if-none-match')
+    if known is None:
+        return None
+    tags = [tag.strip() for tag in known.split(',')]
+    if etag in tags or 'W/' + etag in tags:
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def _parse_event_id(event_id: Optional[str], size: int) -> Optional[List[int]]:
+    # event ID is an instance and sequence numbers of emitters: <instance>.<seq>[.<seq>...]
+    if not event_id:
+        return None
+    instance, *sequences = event_id.split('.')
+    if instance != _INSTANCE or len(sequences) != size or not all(seq.isdigit() for seq in sequences):
+        return []
+    return [int(seq) for seq in sequences]
+
+
+async def _journal_events(journals: Journals, emitters: List[Emitter[int]], last_event_id: Optional[str],
+                          journal_id: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Server-sent events with current state of updated journals. Events missed since ``last_event_id``
+    are replayed (each journal is sent once in the latest state). If they are not available anymore (or the server
+    was restarted), ``reset`` event is sent first: client should reload everything.
+    """
+    cursor = _parse_event_id(last_event_id, len(emitters))
+    queue: Queue = Queue()
+    with ExitStack() as stack:
+        try:
+            for emitter, after in zip(emitters, cursor or [None] * len(emitters)):
+                stack.enter_context(emitter.resume(after, queue, journal_id))
+        except EventsLost:
+            cursor = []
+        if cursor == []:
+            stack.close()
+            queue = Queue()
+            for emitter in emitters:
+                stack.enter_context(emitter.resume(None, queue, journal_id))
+        positions = cursor or [emitter.version for emitter in emitters]
+        yield 'retry: 3000\n\n'
+        if cursor == []:
+            yield f'id: {".".join([_INSTANCE, *map(str, positions)])}\nevent: reset\ndata: {{}}\n\n'
+        while True:
+            try:
+                events = [await wait_for(queue.get(), KEEPALIVE)]
+            except TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            # coalesce burst of events: only the latest state of each journal is sent
+            while not queue.empty():
+                events.append(queue.get_nowait())
+            if None in events:
+                return
+            for event in events:
+                positions[emitters.index(event.emitter)] = event.sequence
+            event_id = '.'.join([_INSTANCE, *map(str, positions)])
+            for updated_id in dict.fromkeys(event.payload for event in events):
+                journal = await journals.get(updated_id)
+                if journal is not None:
+                    yield f'id: {event_id}\nevent: journal\ndata: {journal.json()}\n\n'
+
+
+class _EventStream(StreamingResponse):
+    """
+    Server-sent events response. Stream is stopped as soon as client disconnected.
+    """
+
+    media_type = 'text/event-stream'
+
+    def __init__(self, content: AsyncIterator[str]):
+        super().__init__(content, headers={'Cache-Control': 'no-cache'})
+
+    async def __call__(self, scope, receive, send) -> None:
+        # starlette (before 0.14) passes coroutines to asyncio.wait which is not allowed since Python 3.11
+        tasks = [ensure_future(self.stream_response(send)), ensure_future(self.listen_for_disconnect(receive))]
+        try:
+            done, _ = await wait(tasks, return_when=FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            task.result()
+
+
+def create_app(journals: Journals, kv: KV, actions: Action, services: Service, page_limit: int = 20,
+               caches: Optional[Cache] = None) -> FastAPI:
+    """
+    Create application with UI and internal API. Internal API will be constructed on the first request.
+    """
+    static_dir = Path(__file__).absolute().parent / "static"
+    app = FastAPI(title='BINP', description='User defined APIs. See internal APIs <a href="internal/redoc">here</a>')
+    compress_min_size = int(getenv('COMPRESS_MIN_SIZE', '1024'))
+    if compress_min_size >= 0:
+        from binp.compression import CompressionMiddleware
+
+        app.add_middleware(CompressionMiddleware, minimum_size=compress_min_size)
+    if getenv('DEV', '') == 'true':
+        _allow_dev_origins(app)
+    else:
+        @app.get("/")
+        async def main_page_redirect():
+            """
+            Redirects to UI
+            """
+            return Response(status_code=302, headers={
+                'Location': 'static/index.html#/'
+            })
+
+        from binp.assets import StaticAssets
+
+        app.mount("/static", StaticAssets(directory=str(static_dir)), name="static")
+    app.mount('/internal/', DeferredApp(lambda: create_internal(journals, kv, actions, services, page_limit,
+                                                                   caches)))
+    return app
+
+
+def create_internal(journals: Journals, kv: KV, actions: Action, services: Service,
+                    page_limit: int = 20, caches: Optional[Cache] = None) -> FastAPI:
+    """
+    Create internal API application (used by UI)
+    """
     internal = FastAPI(title='BINP', description='Internal APIs')
+    caches = caches or Cache()
+    multiplexer = Stream(journals, kv, services)
 
     @internal.get('/actions/', operation_id='listActions', response_model=List[ActionInfo])
     async def list_actions():
@@ -42,22 +223,43 @@ def create_app(journals: Journals, kv: KV, actions: Action, services: Service, p
         return actions.actions
 
     @internal.post('/action/{name}', operation_id='invokeAction', response_model=InvokeResult)
-    async def invoke_action(name: str):
+    async def invoke_action(name: str, background: bool = False, params: Optional[Dict[str, Any]] = Body(None)):
         """
-        Invoke custom action (methods annotated by @action)
+        Invoke custom action (methods annotated by @action). Arguments (if any) should be passed as JSON object
+        in the body and will be validated against action parameters schema.
+
+        In background mode the request returns as soon as action opened journal, without waiting for completion.
+        Returns 429 if action has no free slots and the wait queue is full.
         """
         a = monotonic()
-        executed = await actions.invoke(name)
+        journal_id = None
+        # only input is validated here: validation errors raised by action itself are internal errors
+        try:
+            args = actions.validate(name, params)
+        except ValidationError as ex:
+            raise HTTPException(status_code=422, detail=ex.errors())
+        if args is None:
+            raise HTTPException(status_code=404, detail=f'action {name} not found')
+        try:
+            if background:
+                executed, journal_id = await actions.submit(name, args)
+            else:
+                executed = await actions.invoke(name, args)
+        except ActionBusy as ex:
+            raise HTTPException(status_code=429, detail=str(ex))
         b = monotonic()
         if not executed:
             raise HTTPException(status_code=404, detail=f'action {name} not found')
-        return InvokeResult(name=name, duration=b - a)
+        return InvokeResult(name=name, duration=b - a, journal_id=journal_id)
 
     @internal.get("/journals/", operation_id='listJournals', response_model=List[Headline])
-    async def list_journals(page: int = 0):
+    async def list_journals(request: Request, response: Response, page: int = 0):
         """
-        List journal records in reverse order
+        List journal records in reverse order. Supports conditional requests (ETag).
         """
+        not_modified = _not_modified(request, response, journals.version())
+        if not_modified is not None:
+            return not_modified
         return await journals.history(page * page_limit)
 
     @internal.post("/journals/search", operation_id='searchJournals', response_model=List[Headline])
@@ -67,6 +269,46 @@ def create_app(journals: Journals, kv: KV, actions: Action, services: Service, p
         """
         return await journals.search(**query.__dict__, offset=page * page_limit, limit=page_limit)
 
+    @internal.get("/journals/operations", operation_id='listOperations', response_model=List[OperationStats])
+    async def list_operations():
+        """
+        Statistics of journaled operations: number of calls (including not sampled), failures and duration
+        """
+        return journals.operations
+
+    @internal.get("/journals/export", operation_id='exportJournals')
+    async def export_journals(format: Format = Format.ndjson,
+                              records: bool = False,
+                              gzip: bool = False,
+                              operation: Optional[str] = None,
+                              failed: Optional[bool] = None,
+                              pending: Optional[bool] = None,
+                              labels: Optional[List[str]] = Parameter(None),
+                              since: Optional[datetime] = None,
+                              after: int = 0):
+        """
+        Stream all matched journals (oldest first) as NDJSON or CSV file, optionally with records and gzip compressed.
+        To continue export, pass ID of the last exported journal as ``after``.
+        """
+        journals_stream = journals.export(operation=operation, failed=failed, pending=pending, labels=labels,
+                                          since=since, after=after, records=records)
+        filename = f'journals.{format.value}' + ('.gz' if gzip else '')
+        return StreamingResponse(serialize(journals_stream, format, gzip),
+                                 media_type='application/gzip' if gzip else format.media_type,
+                                 headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+    @internal.post("/journals/import", operation_id='importJournals', response_model=ImportStats)
+    async def import_journals(request: Request, batch_size: int = 1000, rebuild_indexes: bool = False):
+        """
+        Bulk import of journals from NDJSON body (as produced by export, plain or gzip compressed).
+        Imported journals get new IDs.
+        """
+        try:
+            return await journals.load(parse_ndjson(request.stream()), batch_size=batch_size,
+                                       rebuild_indexes=rebuild_indexes)
+        except (ValueError, ValidationError) as ex:
+            raise HTTPException(status_code=422, detail=str(ex))
+
     @internal.websocket("/journals/updates")
     async def notify_journals_updates(websocket: WebSocket):
         """
@@ -76,22 +318,47 @@ def create_app(journals: Journals, kv: KV, actions: Action, services: Service, p
         with journals.journal_updated.subscribe() as queue:
             while True:
                 journal_id = await queue.get()
+                if journal_id is None:
+                    await websocket.close(code=1001)
+                    break
                 journal = await journals.get(journal_id)
                 try:
                     await websocket.send_text(journal.json())
                 except ConnectionClosed:
                     break
 
+    @internal.get("/journals/events", operation_id='streamJournalsEvents')
+    async def stream_journals_events(last_event_id: Optional[str] = Header(None)):
+        """
+        Stream all journals updates as server-sent events (``journal`` event with journal as data).
+        Reconnected clients (with ``Last-Event-ID`` header) receive journals updated while they were disconnected.
+        If missed events are not available, ``reset`` event is sent first - client should reload journals.
+        """
+        return _EventStream(_journal_events(journals, [journals.journal_updated], last_event_id))
+
     @internal.get("/journal/{journal_id}", operation_id='getJournal', response_model=Journal)
-    async def get_journal(journal_id: int):
+    async def get_journal(journal_id: int, request: Request, response: Response):
         """
-        Get single journal record by ID. If no record found - 404 returned.
+        Get single journal record by ID. If no record found - 404 returned. Supports conditional requests (ETag).
         """
+        not_modified = _not_modified(request, response, journals.version(journal_id))
+        if not_modified is not None:
+            return not_modified
         res = await journals.get(journal_id)
         if res is None:
             raise HTTPException(status_code=404, detail=f'journal {journal_id} not found')
         return res
 
+    @internal.get("/blob/{digest}", operation_id='getBlob')
+    async def get_blob(digest: str):
+        """
+        Get content of large record field (JSON) by reference. Blobs are immutable and cached by clients forever.
+        """
+        path = journals.blobs.path(digest) if journals.blobs is not None else None
+        if path is None:
+            raise HTTPException(status_code=404, detail=f'blob {digest} not found')
+        return FileResponse(path, media_type='application/json', headers={'Cache-Control': IMMUTABLE})
+
     @internal.websocket("/journal/{journal_id}/updates")
     async def notify_journal_updates(journal_id: int, websocket: WebSocket):
         """
@@ -99,22 +366,34 @@ def create_app(journals: Journals, kv: KV, actions: Action, services: Service, p
         """
         await websocket.accept()
         queue: Queue[int] = Queue()
-        with journals.record_added.subscribe(queue), journals.journal_updated.subscribe(queue):
+        with journals.record_added.subscribe(queue, journal_id), journals.journal_updated.subscribe(queue, journal_id):
             while True:
                 event_journal_id = await queue.get()
-                if event_journal_id != journal_id:
-                    continue
+                if event_journal_id is None:
+                    await websocket.close(code=1001)
+                    break
                 journal = await journals.get(journal_id)
                 try:
                     await websocket.send_text(journal.json())
                 except ConnectionClosed:
                     break
 
+    @internal.get("/journal/{journal_id}/events", operation_id='streamJournalEvents')
+    async def stream_journal_events(journal_id: int, last_event_id: Optional[str] = Header(None)):
+        """
+        Stream single journal updates (including new records) as server-sent events. Resumable as journals events.
+        """
+        return _EventStream(_journal_events(journals, [journals.journal_updated, journals.record_added],
+                                            last_event_id, journal_id))
+
     @internal.get("/services/", operation_id='listServices', response_model=List[Info])
-    async def list_services():
+    async def list_services(request: Request, response: Response):
         """
-        List all defined services
+        List all defined services. Supports conditional requests (ETag).
         """
+        not_modified = _not_modified(request, response, str(services.service_changed.version))
+        if not_modified is not None:
+            return not_modified
         return services.services
 
     @internal.websocket("/services/updates")
@@ -126,55 +405,55 @@ def create_app(journals: Journals, kv: KV, actions: Action, services: Service, p
         with services.service_changed.subscribe() as queue:
             while True:
                 update = await queue.get()
+                if update is None:
+                    await websocket.close(code=1001)
+                    break
                 try:
                     await websocket.send_text(update.json())
                 except ConnectionClosed:
                     break
 
+    @internal.websocket("/stream")
+    async def stream(websocket: WebSocket):
+        """
+        Multiplexed subscriptions (journals, single journal, services, KV namespace) over single websocket.
+        See ``binp.stream.Stream`` for protocol.
+        """
+        await multiplexer(websocket)
+
     @internal.put("/service/{name}", operation_id='manageService')
     async def manage_service(name: str, control: ServiceControl):
+        """
+        Start or stop service, pause or resume planned runs of scheduled service. Omitted fields are not changed.
+        In multi-worker deployment services are running only in the leader process:
+        other workers return 409, the request should be retried (ex: by another connection).
+        """
+        if services.is_standby:
+            raise HTTPException(status_code=409, detail='services are managed by another worker (leader)')
+        if control.paused is not None:
+            services.pause(name, control.paused)
+        if control.running is None:
+            return
         if control.running:
             services.start(name)
         else:
             services.stop(name)
 
-    static_dir = Path(__file__).absolute().parent / "static"
-    app = FastAPI(title='BINP', description='User defined APIs. See internal APIs <a href="internal/redoc">here</a>')
-    if getenv('DEV', '') == 'true':
-        from fastapi.middleware.cors import CORSMiddleware
+    @internal.get("/caches/", operation_id='listCaches', response_model=List[CacheInfo])
+    async def list_caches():
+        """
+        List cached functions with hits and misses
+        """
+        return caches.caches
 
-        origins = [
-            "http://localhost",
-            "http://localhost:8000",
-            "http://localhost:5000",
-            "http://127.0.0.1:5000",
-        ]
-
-        app.add_middleware(
-            CORSMiddleware,
-            allow_origins=origins,
-            allow_credentials=True,
-            allow_methods=["*"],
-            allow_headers=["*"],
-        )
-
-        internal.add_middleware(
-            CORSMiddleware,
-            allow_origins=origins,
-            allow_credentials=True,
-            allow_methods=["*"],
-            allow_headers=["*"],
-        )
-    else:
-        @app.get("/")
-        async def main_page_redirect():
-            """
-            Redirects to UI
-            """
-            return Response(status_code=302, headers={
-                'Location': 'static/index.html#/'
-            })
+    @internal.delete("/cache/{name}", operation_id='clearCache')
+    async def clear_cache(name: str):
+        """
+        Remove all cached results of function (including persisted)
+        """
+        if not await caches.clear(name):
+            raise HTTPException(status_code=404, detail=f'cache {name} not found')
 
-        app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
-    app.mount('/internal/', internal)
-    return app
+    if getenv('DEV', '') == 'true':
+        _allow_dev_origins(internal)
+    return internal
@@ -0,0 +1,282 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from logging import getLogger
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Mapping, Collection, TYPE_CHECKING
+
+from binp.db import ensure, migrate, timestamp
+
+if TYPE_CHECKING:
+    from databases import Database
+
+#: prefix of partition file name, full name is ``journal-YYYY-MM.db``
+PREFIX = 'journal-'
+#: tables of interned strings and columns referencing them
+INTERNED = {
+    'operation_name': ('journal', 'operation_id'),
+    'operation_description': ('journal', 'description_id'),
+    'field_name': ('record_field', 'name_id'),
+}
+
+
+@dataclass
+class Partition:
+    #: month in format YYYY-MM
+    name: str
+    #: partition file
+    path: Path
+    #: connection to partition database
+    db: 'Database'
+    #: number of journals
+    journals: int
+    #: minimal journal ID
+    min_id: Optional[int]
+    #: maximum journal ID
+    max_id: Optional[int]
+
+    def contains(self, journal_id: int) -> bool:
+        return self.min_id is not None and self.min_id <= journal_id <= self.max_id
+
+
+class Archive:
+    """
+    Monthly partitions of journals in separate SQLite files (``journal-YYYY-MM.db`` in the archive directory).
+
+    New journals are always written to the current database. ``rotate()`` moves finished journals
+    (with labels, records and fields) older than ``keep`` months to the partition of the month
+    they were started in. Journal IDs are preserved, so links to journals stay valid.
+    Journals with archive are reading partitions transparently: newest first, stopping once the page is full.
+
+    Partitions are not modified after the month was rotated, so they could be backed up, compressed
+    or removed independently. Removing a partition (``drop()``) is just removing a file.
+
+    .. code-block:: python
+
+       from pathlib import Path
+       from binp import BINP
+       from binp.archive import Archive
+       from binp.journals import Journals
+
+       archive = Archive(Path('archive'), keep=3)
+       binp = BINP(journal=Journals(archive=archive))
+
+       @binp.schedule(cron='@daily', journal=False)
+       async def rotate_journals():
+           await archive.rotate()
+
+    """
+
+    def __init__(self, directory: Path, db: Optional['Database'] = None, keep: int = 1, batch_size: int = 500):
+        """
+        :param directory: directory for partition files (will be created if needed)
+        :param db: current database, default database will be used if not set
+        :param keep: number of months (including current) to keep in current database
+        :param batch_size: number of journals moved in one transaction
+        """
+        if keep < 1:
+            raise ValueError('at least current month should be kept')
+        self.__directory = directory
+        self.__db = ensure(db)
+        self.__keep = keep
+        self.__batch_size = batch_size
+        self.__partitions: Dict[str, Partition] = {}
+        #: incremented each time a partition is removed (journals from the partition are gone)
+        self.generation = 0
+
+    def partitions(self) -> List[str]:
+        """
+        Names (YYYY-MM) of available partitions, newest first
+        """
+        if not self.__directory.exists():
+            return []
+        names = [file.stem[len(PREFIX):] for file in self.__directory.glob(PREFIX + '*.db')]
+        return sorted(names, reverse=True)
+
+    async def open(self, name: str) -> Partition:
+        """
+        Open (or create) partition by name (YYYY-MM). Connections are cached.
+        """
+        partition = self.__partitions.get(name)
+        if partition is not None:
+            return partition
+        from databases import Database
+
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        path = self.__directory / f'{PREFIX}{name}.db'
+        db = Database(f'sqlite:///{path}')
+        await db.connect()
+        online = await migrate(db)
+        if online is not None:
+            await online
+        await self.__adopt_interned(db)
+        row = await db.fetch_one('SELECT count(*), min(id), max(id) FROM journal')
+        partition = Partition(name=name, path=path, db=db, journals=row[0], min_id=row[1], max_id=row[2])
+        self.__partitions[name] = partition
+        return partition
+
+    async def find(self, journal_id: int) -> Optional[Partition]:
+        """
+        Find partition containing journal
+        """
+        for name in self.partitions():
+            partition = await self.open(name)
+            if partition.contains(journal_id):
+                return partition
+        return None
+
+    async def rotate(self, now: Optional[datetime] = None) -> int:
+        """
+        Move finished journals older than ``keep`` months to partitions.
+        Safe to interrupt: journals are removed from the current database only after they were saved to a partition.
+
+        :param now: current time (UTC), used to find the oldest kept month
+        :return: number of moved journals
+        """
+        logger = getLogger(self.__class__.__qualname__)
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        month = now.year * 12 + now.month - 1 - (self.__keep - 1)
+        boundary = datetime(month // 12, month % 12 + 1, 1)
+        db = await self.__db()
+        moved = 0
+        while True:
+            rows = await db.fetch_all('''SELECT * FROM journal
+                                         WHERE finished_at IS NOT NULL AND started_at < :boundary
+                                         ORDER BY id LIMIT :limit''', values={
+                'boundary': timestamp(db, boundary),
+                'limit': self.__batch_size,
+            })
+            if not rows:
+                break
+            groups: Dict[str, List[Mapping]] = {}
+            for row in rows:
+                groups.setdefault(str(row['started_at'])[:7], []).append(row)
+            for name, journals in groups.items():
+                await self.__move(db, await self.open(name), journals)
+            moved += len(rows)
+        if moved:
+            logger.info("moved %d journals to archive", moved)
+        return moved
+
+    async def drop(self, name: str):
+        """
+        Remove partition (YYYY-MM) with all journals
+        """
+        partition = self.__partitions.pop(name, None)
+        if partition is not None:
+            await partition.db.disconnect()
+        (self.__directory / f'{PREFIX}{name}.db').unlink(missing_ok=True)
+        self.generation += 1
+
+    async def close(self):
+        """
+        Close connections to partitions
+        """
+        partitions, self.__partitions = self.__partitions, {}
+        for partition in partitions.values():
+            await partition.db.disconnect()
+
+    async def __adopt_interned(self, partition_db: 'Database'):
+        # partitions created before strings were interned (migration 0006) got own IDs of strings:
+        # they are replaced by IDs of the current database, so partitions are read by the same cache
+        db = await self.__db()
+        for table, (referencing, column) in INTERNED.items():
+            rows = await partition_db.fetch_all(f'SELECT id, value FROM {table}')
+            if not rows:
+                continue
+            await db.execute_many(f'INSERT INTO {table} (value) VALUES (:value) ON CONFLICT DO NOTHING',
+                                  values=[{'value': row['value']} for row in rows])
+            ids = {row['value']: row['id'] for row in await _select_interned(db, table, 'value',
+                                                                            [row['value'] for row in rows])}
+            changed = [(row['id'], ids[row['value']], row['value']) for row in rows if ids[row['value']] != row['id']]
+            if not changed:
+                continue
+            getLogger(self.__class__.__qualname__).info("re-numbering %d strings of %s in %s", len(changed), table,
+                                                        partition_db.url)
+            async with partition_db.transaction():
+                # new IDs are set through negative values: old and new IDs could overlap
+                await partition_db.execute_many(f'UPDATE {referencing} SET {column} = :new WHERE {column} = :old',
+                                                values=[{'old': old, 'new': -new} for old, new, _ in changed])
+                await partition_db.execute(f'UPDATE {referencing} SET {column} = -{column} WHERE {column} < 0')
+                await partition_db.execute_many(f'DELETE FROM {table} WHERE id = :id',
+                                                values=[{'id': old} for old, _, _ in changed])
+                await partition_db.execute_many(f'INSERT INTO {table} (id, value) VALUES (:id, :value)',
+                                                values=[{'id': new, 'value': value} for _, new, value in changed])
+
+    @staticmethod
+    async def __move(db: 'Database', partition: Partition, journals: List[Mapping]):
+        ids = [row['id'] for row in journals]
+        keys = ', '.join(f':id_{i}' for i in range(len(ids)))
+        args: Dict[str, Any] = {f'id_{i}': journal_id for i, journal_id in enumerate(ids)}
+
+        labels = await db.fetch_all(f'SELECT * FROM journal_label WHERE journal_id IN ({keys})', values=args)
+        records = await db.fetch_all(f'SELECT * FROM record WHERE journal_id IN ({keys})', values=args)
+        fields = await db.fetch_all(f'''SELECT record_field.* FROM record_field
+                                        INNER JOIN record ON record.id = record_field.record_id
+                                        WHERE record.journal_id IN ({keys})''', values=args)
+        # interned strings are copied with the same IDs: partitions are read by the same cache
+        interned = {
+            'operation_name': {row['operation_id'] for row in journals},
+            'operation_description': {row['description_id'] for row in journals},
+            'field_name': {row['name_id'] for row in fields},
+        }
+        strings = {table: await _select_interned(db, table, 'id', table_ids) for table, table_ids in interned.items()}
+
+        target = partition.db
+        async with target.transaction():
+            # ignore conflicts: journals could be already copied by interrupted rotation
+            for table, rows in strings.items():
+                if rows:
+                    await target.execute_many(f'''INSERT INTO {table} (id, value) VALUES (:id, :value)
+                                                  ON CONFLICT (id) DO NOTHING''', values=[
+                        _row(row, 'id', 'value') for row in rows
+                    ])
+            await target.execute_many('''INSERT INTO journal (id, operation_id, description_id, started_at, error,
+                                                              duration, finished_at)
+                                         VALUES (:id, :operation_id, :description_id, :started_at, :error,
+                                                 :duration, :finished_at)
+                                         ON CONFLICT (id) DO NOTHING''', values=[
+                _row(row, 'id', 'operation_id', 'description_id', 'started_at', 'error', 'duration', 'finished_at')
+                for row in journals
+            ])
+            await target.execute_many('''INSERT INTO journal_label (journal_id, label) VALUES (:journal_id, :label)
+                                         ON CONFLICT (journal_id, label) DO NOTHING''', values=[
+                _row(row, 'journal_id', 'label') for row in labels
+            ])
+            await target.execute_many('''INSERT INTO record (id, journal_id, created_at, message)
+                                         VALUES (:id, :journal_id, :created_at, :message)
+                                         ON CONFLICT (id) DO NOTHING''', values=[
+                _row(row, 'id', 'journal_id', 'created_at', 'message') for row in records
+            ])
+            await target.execute_many('''INSERT INTO record_field (record_id, name_id, value)
+                                         VALUES (:record_id, :name_id, :value)
+                                         ON CONFLICT (record_id, name_id) DO NOTHING''', values=[
+                _row(row, 'record_id', 'name_id', 'value') for row in fields
+            ])
+
+        async with db.transaction():
+            await db.execute(f'''DELETE FROM record_field WHERE record_id IN (
+                                     SELECT id FROM record WHERE journal_id IN ({keys}))''', values=args)
+            await db.execute(f'DELETE FROM record WHERE journal_id IN ({keys})', values=args)
+            await db.execute(f'DELETE FROM journal_label WHERE journal_id IN ({keys})', values=args)
+            await db.execute(f'DELETE FROM journal WHERE id IN ({keys})', values=args)
+
+        partition.journals += len(ids)
+        partition.min_id = min(ids) if partition.min_id is None else min(partition.min_id, min(ids))
+        partition.max_id = max(ids) if partition.max_id is None else max(partition.max_id, max(ids))
+
+
+async def _select_interned(db: 'Database', table: str, column: str, keys: Collection[Any],
+                           batch_size: int = 500) -> List[Mapping]:
+    keys = list(keys)
+    rows = []
+    for offset in range(0, len(keys), batch_size):
+        batch = keys[offset:offset + batch_size]
+        placeholders = ', '.join(f':key_{i}' for i in range(len(batch)))
+        rows.extend(await db.fetch_all(f'SELECT id, value FROM {table} WHERE {column} IN ({placeholders})',
+                                       values={f'key_{i}': key for i, key in enumerate(batch)}))
+    return rows
+
+
+def _row(row: Mapping, *names: str) -> Dict[str, Any]:
+    # partitions are SQLite: timestamps (ex: from PostgreSQL) are stored as text
+    return {name: (row[name].isoformat(' ') if isinstance(row[name], datetime) else row[name]) for name in names}
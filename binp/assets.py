@@ -0,0 +1,115 @@
+from argparse import ArgumentParser
+from gzip import compress as gzip_compress
+from logging import getLogger, basicConfig, INFO
+from mimetypes import guess_type
+from os import stat, stat_result
+from pathlib import Path
+from re import compile as regexp
+from typing import List, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope
+
+from binp.compression import SUFFIXES, negotiate, supported, brotli
+
+#: file names with content hash (ex: ``main-1a2b3c4d.js``) - content never changes
+HASHED_NAME = regexp(r'-[0-9a-f]{8,}\.[a-z0-9]+$')
+#: extensions of files worth to compress
+COMPRESSIBLE = ('.js', '.css', '.html', '.svg', '.json', '.txt', '.ico', '.map', '.xml')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+
+class StaticAssets(StaticFiles):
+    """
+    Static files with precompressed siblings and cache headers.
+
+    If client accepts brotli or gzip and the file has sibling ``<name>.br`` or ``<name>.gz``, the sibling is served
+    with ``Content-Encoding``, so nothing is compressed at runtime. Files with content hash in name
+    (ex: ``main-1a2b3c4d.js``) are cached by clients forever, other files (ex: ``index.html``) are revalidated
+    on each load (and usually answered by 304).
+
+    Hashed names are produced by the bundler (see ``ui/rollup.config.js``), siblings - by :func:`build`
+    (``python -m binp.assets <directory>``).
+    """
+
+    def file_response(self, full_path: str, stat_result: stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        response = self.__precompressed(full_path, request_headers, status_code, scope['method'])
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                    method=scope['method'])
+        response.headers['Cache-Control'] = IMMUTABLE if HASHED_NAME.search(full_path) else REVALIDATE
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    @staticmethod
+    def __precompressed(full_path: str, request_headers: Headers, status_code: int,
+                        method: str) -> Optional[Response]:
+        if not full_path.endswith(COMPRESSIBLE):
+            return None
+        available = [encoding for encoding in SUFFIXES if Path(full_path + SUFFIXES[encoding]).is_file()]
+        encoding = negotiate(request_headers.get('accept-encoding', ''), available)
+        if encoding is None:
+            if available:
+                # the same URL has encoded variants: caches should distinguish them
+                response = FileResponse(full_path, status_code=status_code, method=method)
+                response.headers['Vary'] = 'Accept-Encoding'
+                return response
+            return None
+        path = full_path + SUFFIXES[encoding]
+        response = FileResponse(path, status_code=status_code, stat_result=stat(path), method=method,
+                                media_type=guess_type(full_path)[0] or 'text/plain')
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def precompress(directory: Path, minimum_size: int = 256) -> List[Path]:
+    """
+    Write compressed siblings (``.gz`` and ``.br`` if brotli installed) with maximum compression level
+    for text files. Siblings which are not smaller than the original file are not kept.
+
+    :param minimum_size: minimal size of file (in bytes) to compress
+    :return: created files
+    """
+    created = []
+    for file in sorted(directory.rglob('*')):
+        if not file.is_file() or file.suffix not in COMPRESSIBLE or file.stat().st_size < minimum_size:
+            continue
+        content = file.read_bytes()
+        for encoding in supported():
+            data = brotli.compress(content, quality=11) if encoding == 'br' else gzip_compress(content, 9, mtime=0)
+            if len(data) >= len(content):
+                continue
+            target = file.with_name(file.name + SUFFIXES[encoding])
+            target.write_bytes(data)
+            created.append(target)
+    return created
+
+
+def build(directory: Path):
+    """
+    Prepare static assets for serving by :class:`StaticAssets`: precompressed siblings.
+    """
+    logger = getLogger('assets')
+    created = precompress(directory)
+    logger.info("compressed %d files (%s)", len(created), ', '.join(supported()))
+
+
+def main():
+    parser = ArgumentParser(prog='python -m binp.assets',
+                            description='Precompress static assets (UI bundle)')
+    parser.add_argument('directory', type=Path, help='directory with static files')
+    args = parser.parse_args()
+    basicConfig(level=INFO, format='%(message)s')
+    build(args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+from asyncio import get_event_loop
+from hashlib import sha256
+from json import loads
+from mmap import mmap, ACCESS_READ
+from os import getenv, replace
+from pathlib import Path
+from re import compile as regexp
+from time import time
+from typing import Any, Optional, Collection
+from uuid import uuid4
+
+#: field of reference object with blob digest
+REFERENCE = '$blob'
+#: blob name - sha256 of content
+DIGEST = regexp(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """
+    Content-addressed storage of large record fields: values bigger than ``threshold`` are saved as files
+    named by hash of content (``<directory>/<first two hex digits>/<sha256>``), so equal values are stored once.
+    Database row keeps only reference:
+
+    .. code-block:: json
+
+       {"$blob": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08", "size": 1048576}
+
+    Journals are returned with references (not inlined values), so reading a journal is not slowed down by big
+    fields. Content is available by ``/internal/blob/<sha256>`` (streamed from file) or by :meth:`load`.
+
+    Blobs are shared by all journals (including archived) and never modified. Blobs which are not referenced
+    anymore (ex: journals removed) could be removed by :meth:`sweep`.
+    """
+
+    def __init__(self, directory: Path, threshold: int = 65536):
+        """
+        :param directory: directory for blobs, created on first write
+        :param threshold: minimal size of serialized value (in bytes) to be saved as blob
+        """
+        self.directory = directory
+        self.threshold = threshold
+
+    @classmethod
+    def from_env(cls) -> Optional['BlobStore']:
+        """
+        Create store by environment variables ``BLOBS_DIR`` (default ``blobs``) and ``BLOB_THRESHOLD``
+        (default 65536, negative value disables offloading)
+        """
+        threshold = int(getenv('BLOB_THRESHOLD', '65536'))
+        if threshold < 0:
+            return None
+        return cls(Path(getenv('BLOBS_DIR', 'blobs')), threshold)
+
+    async def offload(self, value: str) -> str:
+        """
+        Save serialized value as blob if it's big enough.
+
+        :param value: serialized (JSON) value
+        :return: serialized reference or the same value if it's smaller than threshold
+        """
+        data = value.encode()
+        if len(data) < self.threshold:
+            return value
+        digest = await get_event_loop().run_in_executor(None, self.__write, data)
+        return f'{{"{REFERENCE}": "{digest}", "size": {len(data)}}}'
+
+    def path(self, digest: str) -> Optional[Path]:
+        """
+        Location of blob or None if there is no such blob (or digest is invalid)
+        """
+        if not DIGEST.match(digest):
+            return None
+        path = self.directory / digest[:2] / digest
+        if not path.is_file():
+            return None
+        return path
+
+    async def load(self, reference: Any) -> Any:
+        """
+        Read and parse value by reference. Values which are not references are returned as-is.
+        """
+        digest = self.digest(reference)
+        if digest is None:
+            return reference
+        path = self.path(digest)
+        if path is None:
+            raise FileNotFoundError(f'blob {digest} not found')
+        return await get_event_loop().run_in_executor(None, self.__read, path)
+
+    def sweep(self, referenced: Collection[str], grace: float = 3600) -> int:
+        """
+        Remove blobs which are not referenced.
+
+        :param referenced: digests of used blobs
+        :param grace: blobs younger than grace period (in seconds) are kept: they could be referenced by records
+                      which are being written right now
+        :return: number of removed blobs
+        """
+        if not self.directory.is_dir():
+            return 0
+        keep = set(referenced)
+        deadline = time() - grace
+        removed = 0
+        for path in self.directory.glob('??/*'):
+            if path.name in keep or not DIGEST.match(path.name) or path.stat().st_mtime > deadline:
+                continue
+            path.unlink()
+            removed += 1
+        return removed
+
+    @staticmethod
+    def digest(value: Any) -> Optional[str]:
+        """
+        Digest of blob if value is a reference
+        """
+        if isinstance(value, dict) and isinstance(value.get(REFERENCE), str) and len(value) == 2 and 'size' in value:
+            return value[REFERENCE]
+        return None
+
+    def __write(self, data: bytes) -> str:
+        digest = sha256(data).hexdigest()
+        target = self.directory / digest[:2] / digest
+        if target.is_file():
+            # the same content already stored: refresh modification time to protect it from sweep
+            target.touch()
+            return digest
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # written under temporary name: readers never see partial content
+        temp = target.with_name(f'.{digest}.{uuid4().hex}.tmp')
+        temp.write_bytes(data)
+        replace(temp, target)
+        return digest
+
+    @staticmethod
+    def __read(path: Path) -> Any:
+        with path.open('rb') as file, mmap(file.fileno(), 0, access=ACCESS_READ) as content:
+            return loads(content[:])
+
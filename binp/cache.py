@@ -0,0 +1,302 @@
+from asyncio import Future, get_event_loop, shield, current_task
+from collections import OrderedDict
+from functools import update_wrapper
+from hashlib import sha256
+from inspect import signature
+from json import dumps
+from logging import getLogger
+from time import time
+from typing import Callable, Awaitable, Optional, Dict, List, Any, Tuple, get_type_hints
+
+from pydantic import parse_obj_as, ValidationError
+from pydantic.json import pydantic_encoder
+from pydantic.main import BaseModel
+
+from binp.kv import KV
+
+
+class CacheInfo(BaseModel):
+    """
+    Cached function statistics
+    """
+    name: str
+    description: str
+    #: calls served from cache (memory or storage)
+    hits: int = 0
+    #: calls which invoked the function
+    misses: int = 0
+    #: number of results in memory
+    size: int = 0
+    #: maximum number of results in memory (None - unlimited)
+    maxsize: Optional[int] = None
+    #: time to live of result in seconds (None - forever)
+    ttl: Optional[float] = None
+    #: results are saved to KV storage
+    persist: bool = False
+
+
+class CachedResult(BaseModel):
+    """
+    Persisted result of cached function
+    """
+    #: unix time after which result is stale (None - never)
+    expires_at: Optional[float] = None
+    value: Any = None
+
+
+class CachedFunction:
+    """
+    Async function with memoized results. Created by :class:`Cache` decorator.
+    """
+
+    def __init__(self, fn: Callable[..., Awaitable], info: CacheInfo, kv: Optional[KV] = None):
+        update_wrapper(self, fn)
+        self.info = info
+        self.__fn = fn
+        self.__kv = kv
+        self.__signature = signature(fn)
+        self.__returns = get_type_hints(fn).get('return', Any)
+        #: key -> (expires at, result) in order of usage
+        self.__results: 'OrderedDict[str, Tuple[Optional[float], Any]]' = OrderedDict()
+        self.__inflight: Dict[str, Future] = {}
+
+    async def __call__(self, *args, **kwargs):
+        key = self.__key(args, kwargs)
+        found, value = self.__lookup(key)
+        if found:
+            self.info.hits += 1
+            return value
+        task = self.__inflight.get(key)
+        if task is None:
+            task = get_event_loop().create_task(self.__load(key, args, kwargs))
+            task.add_done_callback(lambda done: self.__detach(key, done))
+            self.__inflight[key] = task
+        else:
+            # concurrent caller shares in-flight execution
+            self.info.hits += 1
+        # shield shared execution from cancellation of a single caller
+        return await shield(task)
+
+    async def invalidate(self, *args, **kwargs):
+        """
+        Remove result for arguments from memory and storage.
+        Result of in-flight execution (started before) is returned to its callers but not cached.
+        """
+        key = self.__key(args, kwargs)
+        self.__results.pop(key, None)
+        self.__inflight.pop(key, None)
+        self.info.size = len(self.__results)
+        if self.__kv is not None:
+            await self.__kv.remove(self.__digest(key))
+
+    async def clear(self):
+        """
+        Remove all results from memory and storage. Statistics are kept.
+        Results of in-flight executions (started before) are returned to their callers but not cached.
+        """
+        self.__results.clear()
+        self.__inflight.clear()
+        self.info.size = 0
+        if self.__kv is not None:
+            await self.__kv.remove(*(await self.__kv.keys()))
+
+    def __lookup(self, key: str) -> Tuple[bool, Any]:
+        entry = self.__results.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time():
+            del self.__results[key]
+            self.info.size = len(self.__results)
+            return False, None
+        self.__results.move_to_end(key)
+        return True, value
+
+    async def __load(self, key: str, args, kwargs):
+        if self.__kv is not None:
+            found, value = await self.__restore(key)
+            if found:
+                self.info.hits += 1
+                return value
+        self.info.misses += 1
+        value = await self.__fn(*args, **kwargs)
+        if not self.__is_current(key):
+            # invalidated (or cleared) during execution
+            return value
+        expires_at = time() + self.info.ttl if self.info.ttl is not None else None
+        evicted = self.__remember(key, expires_at, value)
+        if self.__kv is not None:
+            try:
+                await self.__kv.set(**{self.__digest(key): CachedResult(expires_at=expires_at, value=value)})
+            except Exception as ex:
+                # result is still cached in memory
+                getLogger(self.__class__.__qualname__).warning("failed to persist result of %s: %s",
+                                                               self.info.name, ex)
+            await self.__forget(*evicted)
+        return value
+
+    async def __restore(self, key: str) -> Tuple[bool, Any]:
+        raw = await self.__kv.get(self.__digest(key))
+        if raw is None:
+            return False, None
+        try:
+            saved = CachedResult.parse_obj(raw)
+            value = parse_obj_as(self.__returns, saved.value)
+        except ValidationError as ex:
+            # saved by another version of the function (ex: return type changed)
+            getLogger(self.__class__.__qualname__).warning("ignoring incompatible persisted result of %s: %s",
+                                                           self.info.name, ex)
+            await self.__forget(key)
+            return False, None
+        if saved.expires_at is not None and saved.expires_at <= time():
+            await self.__forget(key)
+            return False, None
+        if self.__is_current(key):
+            await self.__forget(*self.__remember(key, saved.expires_at, value))
+        return True, value
+
+    async def __forget(self, *keys: str):
+        # remove stale (expired, evicted, invalid) results from storage
+        if not keys:
+            return
+        try:
+            await self.__kv.remove(*(self.__digest(key) for key in keys))
+        except Exception as ex:
+            getLogger(self.__class__.__qualname__).warning("failed to remove persisted results of %s: %s",
+                                                           self.info.name, ex)
+
+    def __remember(self, key: str, expires_at: Optional[float], value: Any) -> List[str]:
+        # returns keys of evicted results
+        self.__results[key] = (expires_at, value)
+        self.__results.move_to_end(key)
+        evicted = []
+        if self.info.maxsize is not None:
+            while len(self.__results) > self.info.maxsize:
+                evicted.append(self.__results.popitem(last=False)[0])
+        self.info.size = len(self.__results)
+        return evicted
+
+    def __is_current(self, key: str) -> bool:
+        # execution is not detached by invalidate or clear
+        return self.__inflight.get(key) is current_task()
+
+    def __detach(self, key: str, task: Future):
+        if self.__inflight.get(key) is task:
+            del self.__inflight[key]
+
+    def __key(self, args, kwargs) -> str:
+        bound = self.__signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return dumps(bound.arguments, sort_keys=True, default=pydantic_encoder, ensure_ascii=False)
+
+    @staticmethod
+    def __digest(key: str) -> str:
+        return sha256(key.encode()).hexdigest()
+
+
+class Cache:
+    """
+    Memoize results of async functions (ex: calls of slow upstream API).
+
+    Results are cached by arguments (arguments should be serializable to JSON, pydantic models are supported).
+    Least recently used results are evicted when ``maxsize`` reached, results older than ``ttl`` are not used.
+    Concurrent calls with the same arguments share one in-flight execution (single flight).
+    Exceptions are not cached.
+
+    .. code-block:: python
+
+       from binp import BINP
+
+       binp = BINP()
+
+       @binp.cache(ttl=300, maxsize=1000)
+       async def get_user(user_id: int) -> User:
+           ...
+
+       @binp.journal
+       async def handle_order(order: Order):
+           user = await get_user(order.user_id)
+
+
+    Decorators order matters: if cached function is also journaled (``@binp.cache`` above ``@binp.journal``),
+    only misses are journaled.
+
+    :Persistence:
+
+    With ``persist=True`` results are also saved to KV storage (namespace ``cache:<name>``), so they survive
+    restarts and are shared by workers. Results are restored by return annotation of the function,
+    so pydantic models are returned as models. Results which can't be restored (ex: return type changed)
+    are treated as misses. Expired and evicted results are removed from storage.
+
+    :Statistics:
+
+    Hits and misses of each cached function are exposed in internal API (``/internal/caches/``).
+
+    :Conflicts:
+
+    Cached functions are indexed by name. If multiple functions defined with the same name - the latest one will
+    be listed.
+    """
+
+    def __init__(self, kv: Optional[KV] = None):
+        self.__kv = kv
+        self.__functions: Dict[str, CachedFunction] = {}
+
+    def __call__(self, func: Optional[Callable[..., Awaitable]] = None, *,
+                 name: Optional[str] = None,
+                 description: Optional[str] = None,
+                 ttl: Optional[float] = None,
+                 maxsize: Optional[int] = 128,
+                 persist: bool = False):
+        """
+        Decorator that memoizes results of async function
+
+        :param name: cache name (used in statistics and as part of KV namespace), default is fully-qualified
+                     function name
+        :param description: cache description, default is function doc-string
+        :param ttl: time to live of result in seconds (None - forever)
+        :param maxsize: maximum number of results in memory (None - unlimited)
+        :param persist: save results to KV storage
+        """
+        if ttl is not None and ttl <= 0:
+            raise ValueError('ttl should be positive')
+        if maxsize is not None and maxsize < 1:
+            raise ValueError('maxsize should be positive')
+        if persist and self.__kv is None:
+            raise ValueError('persistence requires KV storage')
+
+        def register_function(fn: Callable[..., Awaitable]) -> CachedFunction:
+            nonlocal name, description
+
+            if name is None:
+                name = fn.__qualname__
+            if description is None:
+                description = "\n".join(line.strip() for line in (fn.__doc__ or '').splitlines()).strip()
+
+            info = CacheInfo(name=name, description=description, ttl=ttl, maxsize=maxsize, persist=persist)
+            cached = CachedFunction(fn, info, self.__kv.select('cache:' + name) if persist else None)
+            self.__functions[name] = cached
+            return cached
+
+        if func is None:
+            return register_function
+        return register_function(func)
+
+    @property
+    def caches(self) -> List[CacheInfo]:
+        """
+        Statistics of all cached functions
+        """
+        return [cached.info for cached in self.__functions.values()]
+
+    async def clear(self, name: str) -> bool:
+        """
+        Remove all results of cached function by name
+
+        :return: true if cached function exists
+        """
+        cached = self.__functions.get(name)
+        if cached is None:
+            return False
+        await cached.clear()
+        return True
@@ -0,0 +1,263 @@
+from asyncio import Event, Task, get_event_loop, sleep, wait_for, TimeoutError
+from json import dumps, loads
+from logging import getLogger
+from os import getenv, getpid
+from pathlib import Path
+from typing import Optional, List, Tuple, Any, Callable, Union, TYPE_CHECKING
+from uuid import uuid4
+
+from pydantic.main import BaseModel
+
+from binp.db import ensure, dialect, POSTGRESQL
+from binp.events import Bus, deliver, use_bus
+from binp.service import Service
+
+if TYPE_CHECKING:
+    from databases import Database
+
+    from binp.schedule import Schedule
+
+
+class SQLiteBus(Bus):
+    """
+    Cross-process event bus based on notification log in the database (table ``event_log``).
+
+    Published events are written in batches (one transaction per event loop tick), and each process polls
+    the log for events from other processes. Old events are removed after ``retention`` seconds.
+    Designed for several workers on a single host sharing the same database (SQLite or PostgreSQL).
+    """
+
+    def __init__(self, db: Optional['Database'] = None, interval: float = 0.1, retention: float = 60,
+                 batch_size: int = 1000):
+        self.__db = ensure(db)
+        self.__interval = interval
+        self.__retention = retention
+        self.__batch_size = batch_size
+        self.__origin = f'{getpid()}-{uuid4().hex}'
+        self.__buffer: List[Tuple[str, str]] = []
+        self.__flush_task: Optional[Task] = None
+        self.__poll_task: Optional[Task] = None
+        self.__stopping: Optional[Event] = None
+
+    def publish(self, channel: str, payload: Any):
+        value = payload.json() if isinstance(payload, BaseModel) else dumps(payload, ensure_ascii=False)
+        self.__buffer.append((channel, value))
+        if self.__poll_task is not None and (self.__flush_task is None or self.__flush_task.done()):
+            self.__flush_task = get_event_loop().create_task(self.flush())
+
+    async def flush(self):
+        """
+        Write buffered events to the log
+        """
+        if not self.__buffer:
+            return
+        batch, self.__buffer = self.__buffer, []
+        db = await self.__db()
+        async with db.transaction():
+            await db.execute_many('''INSERT INTO event_log (origin, channel, payload)
+                                     VALUES (:origin, :channel, :payload)''', values=[
+                {'origin': self.__origin, 'channel': channel, 'payload': payload} for channel, payload in batch
+            ])
+
+    async def start(self):
+        """
+        Start polling for events from other processes. Events published before start are flushed.
+        """
+        if self.__poll_task is not None:
+            return
+        db = await self.__db()
+        row = await db.fetch_one('SELECT max(id) FROM event_log')
+        self.__stopping = Event()
+        self.__poll_task = get_event_loop().create_task(self.__poll(row[0] or 0, self.__stopping))
+        await self.flush()
+
+    async def stop(self):
+        """
+        Stop polling and flush pending events
+        """
+        if self.__poll_task is not None:
+            # polling is not cancelled: cancellation of a query could leave database connection open
+            self.__stopping.set()
+            await self.__poll_task
+            self.__poll_task = None
+        if self.__flush_task is not None:
+            # do not run two flushes (transactions) concurrently
+            await self.__flush_task
+            self.__flush_task = None
+        await self.flush()
+
+    async def __poll(self, last_id: int, stopping: Event):
+        logger = getLogger(self.__class__.__qualname__)
+        db = await self.__db()
+        last_cleanup = 0.0
+        while not stopping.is_set():
+            try:
+                rows = await db.fetch_all('''SELECT id, origin, channel, payload FROM event_log
+                                             WHERE id > :last_id ORDER BY id LIMIT :limit''', values={
+                    'last_id': last_id,
+                    'limit': self.__batch_size
+                })
+                for row in rows:
+                    last_id = row['id']
+                    if row['origin'] != self.__origin:
+                        deliver(row['channel'], loads(row['payload']))
+                now = get_event_loop().time()
+                if now - last_cleanup > self.__retention:
+                    last_cleanup = now
+                    await db.execute(self.__cleanup_query(db), values={'age': float(self.__retention)})
+                if len(rows) == self.__batch_size:
+                    continue
+            except Exception as ex:
+                logger.warning("failed to poll events: %s", ex, exc_info=ex)
+            try:
+                await wait_for(stopping.wait(), self.__interval)
+            except TimeoutError:
+                pass
+
+    @staticmethod
+    def __cleanup_query(db: 'Database') -> str:
+        if dialect(db) == POSTGRESQL:
+            return "DELETE FROM event_log WHERE created_at < now() - make_interval(secs => :age)"
+        return "DELETE FROM event_log WHERE created_at < datetime('now', '-' || :age || ' seconds')"
+
+
+class FileLeader:
+    """
+    Leader election between processes on the same host by exclusive lock (flock) on a file.
+
+    The process holding the lock is a leader. Lock is released automatically by OS if the process dies,
+    so one of the other processes will take leadership on the next attempt. Unix only.
+    """
+
+    def __init__(self, path: Path, interval: float = 1):
+        self.__path = path
+        self.__interval = interval
+        self.__file = None
+        self.__task: Optional[Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        """
+        Is leadership acquired by the current process
+        """
+        return self.__file is not None
+
+    def acquire(self) -> bool:
+        """
+        Try to acquire leadership (non-blocking)
+
+        :return: true if the process is a leader
+        """
+        if self.__file is not None:
+            return True
+        from fcntl import flock, LOCK_EX, LOCK_NB
+
+        file = open(self.__path, 'a+')
+        try:
+            flock(file.fileno(), LOCK_EX | LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        file.truncate(0)
+        file.write(str(getpid()))
+        file.flush()
+        self.__file = file
+        getLogger(self.__class__.__qualname__).info("process %d elected as leader", getpid())
+        return True
+
+    def campaign(self, on_elected: Callable[[], None]):
+        """
+        Retry to acquire leadership in background until success, then invoke callback.
+        Does nothing if the process is already a leader.
+        """
+        if self.__task is not None or self.is_leader:
+            return
+
+        async def retry():
+            while not self.acquire():
+                await sleep(self.__interval)
+            on_elected()
+
+        self.__task = get_event_loop().create_task(retry())
+
+    def resign(self):
+        """
+        Stop campaign and release leadership (if acquired)
+        """
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+class Cluster:
+    """
+    Multi-worker deployment support (ex: ``uvicorn --workers 4``): cross-process events and leader election.
+
+    * journal and service events are delivered to websocket clients connected to any worker;
+    * services marked as autostart are started only in one worker (leader). If leader dies, another worker
+      takes leadership and starts services;
+    * scheduled jobs are run by timer only in leader.
+
+    Enabled by environment variable ``CLUSTER=true``; lock file for leader election could be defined
+    by ``LEADER_LOCK`` (default ``binp.lock`` in working directory).
+
+    .. code-block:: python
+
+       from binp import BINP
+       from binp.cluster import Cluster
+
+       binp = BINP(cluster=Cluster())
+
+    """
+
+    def __init__(self, bus: Optional[SQLiteBus] = None, leader: Optional[FileLeader] = None):
+        self.bus = bus or SQLiteBus()
+        self.leader = leader or FileLeader(Path(getenv('LEADER_LOCK', 'binp.lock')))
+        self.__members: List[Union[Service, 'Schedule']] = []
+
+    @classmethod
+    def from_env(cls) -> Optional['Cluster']:
+        """
+        Create cluster if enabled by environment variable ``CLUSTER``
+        """
+        if getenv('CLUSTER', '') == 'true':
+            return cls()
+        return None
+
+    def attach(self, services: Service):
+        """
+        Route named events through the bus and put services to standby mode if the process is not a leader.
+        """
+        use_bus(self.bus)
+        self.follow(services)
+
+    def follow(self, member: Union[Service, 'Schedule']):
+        """
+        Run services or scheduled jobs only in leader: member is put to standby mode if the process is not a leader
+        and activated once the process is elected.
+        """
+        self.__members.append(member)
+        if not self.leader.acquire():
+            member.standby()
+
+    async def start(self):
+        """
+        Start events polling and leader campaign
+        """
+        await self.bus.start()
+        self.leader.campaign(self.__activate)
+
+    def __activate(self):
+        for member in self.__members:
+            member.activate()
+
+    async def stop(self):
+        """
+        Flush events and release leadership
+        """
+        await self.bus.stop()
+        use_bus(None)
+        self.leader.resign()
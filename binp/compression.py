@@ -0,0 +1,153 @@
+from typing import Callable, List, Optional, Tuple
+from zlib import compressobj, DEFLATED, Z_SYNC_FLUSH
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+#: file suffixes of precompressed content by encoding
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+#: content types which are already compressed
+INCOMPRESSIBLE = ('image/', 'video/', 'audio/', 'font/woff', 'application/gzip', 'application/zip')
+
+
+def supported() -> List[str]:
+    """
+    Encodings supported by the current installation, most effective first. Brotli requires ``pip install binp[brotli]``.
+    """
+    return (['br'] if brotli is not None else []) + ['gzip']
+
+
+def negotiate(accept_encoding: str, available: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Choose encoding by ``Accept-Encoding`` header: first of available encodings accepted by client (q > 0).
+
+    :param accept_encoding: header value (ex: ``gzip, deflate, br;q=0.9``)
+    :param available: encodings in order of preference, default is supported()
+    :return: encoding or None if content should not be compressed
+    """
+    accepted = set()
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    for encoding in (available if available is not None else supported()):
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compressor(encoding: str, level: int) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes]]:
+    """
+    Streaming compressor for encoding: pair of functions to compress chunk and to finish the stream.
+    Each chunk is flushed, so streamed messages (ex: server-sent events) are not delayed by compressor.
+    """
+    if encoding == 'br':
+        engine = brotli.Compressor(quality=level)
+        return (lambda chunk: engine.process(chunk) + engine.flush()), engine.finish
+    engine = compressobj(level, DEFLATED, 31)  # 31 - gzip container
+    return (lambda chunk: engine.compress(chunk) + engine.flush(Z_SYNC_FLUSH)), engine.flush
+
+
+class CompressionMiddleware:
+    """
+    Compress responses by brotli (if installed) or gzip depending on ``Accept-Encoding`` of request.
+
+    Responses smaller than ``minimum_size``, already encoded responses (ex: precompressed static files) and
+    already compressed content types (images, archives) are sent as-is. Streaming responses are compressed
+    on the fly.
+
+    .. code-block:: python
+
+       app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        """
+        :param minimum_size: minimal size of response (in bytes) to compress
+        :param gzip_level: gzip compression level (1-9)
+        :param brotli_quality: brotli quality (0-11), lower values are faster and good enough for dynamic content
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {'gzip': gzip_level, 'br': brotli_quality}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _Responder(self.app, encoding, self.levels[encoding], self.minimum_size)(scope, receive, send)
+
+
+class _Responder:
+    def __init__(self, app: ASGIApp, encoding: str, level: int, minimum_size: int):
+        self.__app = app
+        self.__encoding = encoding
+        self.__level = level
+        self.__minimum_size = minimum_size
+        self.__send: Send = None
+        self.__start: Optional[Message] = None
+        self.__compress: Optional[Tuple[Callable[[bytes], bytes], Callable[[], bytes]]] = None
+        self.__passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.__send = send
+        await self.__app(scope, receive, self.__on_message)
+
+    async def __on_message(self, message: Message):
+        if self.__passthrough:
+            await self.__send(message)
+            return
+        if message['type'] == 'http.response.start':
+            # headers could be decided only after the first chunk of body
+            self.__start = message
+            headers = Headers(raw=message['headers'])
+            content_type = headers.get('content-type', '')
+            if 'content-encoding' in headers or any(content_type.startswith(kind) for kind in INCOMPRESSIBLE):
+                self.__passthrough = True
+                await self.__send(message)
+            return
+        if message['type'] != 'http.response.body':
+            await self.__send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if self.__compress is None:
+            if not more_body and len(body) < self.__minimum_size:
+                self.__passthrough = True
+                await self.__send(self.__start)
+                await self.__send(message)
+                return
+            self.__compress = compressor(self.__encoding, self.__level)
+            headers = MutableHeaders(raw=self.__start['headers'])
+            headers['Content-Encoding'] = self.__encoding
+            headers.add_vary_header('Accept-Encoding')
+            del headers['Content-Length']
+            compress, finish = self.__compress
+            data = compress(body) + (b'' if more_body else finish())
+            if not more_body:
+                headers['Content-Length'] = str(len(data))
+            await self.__send(self.__start)
+            await self.__send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+            return
+
+        compress, finish = self.__compress
+        data = compress(body) + (b'' if more_body else finish())
+        await self.__send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
@@ -1,14 +1,20 @@
-from asyncio import Lock
+from asyncio import Lock, Task, CancelledError, get_event_loop
+from contextvars import Context
+from dataclasses import dataclass
 from functools import lru_cache
+from hashlib import sha256
+from itertools import groupby
 from logging import getLogger
 from os import getenv
 from pathlib import Path
-from typing import Optional, Callable, Awaitable
+from datetime import datetime, timezone
+from typing import Optional, Callable, Awaitable, Tuple, List, Sequence, Any, Union, TYPE_CHECKING
 
-from databases import Database
+if TYPE_CHECKING:
+    from databases import Database
 
 
-def ensure(db: Optional[Database] = None) -> Callable[[], Awaitable[Database]]:
+def ensure(db: Optional['Database'] = None) -> Callable[[], Awaitable['Database']]:
     """
     Wraps database to async callable or inits
     default database defined in DB_URL environment. If not defined - sqlite in data.db will be used
@@ -17,65 +23,375 @@ def ensure(db: Optional[Database] = None) -> Callable[[], Awaitable[Database]]:
     if db is None:
         return __get_default_db()
 
-    async def proxy() -> Database:
+    async def proxy() -> 'Database':
         return db
 
     return proxy
 
 
+def spawn(coro: Awaitable) -> Task:
+    """
+    Create task with own database connection. Connection is bound to context, and tasks created by
+    ``create_task`` inherit context: if the parent already used the database, the tasks share its connection
+    and concurrent transactions are mixed. Context variables (ex: current journal) are not inherited.
+    """
+    return Context().run(get_event_loop().create_task, coro)
+
+
+async def close(db: Optional['Database'] = None):
+    """
+    Close database connections. If database not defined, the default database will be closed (only if it was used).
+    Online migration of the default database which is still running is interrupted.
+    """
+    if db is None:
+        if __get_default_db.cache_info().currsize == 0:
+            return
+        default = __get_default_db()
+        db = default.database
+        if default.online is not None and not default.online.done():
+            # interrupted online migration is applied again on the next start
+            default.online.cancel()
+            try:
+                await default.online
+            except CancelledError:
+                pass
+    if db is not None and db.is_connected:
+        await db.disconnect()
+
+
 @lru_cache()
 def __get_default_db():
-    db = Database(getenv('DB_URL', 'sqlite:///data.db'))
+    # database is created on first use: importing databases (and sqlalchemy) is relatively slow
     initialized = False
     lock = Lock()
 
-    async def proxy() -> Database:
+    async def proxy() -> 'Database':
         nonlocal initialized
         if initialized:
-            return db
+            return proxy.database
         async with lock:
             if initialized:
-                return db
-            await migrate(db)
+                return proxy.database
+            from databases import Database
+
+            db = Database(getenv('DB_URL', 'sqlite:///data.db'))
+            await db.connect()
+            # reference to background task is kept: event loop keeps only weak references
+            proxy.online = await migrate(db)
+            proxy.database = db
             initialized = True
             return db
 
+    proxy.database = None
+    proxy.online = None
     return proxy
 
 
-async def migrate(db: Database,
-                  src_dir: Path = Path(__file__).absolute().parent / 'migrations',
-                  namespace: str = 'default'):
+#: supported SQL dialects
+SQLITE = 'sqlite'
+POSTGRESQL = 'postgresql'
+
+
+def dialect(db: 'Database') -> str:
+    """
+    Normalized SQL dialect of database: ``sqlite`` or ``postgresql``
+    """
+    name = db.url.dialect
+    if name in ('postgres', 'postgresql'):
+        return POSTGRESQL
+    return name
+
+
+def returning(db: 'Database') -> bool:
+    """
+    Is ``INSERT ... RETURNING`` supported by database: PostgreSQL or SQLite 3.35+
+    """
+    name = dialect(db)
+    if name == POSTGRESQL:
+        return True
+    if name == SQLITE:
+        from sqlite3 import sqlite_version_info
+        return sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def timestamp(db: 'Database', value: datetime) -> Union[datetime, str]:
+    """
+    Convert time to query parameter. SQLite stores timestamps as text in UTC (as ``current_timestamp``).
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    if dialect(db) == POSTGRESQL:
+        return value
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+async def insert_many(db: 'Database', table: str, columns: Sequence[str], rows: Sequence[Sequence[Any]]):
+    """
+    Insert rows by one prepared statement executed by the driver for all rows (``executemany``).
+    Much faster than statement per row: query is not compiled for each row.
+    Should be called inside transaction if rows should be inserted atomically.
+
+    :param table: table name
+    :param columns: column names
+    :param rows: values in the same order as columns
+    """
+    if not rows:
+        return
+    if dialect(db) == POSTGRESQL:
+        placeholders = ', '.join(f'${i + 1}' for i in range(len(columns)))
+    else:
+        placeholders = ', '.join('?' for _ in columns)
+    query = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})'
+    async with db.connection() as connection:
+        await connection.raw_connection.executemany(query, rows)
+
+
+async def reserve_ids(db: 'Database', table: str, count: int) -> List[int]:
+    """
+    Allocate IDs for rows which will be inserted with explicit ID (ex: bulk import of linked rows).
+    For SQLite should be called inside transaction.
+
+    :param table: table name with auto-generated ``id`` column
+    :param count: number of IDs
+    :return: allocated IDs
+    """
+    if count <= 0:
+        return []
+    if dialect(db) == POSTGRESQL:
+        rows = await db.fetch_all("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)",
+                                  values={'table': table, 'count': count})
+        return [row[0] for row in rows]
+    # AUTOINCREMENT keeps the last used ID in sqlite_sequence; update first to take the write lock
+    await db.execute(f'''INSERT INTO sqlite_sequence (name, seq)
+                         SELECT :name, (SELECT coalesce(max(id), 0) FROM {table})
+                         WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :existing)''', values={
+        'name': table,
+        'existing': table,
+    })
+    await db.execute('UPDATE sqlite_sequence SET seq = seq + :count WHERE name = :name', values={
+        'count': count,
+        'name': table,
+    })
+    last = (await db.fetch_one('SELECT seq FROM sqlite_sequence WHERE name = :name', values={'name': table}))[0]
+    return list(range(last - count + 1, last + 1))
+
+
+async def drop_indexes(db: 'Database', tables: Sequence[str]) -> List[str]:
+    """
+    Drop secondary indexes (except primary keys and constraints) of tables, ex: before bulk insert.
+
+    :return: statements to restore indexes
+    """
+    keys = ', '.join(f':table_{i}' for i in range(len(tables)))
+    values = {f'table_{i}': table for i, table in enumerate(tables)}
+    if dialect(db) == POSTGRESQL:
+        # indexes of constraints (primary keys) are kept
+        rows = await db.fetch_all(f'''SELECT indexname AS name, indexdef AS sql FROM pg_indexes
+                                      WHERE tablename IN ({keys})
+                                      AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = indexname)''',
+                                  values=values)
+    else:
+        # automatic indexes (primary keys) have no SQL
+        rows = await db.fetch_all(f'''SELECT name, sql FROM sqlite_master
+                                      WHERE type = 'index' AND tbl_name IN ({keys}) AND sql IS NOT NULL''',
+                                  values=values)
+    for row in rows:
+        await db.execute(f'DROP INDEX {row["name"]}')
+    return [row['sql'] for row in rows]
+
+
+async def restore_indexes(db: 'Database', statements: Sequence[str]):
+    """
+    Re-create indexes dropped by ``drop_indexes``
+    """
+    for statement in statements:
+        await db.execute(statement)
+
+
+#: marker (at the beginning of file) of migration which should be applied in background without blocking startup
+ONLINE_MARKER = '-- binp: online'
+
+
+@dataclass(frozen=True)
+class Migration:
+    #: file name
+    name: str
+    #: SHA-256 of content
+    checksum: str
+    #: SQL script
+    sql: str
+    #: apply in background, outside of the main transaction
+    online: bool
+
+
+@lru_cache()
+def scan(src_dir: Path) -> Tuple[Tuple[Migration, ...], str]:
+    """
+    Read migrations from directory (once per process) ordered by name and calculate digest of the whole set.
+    """
+    migrations = []
+    digest = sha256()
+    for file in sorted(src_dir.glob("*.sql")):
+        sql = file.read_text()
+        checksum = sha256(sql.encode()).hexdigest()
+        digest.update(f'{file.name}:{checksum}\n'.encode())
+        migrations.append(Migration(name=file.name, checksum=checksum, sql=sql,
+                                    online=sql.lstrip().startswith(ONLINE_MARKER)))
+    return tuple(migrations), digest.hexdigest()
+
+
+async def migrate(db: 'Database',
+                  src_dir: Optional[Path] = None,
+                  namespace: str = 'default') -> Optional[Task]:
     """
     Apply forward migration on database.
+
+    If schema is up to date (digest of all migrations matches saved one) it costs a single query.
+    Otherwise, all pending migrations are applied in a single transaction (as one script for SQLite)
+    and their checksums are saved. Already applied migrations are never re-applied; changed ones are reported to log.
+
+    Migrations starting with ``-- binp: online`` comment (ex: index creation for large tables) are applied
+    in background after the main transaction, so startup is not blocked. Such migrations should be idempotent
+    (ex: ``CREATE INDEX IF NOT EXISTS``) since they could be interrupted. Online migrations followed by pending
+    regular migrations (ex: on the first start) are applied in order with them.
+
+    Only PostgreSQL really builds indexes online (``CREATE INDEX CONCURRENTLY``). SQLite holds the write lock
+    while index is built, so writes are still waiting for online migration - only reads and startup are not blocked.
+    Failures of online migrations are logged, and the migrations are retried on the next start.
+
     :param db: async database connection
-    :param src_dir: source directory with *.sql files, ordered by name (ex: 0001_abc.sql, 0002_def.sql)
+    :param src_dir: source directory with *.sql files, ordered by name (ex: 0001_abc.sql, 0002_def.sql).
+                    Default is built-in migrations for the database dialect.
     :param namespace: migration namespace (useful if several projects are using same db)
+    :return: background task which applies online migrations (if any)
     """
     logger = getLogger("db-migration")
+    if src_dir is None:
+        src_dir = Path(__file__).absolute().parent / 'migrations' / dialect(db)
+    migrations, digest = scan(src_dir)
+    try:
+        row = await db.fetch_one('SELECT digest FROM _migration_state WHERE namespace = :namespace', values={
+            'namespace': namespace
+        })
+    except Exception:  # first start or legacy schema
+        row = None
+    if row is not None and row['digest'] == digest:
+        logger.debug("schema is up to date, namespace = %s", namespace)
+        return None
+
+    await __prepare(db)
+    rows = await db.fetch_all('SELECT name, checksum FROM _migration WHERE namespace = :namespace', values={
+        'namespace': namespace
+    })
+    applied = {row['name']: row['checksum'] for row in rows}
+    for migration in migrations:
+        if migration.name not in applied:
+            continue
+        checksum = applied[migration.name]
+        if checksum is None:
+            await db.execute('UPDATE _migration SET checksum = :checksum WHERE name = :name AND namespace = :namespace',
+                             values={'checksum': migration.checksum, 'name': migration.name, 'namespace': namespace})
+        elif checksum != migration.checksum:
+            logger.warning("migration %s changed after it was applied - ignored", migration.name)
+
+    pending = [migration for migration in migrations if migration.name not in applied]
+    # online migrations followed by regular ones are applied in order: later migrations could depend on them
+    last_regular = max((i for i, migration in enumerate(pending) if not migration.online), default=-1)
+    regular, online = pending[:last_regular + 1], pending[last_regular + 1:]
+    if regular:
+        logger.info("applying migrations: %s", ", ".join(migration.name for migration in regular))
+        if dialect(db) == SQLITE:
+            await __apply(db, regular, namespace)
+        else:
+            for is_online, group in groupby(regular, key=lambda migration: migration.online):
+                await __apply(db, list(group), namespace, atomic=not is_online)
+    if not online:
+        await __save_digest(db, namespace, digest)
+        logger.info("migration complete, namespace = %s", namespace)
+        return None
+
+    async def apply_online():
+        try:
+            for migration in online:
+                logger.info("applying online migration %s", migration.name)
+                await __apply(db, [migration], namespace, atomic=False)
+            await __save_digest(db, namespace, digest)
+            logger.info("online migration complete, namespace = %s", namespace)
+        except Exception as ex:
+            logger.error("online migration failed: %s", ex, exc_info=ex)
+
+    return get_event_loop().create_task(apply_online())
+
+
+async def __prepare(db: 'Database'):
     await db.execute(
         '''
         CREATE TABLE IF NOT EXISTS _migration (
             name TEXT NOT NULL, 
             namespace TEXT NOT NULL, 
+            checksum TEXT,
             PRIMARY KEY(name,namespace)
         )''')
-    row = await db.fetch_one(
-        'SELECT name FROM _migration WHERE namespace = :namespace ORDER BY name DESC LIMIT 1', values={
-            "namespace": namespace
-        })
-    for file in sorted(src_dir.glob("*.sql")):
-        if row is not None and file.name <= row[0]:
-            logger.info("skipping %s", file.name)
-            continue
-        async with db.transaction():
-            logger.info("applying migration from %s", file.name)
-            for statement in file.read_text().split(';'):
-                logger.info("applying: %s", statement)
+    try:
+        await db.fetch_one('SELECT checksum FROM _migration LIMIT 1')
+    except Exception:  # created by previous version
+        await db.execute('ALTER TABLE _migration ADD COLUMN checksum TEXT')
+    await db.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS _migration_state (
+            namespace TEXT NOT NULL PRIMARY KEY,
+            digest TEXT NOT NULL
+        )''')
+
+
+async def __apply(db: 'Database', migrations: List[Migration], namespace: str, atomic: bool = True):
+    if dialect(db) == SQLITE:
+        # one script in one transaction: much faster than statement by statement
+        script = ['BEGIN;']
+        for migration in migrations:
+            script.append(migration.sql.strip().rstrip(';') + ';')
+            script.append(f"INSERT INTO _migration(name, namespace, checksum) VALUES "
+                          f"({__quote(migration.name)}, {__quote(namespace)}, {__quote(migration.checksum)});")
+        script.append('COMMIT;')
+        async with db.connection() as connection:
+            raw = connection.raw_connection
+            try:
+                await raw.executescript('\n'.join(script))
+            except Exception:
+                if raw.in_transaction:
+                    await raw.execute('ROLLBACK')
+                raise
+        return
+    if not atomic:
+        # online migrations may contain statements not allowed in transaction (ex: CREATE INDEX CONCURRENTLY)
+        await __execute(db, migrations, namespace)
+        return
+    async with db.transaction():
+        await __execute(db, migrations, namespace)
+
+
+async def __execute(db: 'Database', migrations: List[Migration], namespace: str):
+    for migration in migrations:
+        for statement in migration.sql.split(';'):
+            if statement.strip():
                 await db.execute(statement)
-            await db.execute('INSERT INTO _migration(name, namespace) VALUES(:name, :namespace)',
-                             values={
-                                 'name': file.name,
-                                 'namespace': namespace
-                             })
-    logger.info("migration complete, namespace = %s", namespace)
+        await db.execute('INSERT INTO _migration(name, namespace, checksum) VALUES(:name, :namespace, :checksum)',
+                         values={
+                             'name': migration.name,
+                             'namespace': namespace,
+                             'checksum': migration.checksum,
+                         })
+
+
+async def __save_digest(db: 'Database', namespace: str, digest: str):
+    async with db.transaction():
+        await db.execute('DELETE FROM _migration_state WHERE namespace = :namespace', values={'namespace': namespace})
+        await db.execute('INSERT INTO _migration_state (namespace, digest) VALUES (:namespace, :digest)', values={
+            'namespace': namespace,
+            'digest': digest,
+        })
+
+
+def __quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
@@ -1,11 +1,84 @@
 from asyncio import Queue, CancelledError, get_event_loop
+from collections import deque
 from contextlib import contextmanager
+from dataclasses import dataclass
 from logging import getLogger
-from typing import TypeVar, Generic, ContextManager, Set, Awaitable, Callable, Optional
+from typing import TypeVar, Generic, ContextManager, Set, Awaitable, Callable, Optional, Any, Dict, List, Deque, \
+    Hashable
+from weakref import WeakSet
 
 T = TypeVar('T')
 
 
+class Bus:
+    """
+    Transport of named events between processes (ex: several uvicorn workers).
+
+    By default, there is no bus and events are delivered only inside the current process.
+    Implementation should deliver published events to all other processes by calling ``deliver``.
+    """
+
+    def publish(self, channel: str, payload: Any):
+        """
+        Send event to other processes. Should be non-blocking.
+        """
+        raise NotImplementedError()
+
+
+#: active bus (None - in-process delivery only)
+_bus: Optional[Bus] = None
+#: named emitters in the current process
+_channels: Dict[str, 'WeakSet[Emitter]'] = {}
+
+
+def use_bus(bus: Optional[Bus]):
+    """
+    Set bus for all named emitters. None - deliver events only inside the current process (default).
+    """
+    global _bus
+    _bus = bus
+
+
+def deliver(channel: str, payload: Any):
+    """
+    Deliver event received from another process to local subscribers of all emitters with the channel name.
+    """
+    for emitter in list(_channels.get(channel, ())):
+        emitter.deliver(emitter.parse(payload))
+
+
+@dataclass(frozen=True)
+class Event:
+    """
+    Emitted event with sequence number
+    """
+    #: source of event
+    emitter: 'Emitter'
+    #: sequence number of event in emitter (starts from 1, increased by each event)
+    sequence: int
+    #: event payload
+    payload: Any
+
+
+class EventsLost(Exception):
+    """
+    Events after requested sequence number are not available (replay buffer overflowed or emitter was re-created)
+    """
+
+
+class _Sequencer:
+    # queue-like adapter which wraps payloads to events with sequence numbers
+    def __init__(self, emitter: 'Emitter', queue: 'Queue[Optional[Event]]'):
+        self.__emitter = emitter
+        self.__queue = queue
+
+    def put_nowait(self, payload: Any):
+        if payload is None:
+            self.__queue.put_nowait(None)
+        else:
+            self.__queue.put_nowait(Event(self.__emitter, self.__emitter.version, payload))
+
+
 class Emitter(Generic[T]):
     """
     Typed event emitter based on async queues.
@@ -13,6 +86,8 @@ class Emitter(Generic[T]):
     Event emitting is non-blocking operation. After subscription, listener will not miss any event regardless
     of processing time (in exchange of memory). Events order are strictly the same as emitting order.
 
+    Once emitter closed (ex: on shutdown), each subscribed queue receives ``None`` as the last value.
+
     Can be used as decorator.
 
     :Example:
@@ -45,30 +120,137 @@ class Emitter(Generic[T]):
        def emitter():
            on_something.emit('hello world')
 
+    Emitter with name (channel) will also deliver events to emitters with the same name in other processes
+    if bus is configured (see ``use_bus``). In this case payload should be JSON serializable (or pydantic model),
+    and ``parse`` will be used to restore payload from JSON. Large payloads could be reduced by ``share`` before
+    sending to other processes (ex: only IDs instead of full values).
+
+    Each event gets sequence number (``version`` of emitter after the event). Emitter with ``replay`` keeps
+    latest events, so a subscriber which was disconnected can continue from the last received event
+    without missing anything:
+
+    .. code-block:: python
+
+       on_something : Emitter[str] = Emitter(replay=1000)
+
+       async def subscriber(last_sequence: int):
+           with on_something.resume(after=last_sequence) as queue:
+                while True:
+                    event = await queue.get()
+                    print("payload:", event.payload, "sequence:", event.sequence)
+
+    Subscriber interested only in events about a single entity could subscribe by key: such events are put only
+    to queues subscribed to the key (and to queues without key), so emitting cost doesn't depend on number of
+    subscribers for other keys. Key of event is calculated by ``key`` function (payload itself by default).
+
+    .. code-block:: python
+
+       on_changed : Emitter[Info] = Emitter(key=lambda info: info.name)
+
+       async def subscriber():
+           with on_changed.subscribe(key='my-service') as queue:
+                while True:
+                    info = await queue.get()
+                    print("my-service changed:", info)
     """
 
-    def __init__(self):
+    def __init__(self, name: Optional[str] = None, parse: Optional[Callable[[Any], T]] = None, replay: int = 0,
+                 key: Optional[Callable[[T], Hashable]] = None, share: Optional[Callable[[T], Any]] = None):
         self.__streams: Set[Queue[T]] = set()
+        self.__keyed: Dict[Hashable, Set[Queue[T]]] = {}
+        self.__key: Callable[[T], Hashable] = key or (lambda x: x)
+        self.__replay: Deque[Event] = deque(maxlen=replay)
+        #: number of delivered events (including events from other processes) - sequence number of the last event
+        self.version = 0
+        self.name = name
+        self.parse: Callable[[Any], T] = parse or (lambda x: x)
+        #: payload sent to other processes
+        self.share: Callable[[T], Any] = share or (lambda x: x)
+        if name is not None:
+            _channels.setdefault(name, WeakSet()).add(self)
 
     @contextmanager
-    def subscribe(self, own_queue: Optional['Queue[T]'] = None) -> ContextManager['Queue[T]']:
+    def subscribe(self, own_queue: Optional['Queue[T]'] = None, key: Optional[Hashable] = None) \
+            -> ContextManager['Queue[T]']:
         """
         Create queue that will listen for the event. Queue will be automatically unsubscribed.
         A new queue will be created if no own queue will be provided.
+
+        :param own_queue: queue to put events
+        :param key: receive only events with the key, None - all events
         """
         queue: Queue[T] = own_queue or Queue()
-        self.__streams.add(queue)
+        streams = self.__streams if key is None else self.__keyed.setdefault(key, set())
+        streams.add(queue)
         try:
             yield queue
         finally:
-            self.__streams.remove(queue)
+            streams.remove(queue)
+            if key is not None and not streams:
+                del self.__keyed[key]
+
+    @contextmanager
+    def resume(self, after: Optional[int] = None,
+               own_queue: Optional['Queue[Optional[Event]]'] = None,
+               key: Optional[Hashable] = None) -> ContextManager['Queue[Optional[Event]]']:
+        """
+        Create queue that will listen for events with sequence numbers. Events emitted after the provided
+        sequence number are taken from the replay buffer and put to the queue first.
+        The same queue could be used for several emitters (events are distinguished by ``Event.emitter``).
+
+        :param after: sequence number of the last received event, None - only new events
+        :param own_queue: queue to put events, a new queue will be created if not set
+        :param key: receive only events with the key, None - all events
+        :raises EventsLost: if some events after the sequence number are not available
+        """
+        queue: Queue[Optional[Event]] = own_queue or Queue()
+        for event in (self.since(after) if after is not None else ()):
+            if key is None or self.__key(event.payload) == key:
+                queue.put_nowait(event)
+        with self.subscribe(_Sequencer(self, queue), key):
+            yield queue
+
+    def since(self, sequence: int) -> List[Event]:
+        """
+        Events from the replay buffer emitted after the sequence number
+
+        :raises EventsLost: if some events after the sequence number are not available
+        """
+        oldest = self.__replay[0].sequence if self.__replay else self.version + 1
+        if sequence > self.version or sequence < oldest - 1:
+            raise EventsLost(f'events after {sequence} are not available (available {oldest}-{self.version})')
+        return [event for event in self.__replay if event.sequence > sequence]
 
     def emit(self, payload: T):
         """
         Emit event. Non-blocking operation.
         """
+        self.deliver(payload)
+        if self.name is not None and _bus is not None:
+            _bus.publish(self.name, self.share(payload))
+
+    def deliver(self, payload: T):
+        """
+        Deliver event to local subscribers only.
+        """
+        self.version += 1
+        if self.__replay.maxlen:
+            self.__replay.append(Event(self, self.version, payload))
         for stream in self.__streams:
             stream.put_nowait(payload)
+        if self.__keyed:
+            for stream in self.__keyed.get(self.__key(payload), ()):
+                stream.put_nowait(payload)
+
+    def close(self):
+        """
+        Notify all subscribers that no more events will be emitted: each queue receives ``None``.
+        """
+        for stream in self.__streams:
+            stream.put_nowait(None)
+        for streams in self.__keyed.values():
+            for stream in streams:
+                stream.put_nowait(None)
 
     def __call__(self, func: Callable[[T], Awaitable]):
         """
@@ -77,18 +259,22 @@ class Emitter(Generic[T]):
         Important: event listener will be created on next event loop tick.
 
         Exceptions (except KeyboardInterruption and CancelledError) will be caught and reported to log.
+        Listener stops when emitter is closed.
         """
 
         async def listener():
             logger = getLogger('event:' + func.__qualname__)
             with self.subscribe() as queue:
-                payload = await queue.get()
-                try:
-                    await func(payload)
-                except (KeyboardInterrupt, CancelledError):
-                    raise
-                except Exception as ex:
-                    logger.warning("failed to process event: %v", ex, exc_info=ex)
+                while True:
+                    payload = await queue.get()
+                    if payload is None:
+                        break
+                    try:
+                        await func(payload)
+                    except (KeyboardInterrupt, CancelledError):
+                        raise
+                    except Exception as ex:
+                        logger.warning("failed to process event: %s", ex, exc_info=ex)
 
         get_event_loop().create_task(listener())
         return func
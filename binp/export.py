@@ -0,0 +1,132 @@
+from csv import writer
+from enum import Enum
+from io import StringIO
+from json import dumps, loads
+from typing import AsyncIterator, Union
+from zlib import compressobj, decompressobj, MAX_WBITS
+
+from binp.journals import Headline, Journal
+
+#: approximate size of produced chunks in bytes
+CHUNK_SIZE = 64 * 1024
+
+#: CSV columns, records (if exported) are serialized as JSON array in the last column
+COLUMNS = ('id', 'operation', 'description', 'started_at', 'finished_at', 'error', 'duration', 'labels', 'records')
+
+
+class Format(str, Enum):
+    """
+    Export format
+    """
+    #: one JSON object per line
+    ndjson = 'ndjson'
+    #: comma-separated values with header, labels are joined by ``;``
+    csv = 'csv'
+
+    @property
+    def media_type(self) -> str:
+        return 'application/x-ndjson' if self == Format.ndjson else 'text/csv'
+
+
+async def ndjson(journals: AsyncIterator[Union[Headline, Journal]]) -> AsyncIterator[bytes]:
+    """
+    Serialize journals as newline-delimited JSON
+    """
+    buffer = []
+    size = 0
+    async for journal in journals:
+        line = journal.json(ensure_ascii=False) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+async def csv(journals: AsyncIterator[Union[Headline, Journal]]) -> AsyncIterator[bytes]:
+    """
+    Serialize journals as CSV with header
+    """
+    output = StringIO()
+    out = writer(output)
+    out.writerow(COLUMNS)
+    async for journal in journals:
+        records = getattr(journal, 'records', None)
+        out.writerow((
+            journal.id,
+            journal.operation,
+            journal.description,
+            journal.started_at.isoformat(),
+            journal.finished_at.isoformat() if journal.finished_at is not None else '',
+            journal.error if journal.error is not None else '',
+            journal.duration if journal.duration is not None else '',
+            ';'.join(journal.labels),
+            dumps([record.dict() for record in records], default=str, ensure_ascii=False) if records is not None else '',
+        ))
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue().encode()
+            output.seek(0)
+            output.truncate()
+    if output.tell() > 0:
+        yield output.getvalue().encode()
+
+
+async def gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Compress stream by gzip
+    """
+    compressor = compressobj(wbits=MAX_WBITS | 16)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def serialize(journals: AsyncIterator[Union[Headline, Journal]], fmt: Format = Format.ndjson,
+              compress: bool = False) -> AsyncIterator[bytes]:
+    """
+    Serialize journals stream to chunks of bytes in required format
+    """
+    chunks = ndjson(journals) if fmt == Format.ndjson else csv(journals)
+    return gzip(chunks) if compress else chunks
+
+
+async def parse_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Journal]:
+    """
+    Parse journals from newline-delimited JSON (as produced by export, plain or gzip compressed).
+    Journals without records are allowed.
+    """
+    decompressor = None
+    detected = False
+    tail = b''
+    async for chunk in chunks:
+        if not detected:
+            # wait for gzip magic bytes
+            tail += chunk
+            if len(tail) < 2:
+                continue
+            detected = True
+            chunk, tail = tail, b''
+            if chunk[:2] == b'\x1f\x8b':
+                decompressor = decompressobj(wbits=MAX_WBITS | 16)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield _parse_journal(line)
+    if decompressor is not None:
+        tail += decompressor.flush()
+    for line in tail.split(b'\n'):
+        if line.strip():
+            yield _parse_journal(line)
+
+
+def _parse_journal(line: bytes) -> Journal:
+    data = loads(line)
+    data.setdefault('records', [])
+    return Journal.parse_obj(data)
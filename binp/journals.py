@@ -1,17 +1,25 @@
+from asyncio import CancelledError, get_event_loop
 from contextvars import ContextVar
 from datetime import datetime
 from functools import wraps
+from itertools import count
 from json import dumps, loads
 from logging import getLogger
 from time import monotonic
-from typing import List, Optional, Union, Any, Dict, Mapping, Collection, Tuple
+from typing import List, Optional, Union, Any, Dict, Mapping, Collection, Tuple, Callable, AsyncIterator, \
+    AsyncIterable, Iterable, TYPE_CHECKING
 
-from databases import Database
 from pydantic.main import BaseModel
 
-from binp.db import ensure
+from binp.blobs import BlobStore, REFERENCE
+from binp.db import ensure, returning, timestamp, insert_many, reserve_ids, drop_indexes, restore_indexes
 from binp.events import Emitter
 
+if TYPE_CHECKING:
+    from databases import Database
+
+    from binp.archive import Archive
+
 """
 Current journal record ID. Can be used only from functions under @journal.log decorators.
 Useful to link some other entities to the journal record.
@@ -19,6 +27,13 @@ It's not recommended modify the variable outside core module.
 """
 current_journal: ContextVar[Optional[int]] = ContextVar('current_journal', default=None)
 
+"""
+Callback invoked with journal ID each time journal is opened in the current context (with None if the call is not
+sampled, so it's not journaled during execution).
+Used by background actions to report journal ID before completion. Internal use only.
+"""
+journal_opened: ContextVar[Optional[Callable[[Optional[int]], None]]] = ContextVar('journal_opened', default=None)
+
 
 class Record(BaseModel):
     """
@@ -75,12 +90,178 @@ class Journal(Headline):
     records: List[Record]
 
 
+class OperationStats(BaseModel):
+    """
+    Aggregated statistics of journaled operation, including calls skipped by sampling
+    """
+    operation: str
+    description: str
+    #: every N-th successful call is journaled (None - all calls or only failed and slow if ``slow`` set)
+    sample: Optional[int] = None
+    #: successful calls slower than threshold (in seconds) are journaled
+    slow: Optional[float] = None
+    #: number of finished calls
+    calls: int = 0
+    #: number of failed (or cancelled) calls
+    failed: int = 0
+    #: number of journaled calls
+    journaled: int = 0
+    #: total duration of calls in seconds
+    duration: float = 0
+    #: the slowest call duration in seconds
+    max_duration: float = 0
+
+
+class ImportStats(BaseModel):
+    """
+    Result of bulk import
+    """
+    #: number of imported journals
+    journals: int = 0
+    #: number of imported records
+    records: int = 0
+
+
+#: tables with journals data
+JOURNAL_TABLES = ('journal', 'journal_label', 'record', 'record_field')
+
+
+class _Deferred:
+    # records and labels of call which is not journaled (yet): kept in memory as-is, serialized only
+    # if the call will be journaled after all (failed or slow)
+    __slots__ = ('records', 'labels')
+
+    def __init__(self):
+        self.records: List[Tuple[str, datetime, Dict[str, Any]]] = []
+        self.labels: List[str] = []
+
+
+_deferred: ContextVar[Optional[_Deferred]] = ContextVar('_deferred', default=None)
+
+
+class Versions:
+    """
+    In-memory versions of journals, without database access. Each change gets the next value of a counter,
+    so version of a journal is the counter value at its latest change and the counter itself is a version
+    of all journals.
+
+    Only ``capacity`` recently changed journals are tracked. Unknown (evicted or not changed since start) journals
+    get the highest evicted version: it's never lower than the actual version, so a changed journal never keeps
+    the version it had before the change.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.__capacity = capacity
+        self.__current = 0
+        self.__floor = 0
+        self.__journals: Dict[int, int] = {}
+
+    @property
+    def current(self) -> int:
+        """
+        Version of all journals
+        """
+        return self.__current
+
+    def get(self, journal_id: int) -> int:
+        """
+        Version of single journal
+        """
+        return self.__journals.get(journal_id, self.__floor)
+
+    def bump(self, journal_id: Optional[int] = None):
+        """
+        Register change of journal (or new journals without ID)
+        """
+        self.__current += 1
+        if journal_id is None:
+            return
+        self.__journals.pop(journal_id, None)
+        self.__journals[journal_id] = self.__current
+        if len(self.__journals) > self.__capacity:
+            oldest = next(iter(self.__journals))
+            self.__floor = max(self.__floor, self.__journals.pop(oldest))
+
+    def reset(self):
+        """
+        Register change of unknown set of journals: versions of all journals are changed
+        """
+        self.__current += 1
+        self.__floor = self.__current
+        self.__journals.clear()
+
+
+class Interned:
+    """
+    Lookup table of repeated strings (operation names, descriptions, field names): each string is stored once
+    and referenced by ID. Both directions are cached in memory. IDs are never changed or reused (archive
+    partitions keep IDs of the main database), so cached values are never invalidated.
+    """
+
+    def __init__(self, table: str):
+        self.table = table
+        self.__ids: Dict[str, int] = {}
+        self.__values: Dict[int, str] = {}
+
+    async def ids(self, db: 'Database', values: Iterable[str]) -> Dict[str, int]:
+        """
+        IDs of strings. Unknown strings are added to the table.
+        """
+        values = list(dict.fromkeys(values))
+        missing = [value for value in values if value not in self.__ids]
+        if missing:
+            await db.execute_many(f'INSERT INTO {self.table} (value) VALUES (:value) ON CONFLICT DO NOTHING',
+                                  values=[{'value': value} for value in missing])
+            await self.__fetch(db, 'value', missing)
+        return {value: self.__ids[value] for value in values}
+
+    async def find(self, db: 'Database', value: str) -> Optional[int]:
+        """
+        ID of string or None if the string was never stored
+        """
+        if value not in self.__ids:
+            await self.__fetch(db, 'value', [value])
+        return self.__ids.get(value)
+
+    async def values(self, db: 'Database', ids: Iterable[int]) -> Dict[int, str]:
+        """
+        Strings by IDs
+        """
+        ids = list(dict.fromkeys(ids))
+        missing = [key for key in ids if key not in self.__values]
+        if missing:
+            await self.__fetch(db, 'id', missing)
+        return {key: self.__values[key] for key in ids}
+
+    async def __fetch(self, db: 'Database', column: str, keys: List[Any], batch_size: int = 500):
+        for offset in range(0, len(keys), batch_size):
+            batch = keys[offset:offset + batch_size]
+            placeholders = ', '.join(f':key_{i}' for i in range(len(batch)))
+            rows = await db.fetch_all(f'SELECT id, value FROM {self.table} WHERE {column} IN ({placeholders})',
+                                      values={f'key_{i}': key for i, key in enumerate(batch)})
+            for row in rows:
+                self.__ids[row['value']] = row['id']
+                self.__values[row['id']] = row['value']
+
+
+class _VersionedEmitter(Emitter[int]):
+    # bumps journal version for each delivered event, including events from other processes
+    def __init__(self, name: str, versions: Versions, replay: int):
+        super().__init__(name, replay=replay)
+        self.__versions = versions
+
+    def deliver(self, payload: int):
+        self.__versions.bump(payload)
+        super().deliver(payload)
+
+
 class Journals:
     """
     Journal of logged invokes.
 
     Should be used as decorator for async methods. Will create, track and record changes automatically.
     In case of exception, the error will be logged and an exception re-raised.
+    Cancelled operations are finished with ``cancelled`` error.
 
     :Example:
 
@@ -153,21 +334,103 @@ class Journals:
 
     :Events:
 
-    * ``journal_updated`` - when journal created or updated. Emits journal ID
+    * ``journal_updated`` - when journal created or updated (including labels). Emits journal ID
     * ``record_added`` - when record added. Emits journal ID
 
+    Latest ``replay`` events are kept, so disconnected subscribers could resume (see ``Emitter.resume``).
+
+    :Archive:
+
+    Old journals could be moved to monthly SQLite files (see :class:`binp.archive.Archive`).
+    History, search and get are working across current database and archive transparently.
+
+    .. code-block:: python
+
+       from pathlib import Path
+       from binp import BINP
+       from binp.archive import Archive
+       from binp.journals import Journals
+
+       binp = BINP(journal=Journals(archive=Archive(Path('archive'))))
+
+    :Large fields:
+
+    Fields bigger than threshold (ex: HTTP bodies or files) could be saved outside of database
+    (see :class:`binp.blobs.BlobStore`): record keeps only reference to content-addressed file,
+    so the database stays compact and journals are loaded without parsing megabytes of JSON.
+    Enabled by default for ``BINP`` instance (``BLOB_THRESHOLD``, ``BLOBS_DIR``).
+
+    .. code-block:: python
+
+       @binp.journal
+       async def invoke():
+           response = await fetch_something()
+           # saved as blob if bigger than threshold
+           await binp.journal.record('fetched', body=response.text)
+
+    :Sampling:
+
+    Journaling of very hot operations could cost more than the work itself. Sampling keeps only a part of calls:
+    all failed calls, every ``sample``-th successful call and successful calls slower than ``slow`` seconds.
+
+    .. code-block:: python
+
+       @binp.journal(sample=100, slow=0.5)
+       async def handle_message(message: Message):
+           await binp.journal.record('handled', size=len(message.body))
+
+    Not sampled calls are not written to database: ``current_journal`` is None, ``record`` and ``labels`` just
+    keep arguments in memory. If such call fails or turns out to be slow, it's journaled after completion
+    with all records. Skipped calls are counted in operations statistics (see :attr:`operations`,
+    ``/internal/journals/operations``).
+
     **Important!** Never set current journal manually.
     """
 
-    def __init__(self, database: Optional[Database] = None):
+    def __init__(self, database: Optional['Database'] = None, archive: Optional['Archive'] = None,
+                 replay: int = 1000, blobs: Optional[BlobStore] = None):
+        """
+        :param database: database for journals, default database will be used if not set
+        :param archive: archive of old journals
+        :param replay: number of latest events kept by each emitter for resumed subscriptions
+        :param blobs: storage for large record fields (kept in database if not set)
+        """
         self.__db = ensure(database)
-        self.journal_updated: Emitter[int] = Emitter()
-        self.record_added: Emitter[int] = Emitter()
+        self.__archive = archive
+        #: storage of large record fields
+        self.blobs = blobs
+        self.__versions = Versions()
+        self.journal_updated: Emitter[int] = _VersionedEmitter('journal_updated', self.__versions, replay)
+        self.record_added: Emitter[int] = _VersionedEmitter('record_added', self.__versions, replay)
+        self.__pending: Dict[int, float] = {}
+        self.__operations = Interned('operation_name')
+        self.__descriptions = Interned('operation_description')
+        self.__fields = Interned('field_name')
+        self.__statistics: Dict[str, OperationStats] = {}
 
-    def __call__(self, func=None, *, operation: Optional[str] = None, description: Optional[str] = None):
+    @classmethod
+    def from_env(cls) -> 'Journals':
+        """
+        Journals in default database with large fields offloaded to blobs (see :meth:`BlobStore.from_env`)
+        """
+        return cls(blobs=BlobStore.from_env())
+
+    def __call__(self, func=None, *, operation: Optional[str] = None, description: Optional[str] = None,
+                 sample: Optional[int] = None, slow: Optional[float] = None):
         """
         Decorator that tracks operation and put it to journal.
+
+        :param operation: operation name, default is fully-qualified function name
+        :param description: operation description, default is function doc-string
+        :param sample: journal only every N-th successful call (failed calls are always journaled)
+        :param slow: journal successful calls slower than threshold (in seconds). If set without ``sample``,
+                     only failed and slow calls are journaled
         """
+        if sample is not None and sample < 1:
+            raise ValueError('sample should be positive')
+        if slow is not None and slow < 0:
+            raise ValueError('slow threshold should not be negative')
+        sampled = sample is not None or slow is not None
 
         def trace_operation(fn):
             nonlocal operation
@@ -178,21 +441,32 @@ class Journals:
             if description is None:
                 description = "\n".join(line.strip() for line in (fn.__doc__ or '').splitlines()).strip()
 
+            stats = OperationStats(operation=operation, description=description, sample=sample, slow=slow)
+            self.__statistics[operation] = stats
+            calls = count()
+
             @wraps(fn)
             async def wrapper(*args, **kwargs):
+                if sampled and (sample is None or next(calls) % sample != 0):
+                    return await self.__deferred(stats, fn, args, kwargs)
 
                 a = monotonic()
-                ex: Optional[Exception] = None
+                ex: Optional[BaseException] = None
                 rec = await self.__begin(operation, description)
                 token = current_journal.set(rec)
+                notify = journal_opened.get()
+                if notify is not None:
+                    notify(rec)
                 try:
                     return await fn(*args, **kwargs)
-                except Exception as f_ex:
+                except (Exception, CancelledError) as f_ex:
                     ex = f_ex
                     raise
                 finally:
                     current_journal.reset(token)
-                    await self.__end(rec, monotonic() - a, ex)
+                    delta = monotonic() - a
+                    self.__count(stats, delta, ex, True)
+                    await self.__end(rec, delta, ex)
 
             return wrapper
 
@@ -200,22 +474,18 @@ class Journals:
             return trace_operation
         return trace_operation(func)
 
+    @property
+    def operations(self) -> List[OperationStats]:
+        """
+        Statistics of journaled operations (since start)
+        """
+        return list(self.__statistics.values())
+
     async def history(self, offset: int = 0, limit: int = 20) -> List[Headline]:
         """
         Get journal headlines in reverse order (newest - first).
         """
-        db = await self.__db()
-        rows = await db.fetch_all('''
-            SELECT * FROM journal ORDER BY id DESC LIMIT :limit OFFSET :offset
-        ''', values={
-            'offset': offset,
-            'limit': limit
-        })
-        ans = []
-        for info in rows:
-            labels = await self.__fetch_labels(info['id'])
-            ans.append(Headline.from_database(info, labels))
-        return ans
+        return await self.__select('', {}, offset, limit)
 
     async def search(self, operation: Optional[str] = None,
                      failed: Optional[bool] = None,
@@ -235,87 +505,152 @@ class Journals:
         :param offset: how many records to skip
         :param limit: maximum number of records to return
         """
-        conditions = []
-        args = {
-            'offset': offset,
-            'limit': limit
-        }
+        operation_id = None
         if operation is not None:
-            conditions.append('operation = :operation')
-            args['operation'] = operation
-        if failed is not None:
-            if failed:
-                conditions.append('error IS NOT NULL')
-            else:
-                conditions.append('error IS NULL')
-        if pending is not None:
-            if pending:
-                conditions.append('finished_at IS NULL')
-            else:
-                conditions.append('finished_at IS NOT NULL')
-        if labels is not None:
-            opts = []
-            for i, label in enumerate(labels):
-                key = f'label_{i}'
-                args[key] = label
-                opts.append(":" + key)
+            operation_id = await self.__operations.find(await self.__db(), operation)
+            if operation_id is None:
+                return []
+        where, args = self.__conditions(operation_id, failed, pending, labels)
+        if not where:
+            return await self.history(offset, limit)
+        getLogger(self.__class__.__qualname__).debug('search condition: %s', where)
+        return await self.__select(where, args, offset, limit)
 
-            conditions.append(
-                f'id IN (SELECT distinct(journal_id) FROM journal_label WHERE label IN ({",".join(opts)}))')
+    async def export(self, operation: Optional[str] = None,
+                     failed: Optional[bool] = None,
+                     pending: Optional[bool] = None,
+                     labels: Optional[Collection[str]] = None,
+                     since: Optional[datetime] = None,
+                     after: int = 0,
+                     records: bool = False,
+                     batch_size: int = 500) -> AsyncIterator[Union[Headline, Journal]]:
+        """
+        Stream journals (including archived) in natural order (oldest - first) in constant memory.
 
-        if len(conditions) == 0:
-            return await self.history(offset, limit)
+        Journals are read in batches by ID (keyset pagination), labels and records are fetched once per batch.
+        Conditions are the same as for search().
 
-        where = ' AND '.join(conditions)
-        query = f'SELECT journal.* FROM journal WHERE {where} ORDER BY id LIMIT :limit OFFSET :offset'
-        getLogger(self.__class__.__qualname__).debug('search query: %s', query)
-        db = await self.__db()
-        rows = await db.fetch_all(query, values=args)
+        .. code-block:: python
 
-        ans = []
-        for info in rows:
-            labels = await self.__fetch_labels(info['id'])
-            ans.append(Headline.from_database(info, labels))
+           async for journal in binp.journal.export(failed=True, records=True):
+               print(journal.json())
 
-        return ans
+        :param since: only journals started at or after this time
+        :param after: only journals with ID greater than provided (to continue previous export)
+        :param records: include records with fields (returns Journal instead of Headline), large fields saved
+                        as blobs are inlined, so the export is self-contained
+        :param batch_size: number of journals read by one query
+        """
+        operation_id = None
+        if operation is not None:
+            operation_id = await self.__operations.find(await self.__db(), operation)
+            if operation_id is None:
+                return
+        where, args = self.__conditions(operation_id, failed, pending, labels)
+        conditions = [where[len('WHERE '):]] if where else []
+        conditions.append('id > :after')
+        if since is not None:
+            conditions.append('started_at >= :since')
+        query = f'SELECT * FROM journal WHERE {" AND ".join(conditions)} ORDER BY id LIMIT :limit'
+        async for db in self.__sources(oldest_first=True):
+            if since is not None:
+                args['since'] = timestamp(db, since)
+            while True:
+                rows = await db.fetch_all(query, values={**args, 'after': after, 'limit': batch_size})
+                if not rows:
+                    break
+                after = rows[-1]['id']
+                for item in await self.__load_batch(db, rows, records):
+                    if records and self.blobs is not None:
+                        await self.__inline_blobs(item)
+                    yield item
+                if len(rows) < batch_size:
+                    break
+
+    async def load(self, journals: Union[Iterable[Union[Headline, Journal]], AsyncIterable[Union[Headline, Journal]]],
+                   batch_size: int = 1000,
+                   rebuild_indexes: bool = False,
+                   remap: Optional[Callable[[int, int], None]] = None) -> ImportStats:
+        """
+        Bulk import of journals (ex: produced by export() from another database) with labels and records.
+
+        Journals are inserted by multi-row statements, one transaction per batch. Imported journals
+        and records get new IDs; pairs of original and new journal ID are reported to ``remap``.
+        Large fields are saved as blobs (if enabled) as for new records. Events are not emitted.
+
+        .. code-block:: python
+
+           from binp.export import parse_ndjson
+
+           async def restore(chunks):
+               stats = await binp.journal.load(parse_ndjson(chunks), rebuild_indexes=True)
+               print("imported", stats.journals, "journals")
+
+        :param journals: journals to import
+        :param batch_size: number of journals in one transaction
+        :param rebuild_indexes: drop secondary indexes before import and create them after (faster for large imports)
+        :param remap: callback with original and new journal ID
+        """
+        db = await self.__db()
+        stats = ImportStats()
+        indexes = await drop_indexes(db, JOURNAL_TABLES) if rebuild_indexes else []
+        try:
+            batch = []
+            async for journal in self.__iterate(journals):
+                batch.append(journal)
+                if len(batch) >= batch_size:
+                    await self.__import_batch(db, batch, stats, remap)
+                    batch = []
+            if batch:
+                await self.__import_batch(db, batch, stats, remap)
+        finally:
+            await restore_indexes(db, indexes)
+            self.__versions.bump()
+        getLogger(self.__class__.__qualname__).info("imported %d journals and %d records",
+                                                    stats.journals, stats.records)
+        return stats
 
     async def get(self, journal_id: int) -> Optional[Journal]:
         """
         Get single journal by ID
         """
-        db = await self.__db()
-
-        info = await db.fetch_one('SELECT * FROM journal WHERE id = :journal_id', values={
-            'journal_id': journal_id
-        })
-        if info is None:
+        found = await self.__locate(journal_id)
+        if found is None:
             return None
-
-        headline = await self.headline(journal_id)
-        if headline is None:
-            return None
-
-        records = await self.__fetch_records(journal_id)
+        db, info = found
+        labels = await self.__fetch_labels(db, journal_id)
+        records = await self.__fetch_records(db, journal_id)
 
         return Journal(
             records=records,
-            **dict(headline),
+            **dict(Headline.from_database(info, labels)),
         )
 
     async def headline(self, journal_id: int) -> Optional[Headline]:
         """
         Get single journal headline (without records) by ID
         """
-        db = await self.__db()
-
-        info = await db.fetch_one('SELECT * FROM journal WHERE id = :journal_id', values={
-            'journal_id': journal_id
-        })
-        if info is None:
+        found = await self.__locate(journal_id)
+        if found is None:
             return None
-        labels = await self.__fetch_labels(journal_id)
+        db, info = found
+        labels = await self.__fetch_labels(db, journal_id)
         return Headline.from_database(info, labels)
 
+    def version(self, journal_id: Optional[int] = None) -> str:
+        """
+        Opaque version of single journal (or of all journals if ID is not set) which is changed each time
+        the journal is created or updated. Doesn't touch database, so it's cheap enough to be used for
+        conditional requests (ETag). Versions are tracked in memory and valid only within the current process.
+
+        Version should be obtained before reading the journal: if the journal is changed in between,
+        the version will be older than the content, and the next check will detect the change.
+        """
+        version = self.__versions.current if journal_id is None else self.__versions.get(journal_id)
+        if self.__archive is not None:
+            return f'{self.__archive.generation}.{version}'
+        return str(version)
+
     async def labels(self, *labels: str):
         """
         Assign labels to journal. Duplicated labels will be ignored. Only under @journal function.
@@ -323,13 +658,19 @@ class Journals:
         logger = getLogger(self.__class__.__qualname__)
         journal_id = current_journal.get()
         if journal_id is None:
+            deferred = _deferred.get()
+            if deferred is not None:
+                deferred.labels.extend(labels)
+                return
             logger.warning('function no marked as @journal - label will not be assigned')
             return
         db = await self.__db()
-        await db.execute_many('INSERT OR IGNORE INTO journal_label (journal_id, label) VALUES (:journal_id, :label)',
+        await db.execute_many('''INSERT INTO journal_label (journal_id, label) VALUES (:journal_id, :label)
+                                 ON CONFLICT (journal_id, label) DO NOTHING''',
                               values=[
                                   {'journal_id': journal_id, 'label': label} for label in labels
                               ])
+        self.journal_updated.emit(journal_id)
 
     async def record(self, message: str, **events: Union[BaseModel, str, int, float, bool]):
         """
@@ -343,36 +684,97 @@ class Journals:
         logger = getLogger(self.__class__.__qualname__)
         journal_id = current_journal.get()
         if journal_id is None:
+            deferred = _deferred.get()
+            if deferred is not None:
+                # call is not sampled: nothing is written unless the call will be journaled after completion
+                deferred.records.append((message, datetime.utcnow(), events))
+                return
             logger.warning('function no marked as @journal - event will not be published')
             return
 
         db = await self.__db()
-
-        async with db.transaction():
-            await db.execute('''INSERT INTO record (journal_id, message) VALUES (:journal_id, :message)''', values={
-                'journal_id': journal_id,
-                'message': message or '',
-            })
-            record_id = (await db.fetch_one('SELECT last_insert_rowid()'))[0]
+        query = '''INSERT INTO record (journal_id, message) VALUES (:journal_id, :message)'''
+        values = {
+            'journal_id': journal_id,
+            'message': message or '',
+        }
+        if not events:
+            # record id is not needed - single statement without transaction
+            await db.execute(query, values=values)
             logger.info(message)
-            await db.execute_many('''INSERT INTO record_field (record_id, name, value) 
-                                   VALUES (:record_id, :name, :value)
-                                   ''', values=[{
-                'name': name,
-                'value': value.json() if isinstance(value, BaseModel) else dumps(value, ensure_ascii=False),
-                'record_id': record_id
-            } for name, value in events.items()])
+        else:
+            # large fields are saved to blobs before transaction: database is not locked by file writes
+            fields = await self.__serialize_fields(events)
+            names = await self.__fields.ids(db, (name for name, _ in fields))
+            fields = [(names[name], value) for name, value in fields]
+            async with db.transaction():
+                record_id = await self.__insert(db, query, values)
+                logger.info(message)
+                await self.__insert_fields(db, record_id, fields)
         self.record_added.emit(journal_id)
 
+    async def sweep_blobs(self, grace: float = 3600) -> int:
+        """
+        Remove blobs which are not referenced by records of current database and archive (ex: after
+        removing or importing journals). Does nothing if blobs are not enabled.
+
+        :param grace: blobs younger than grace period (in seconds) are kept
+        :return: number of removed blobs
+        """
+        if self.blobs is None:
+            return 0
+        referenced = set()
+        async for db in self.__sources():
+            for row in await db.fetch_all('SELECT value FROM record_field WHERE value LIKE :pattern',
+                                          values={'pattern': f'{{"{REFERENCE}":%'}):
+                digest = self.blobs.digest(loads(row['value']))
+                if digest is not None:
+                    referenced.add(digest)
+        return await get_event_loop().run_in_executor(None, self.blobs.sweep, referenced, grace)
+
     async def remove_dead(self):
         """
         Remove all records without finish_at timestamp. Should be called only once BEFORE any writes.
         """
         db = await self.__db()
-        await db.execute('''
+        async with db.transaction():
+            await db.execute('''
+                   DELETE FROM record_field
+                   WHERE record_id IN (SELECT record.id FROM record
+                                       INNER JOIN journal ON journal.id = record.journal_id
+                                       WHERE journal.finished_at IS NULL)
+               ''')
+            await db.execute('''
+                   DELETE FROM record
+                   WHERE journal_id IN (SELECT id FROM journal WHERE finished_at IS NULL)
+               ''')
+            await db.execute('''
+                   DELETE FROM journal_label
+                   WHERE journal_id IN (SELECT id FROM journal WHERE finished_at IS NULL)
+               ''')
+            await db.execute('''
                    DELETE FROM journal
                    WHERE finished_at IS NULL
                ''')
+        self.__versions.reset()
+
+    async def close(self):
+        """
+        Finish journals which are still pending (ex: on shutdown) with an error,
+        so they will not stay unfinished in the database. Connections to archive (if any) are closed.
+        Functions which are still running after close do not update their journals anymore.
+        """
+        while self.__pending:
+            journal_id, started = self.__pending.popitem()
+            await self.__finish(journal_id, monotonic() - started, 'interrupted by shutdown')
+        if self.__archive is not None:
+            await self.__archive.close()
+
+    async def database(self) -> 'Database':
+        """
+        Current (not archived) database of journals (default database is connected and migrated on first call)
+        """
+        return await self.__db()
 
     @property
     def current(self) -> Optional[int]:
@@ -381,8 +783,119 @@ class Journals:
         """
         return current_journal.get()
 
-    async def __fetch_labels(self, journal_id: int) -> List[str]:
+    async def __sources(self, oldest_first: bool = False) -> AsyncIterator['Database']:
+        # current database first, then archived partitions from newest to oldest (or in reverse order)
+        partitions = self.__archive.partitions() if self.__archive is not None else []
+        if not oldest_first:
+            yield await self.__db()
+        for name in (reversed(partitions) if oldest_first else partitions):
+            yield (await self.__archive.open(name)).db
+        if oldest_first:
+            yield await self.__db()
+
+    @staticmethod
+    def __conditions(operation_id: Optional[int],
+                     failed: Optional[bool],
+                     pending: Optional[bool],
+                     labels: Optional[Collection[str]]) -> Tuple[str, Dict[str, Any]]:
+        conditions = []
+        args = {}
+        if operation_id is not None:
+            conditions.append('operation_id = :operation_id')
+            args['operation_id'] = operation_id
+        if failed is not None:
+            if failed:
+                conditions.append('error IS NOT NULL')
+            else:
+                conditions.append('error IS NULL')
+        if pending is not None:
+            if pending:
+                conditions.append('finished_at IS NULL')
+            else:
+                conditions.append('finished_at IS NOT NULL')
+        if labels is not None:
+            opts = []
+            for i, label in enumerate(labels):
+                key = f'label_{i}'
+                args[key] = label
+                opts.append(":" + key)
+
+            conditions.append(
+                f'id IN (SELECT distinct(journal_id) FROM journal_label WHERE label IN ({",".join(opts)}))')
+        if not conditions:
+            return '', args
+        return 'WHERE ' + ' AND '.join(conditions), args
+
+    async def __load_batch(self, db: 'Database', rows: List[Mapping],
+                           records: bool) -> List[Union[Headline, Journal]]:
+        rows = await self.__named(db, rows)
+        ids = [row['id'] for row in rows]
+        keys = ', '.join(f':id_{i}' for i in range(len(ids)))
+        args = {f'id_{i}': journal_id for i, journal_id in enumerate(ids)}
+        labels: Dict[int, List[str]] = {journal_id: [] for journal_id in ids}
+        for row in await db.fetch_all(f'SELECT journal_id, label FROM journal_label WHERE journal_id IN ({keys})',
+                                      values=args):
+            labels[row['journal_id']].append(row['label'])
+        if not records:
+            return [Headline.from_database(row, labels[row['id']]) for row in rows]
+
+        fields: Dict[int, Dict[str, Any]] = {}
+        field_rows = await db.fetch_all(f'''SELECT record_field.* FROM record_field
+                                           INNER JOIN record ON record.id = record_field.record_id
+                                           WHERE record.journal_id IN ({keys})''', values=args)
+        names = await self.__fields.values(db, (row['name_id'] for row in field_rows))
+        for row in field_rows:
+            fields.setdefault(row['record_id'], {})[names[row['name_id']]] = loads(row['value'])
+        journal_records: Dict[int, List[Record]] = {journal_id: [] for journal_id in ids}
+        for row in await db.fetch_all(f'SELECT * FROM record WHERE journal_id IN ({keys}) ORDER BY id',
+                                      values=args):
+            journal_records[row['journal_id']].append(Record(
+                message=row['message'],
+                created_at=row['created_at'],
+                params=fields.get(row['id'], {}),
+            ))
+        return [Journal(records=journal_records[row['id']], **dict(Headline.from_database(row, labels[row['id']])))
+                for row in rows]
+
+    async def __select(self, where: str, args: Dict[str, Any], offset: int, limit: int) -> List[Headline]:
+        ans = []
+        async for db in self.__sources():
+            rows = await db.fetch_all(f'SELECT * FROM journal {where} ORDER BY id DESC LIMIT :limit OFFSET :offset',
+                                      values={**args, 'limit': limit - len(ans), 'offset': offset})
+            if not rows and offset > 0:
+                # whole source skipped by offset - find out how many rows were skipped
+                skipped = (await db.fetch_one(f'SELECT count(*) FROM journal {where}', values=args))[0]
+                offset -= min(offset, skipped)
+                continue
+            offset = 0
+            for info in await self.__named(db, rows):
+                labels = await self.__fetch_labels(db, info['id'])
+                ans.append(Headline.from_database(info, labels))
+            if len(ans) >= limit:
+                break
+        return ans
+
+    async def __locate(self, journal_id: int) -> Optional[Tuple['Database', Mapping]]:
         db = await self.__db()
+        info = await db.fetch_one('SELECT * FROM journal WHERE id = :journal_id', values={
+            'journal_id': journal_id
+        })
+        if info is not None:
+            return db, (await self.__named(db, [info]))[0]
+        if self.__archive is None:
+            return None
+        partition = await self.__archive.find(journal_id)
+        if partition is None:
+            return None
+        info = await partition.db.fetch_one('SELECT * FROM journal WHERE id = :journal_id', values={
+            'journal_id': journal_id
+        })
+        if info is None:
+            return None
+        return partition.db, (await self.__named(partition.db, [info]))[0]
+
+    @staticmethod
+    async def __fetch_labels(db: 'Database', journal_id: int) -> List[str]:
         rows = await db.fetch_all('SELECT label FROM journal_label WHERE journal_id = :journal_id', values={
             'journal_id': journal_id
         })
@@ -390,8 +903,7 @@ class Journals:
             return []
         return [row['label'] for row in rows]
 
-    async def __fetch_records(self, journal_id: int) -> List[Record]:
-        db = await self.__db()
+    async def __fetch_records(self, db: 'Database', journal_id: int) -> List[Record]:
         rows = await db.fetch_all('SELECT * FROM record WHERE journal_id = :journal_id ORDER BY id DESC', values={
             'journal_id': journal_id
         })
@@ -399,7 +911,7 @@ class Journals:
             return []
         result = []
         for row in rows:
-            fields = await self.__fetch_fields(row['id'])
+            fields = await self.__fetch_fields(db, row['id'])
             result.append(Record(
                 message=row['message'],
                 created_at=row['created_at'],
@@ -407,32 +919,207 @@ class Journals:
             ))
         return result
 
-    async def __fetch_fields(self, record_id: int) -> Dict[str, Any]:
-        db = await self.__db()
-        rows = await db.fetch_all('SELECT name, value FROM record_field WHERE record_id = :record_id', values={
+    async def __fetch_fields(self, db: 'Database', record_id: int) -> Dict[str, Any]:
+        rows = await db.fetch_all('SELECT name_id, value FROM record_field WHERE record_id = :record_id', values={
             'record_id': record_id
         })
         if rows is None or len(rows) == 0:
             return {}
-        return dict((row['name'], loads(row['value'])) for row in rows)
+        names = await self.__fields.values(db, (row['name_id'] for row in rows))
+        return dict((names[row['name_id']], loads(row['value'])) for row in rows)
+
+    async def __named(self, db: 'Database', rows: List[Mapping]) -> List[Dict[str, Any]]:
+        # journal rows with interned operation and description resolved to strings
+        operations = await self.__operations.values(db, (row['operation_id'] for row in rows))
+        descriptions = await self.__descriptions.values(db, (row['description_id'] for row in rows))
+        return [{**row, 'operation': operations[row['operation_id']],
+                 'description': descriptions[row['description_id']]} for row in rows]
+
+    @staticmethod
+    async def __iterate(items: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+        if isinstance(items, AsyncIterable):
+            async for item in items:
+                yield item
+        else:
+            for item in items:
+                yield item
+
+    async def __import_batch(self, db: 'Database', batch: List[Union[Headline, Journal]], stats: ImportStats,
+                             remap: Optional[Callable[[int, int], None]]):
+        journal_rows, label_rows, record_rows, field_rows = [], [], [], []
+        # strings are interned outside of transaction: cached IDs should never be rolled back
+        operations = await self.__operations.ids(db, (item.operation for item in batch))
+        descriptions = await self.__descriptions.ids(db, (item.description for item in batch))
+        names = await self.__fields.ids(db, (name for item in batch for record in getattr(item, 'records', ())
+                                             for name in record.params))
+        # large fields are saved to blobs before transaction: database is not locked by file writes
+        fields = iter([await self.__serialize_fields(record.params)
+                       for item in batch for record in getattr(item, 'records', ())])
+        async with db.transaction():
+            journal_ids = await reserve_ids(db, 'journal', len(batch))
+            record_ids = iter(await reserve_ids(db, 'record', sum(len(getattr(item, 'records', ())) for item in batch)))
+            for journal_id, item in zip(journal_ids, batch):
+                journal_rows.append((journal_id, operations[item.operation], descriptions[item.description],
+                                     timestamp(db, item.started_at),
+                                     item.error, item.duration,
+                                     timestamp(db, item.finished_at) if item.finished_at is not None else None))
+                label_rows.extend((journal_id, label) for label in dict.fromkeys(item.labels))
+                for record in getattr(item, 'records', ()):
+                    record_id = next(record_ids)
+                    record_rows.append((record_id, journal_id, timestamp(db, record.created_at), record.message))
+                    field_rows.extend((record_id, names[name], value) for name, value in next(fields))
+            await insert_many(db, 'journal', ('id', 'operation_id', 'description_id', 'started_at', 'error',
+                                              'duration', 'finished_at'), journal_rows)
+            await insert_many(db, 'journal_label', ('journal_id', 'label'), label_rows)
+            await insert_many(db, 'record', ('id', 'journal_id', 'created_at', 'message'), record_rows)
+            await insert_many(db, 'record_field', ('record_id', 'name_id', 'value'), field_rows)
+        stats.journals += len(journal_rows)
+        stats.records += len(record_rows)
+        if remap is not None:
+            for journal_id, item in zip(journal_ids, batch):
+                remap(item.id, journal_id)
+
+    async def __deferred(self, stats: OperationStats, fn, args, kwargs):
+        # call which is journaled only if it fails or is slow
+        started_at = datetime.utcnow()
+        a = monotonic()
+        ex: Optional[BaseException] = None
+        deferred = _Deferred()
+        notify = journal_opened.get()
+        if notify is not None:
+            # waiting caller (ex: background action) should not wait for completion
+            notify(None)
+        # records of nested functions should not be added to the outer journal
+        token = current_journal.set(None)
+        deferred_token = _deferred.set(deferred)
+        try:
+            return await fn(*args, **kwargs)
+        except (Exception, CancelledError) as f_ex:
+            ex = f_ex
+            raise
+        finally:
+            current_journal.reset(token)
+            _deferred.reset(deferred_token)
+            delta = monotonic() - a
+            keep = ex is not None or (stats.slow is not None and delta >= stats.slow)
+            self.__count(stats, delta, ex, keep)
+            if keep:
+                try:
+                    journal_id = await self.__replay(stats, started_at, delta, ex, deferred)
+                except Exception as replay_ex:
+                    # result (or exception) of the call is more important than its journal
+                    getLogger(self.__class__.__qualname__).error("failed to journal call of %s: %s",
+                                                                 stats.operation, replay_ex, exc_info=replay_ex)
+                else:
+                    if notify is not None:
+                        notify(journal_id)
+
+    @staticmethod
+    def __count(stats: OperationStats, delta: float, exc, journaled: bool):
+        stats.calls += 1
+        stats.duration += delta
+        stats.max_duration = max(stats.max_duration, delta)
+        if exc is not None:
+            stats.failed += 1
+        if journaled:
+            stats.journaled += 1
+
+    async def __replay(self, stats: OperationStats, started_at: datetime, delta: float, exc,
+                       deferred: _Deferred) -> int:
+        # write finished journal of not sampled call with all its records at once
+        if isinstance(exc, CancelledError):
+            exc = 'cancelled'
+        db = await self.__db()
+        records = [(message, created_at, await self.__serialize_fields(events))
+                   for message, created_at, events in deferred.records]
+        names = await self.__fields.ids(db, (name for _, _, fields in records for name, _ in fields))
+        values = {
+            'operation_id': (await self.__operations.ids(db, [stats.operation]))[stats.operation],
+            'description_id': (await self.__descriptions.ids(db, [stats.description]))[stats.description],
+            'started_at': timestamp(db, started_at),
+            'duration': delta,
+            'error': str(exc) if exc is not None else None,
+        }
+        async with db.transaction():
+            journal_id = await self.__insert(db, '''INSERT INTO journal (operation_id, description_id, started_at,
+                                                                      finished_at, duration, error)
+                                                 VALUES (:operation_id, :description_id, :started_at,
+                                                         current_timestamp, :duration, :error)''', values)
+            await insert_many(db, 'journal_label', ('journal_id', 'label'),
+                              [(journal_id, label) for label in dict.fromkeys(deferred.labels)])
+            for message, created_at, fields in records:
+                record_id = await self.__insert(db, '''INSERT INTO record (journal_id, created_at, message)
+                                                    VALUES (:journal_id, :created_at, :message)''', {
+                    'journal_id': journal_id,
+                    'created_at': timestamp(db, created_at),
+                    'message': message or '',
+                })
+                await self.__insert_fields(db, record_id, [(names[name], value) for name, value in fields])
+        self.journal_updated.emit(journal_id)
+        return journal_id
 
     async def __begin(self, name, description) -> int:
         db = await self.__db()
 
-        async with db.transaction():
-            await db.execute('''INSERT INTO journal (operation, description) 
-                        VALUES (:operation, :description)
-                        ''', values={
-                'operation': name,
-                'description': description,
-            })
-            res = await db.fetch_one('SELECT last_insert_rowid()')
-
-        journal_id = res[0]
+        query = '''INSERT INTO journal (operation_id, description_id) VALUES (:operation_id, :description_id)'''
+        values = {
+            'operation_id': (await self.__operations.ids(db, [name]))[name],
+            'description_id': (await self.__descriptions.ids(db, [description]))[description],
+        }
+        if returning(db):
+            journal_id = await self.__insert(db, query, values)
+        else:
+            async with db.transaction():
+                journal_id = await self.__insert(db, query, values)
+
+        self.__pending[journal_id] = monotonic()
         self.journal_updated.emit(journal_id)
         return journal_id
 
+    @staticmethod
+    async def __insert(db: 'Database', query: str, values: Dict[str, Any]) -> int:
+        # without RETURNING should be called inside transaction: for SQLite last inserted id is bound to connection
+        if returning(db):
+            return (await db.fetch_one(query + ' RETURNING id', values=values))[0]
+        await db.execute(query, values=values)
+        return (await db.fetch_one('SELECT last_insert_rowid()'))[0]
+
+    async def __serialize_fields(self, events: Dict[str, Any]) -> List[Tuple[str, str]]:
+        fields = [
+            (name, value.json() if isinstance(value, BaseModel) else dumps(value, ensure_ascii=False))
+            for name, value in events.items()
+        ]
+        if self.blobs is not None:
+            fields = [(name, await self.blobs.offload(value)) for name, value in fields]
+        return fields
+
+    async def __inline_blobs(self, journal: Journal):
+        for record in journal.records:
+            for name, value in record.params.items():
+                if self.blobs.digest(value) is None:
+                    continue
+                try:
+                    record.params[name] = await self.blobs.load(value)
+                except FileNotFoundError as ex:
+                    getLogger(self.__class__.__qualname__).warning("journal %d exported with reference: %s",
+                                                                   journal.id, ex)
+
+    @staticmethod
+    async def __insert_fields(db: 'Database', record_id: int, fields: List[Tuple[int, str]]):
+        # one prepared statement for all fields
+        await insert_many(db, 'record_field', ('record_id', 'name_id', 'value'), [
+            (record_id, name_id, value) for name_id, value in fields
+        ])
+
     async def __end(self, journal_id: int, delta: float, exc=None):
+        if self.__pending.pop(journal_id, None) is None:
+            # already finished by close (shutdown): keep its error, database may be closed
+            return
+        await self.__finish(journal_id, delta, exc)
+
+    async def __finish(self, journal_id: int, delta: float, exc=None):
+        if isinstance(exc, CancelledError):
+            exc = 'cancelled'
         db = await self.__db()
         await db.execute('''
         UPDATE journal
@@ -1,14 +1,31 @@
 from json import dumps, loads
-from typing import Optional, Union, Type, TypeVar, List
+from typing import Optional, Union, Type, TypeVar, List, Dict, Any, TYPE_CHECKING
 
-from databases import Database
 from pydantic.main import BaseModel
 
 from binp.db import ensure
+from binp.events import Emitter
+
+if TYPE_CHECKING:
+    from databases import Database
 
 T = TypeVar('T', bound=BaseModel)
 
 
+class KeyChange(BaseModel):
+    """
+    Change of values in namespace
+    """
+    #: namespace of changed keys
+    namespace: str
+    #: keys with new values
+    changed: List[str] = []
+    #: new values by keys (only in the process where values were set)
+    values: Dict[str, Any] = {}
+    #: removed keys
+    removed: List[str] = []
+
+
 class KV:
     """
     Basic Key-Value storage with namespace.
@@ -57,11 +74,26 @@ class KV:
             saved_value = await binp.kv.load(Author)
             assert value == saved_value
 
+    :Events:
+
+    * ``key_changed`` - when values are set or removed. Emits KeyChange, could be subscribed by namespace as a key.
+      Shared by all namespaces selected from the same storage. Other processes (see ``binp.cluster``) receive
+      only changed keys without values.
+
     """
 
-    def __init__(self, namespace: str = 'default', db: Optional[Database] = None):
+    def __init__(self, namespace: str = 'default', db: Optional['Database'] = None):
         self.__db = ensure(db)
         self.__namespace = namespace
+        self.key_changed: Emitter[KeyChange] = Emitter('key_changed', KeyChange.parse_obj,
+                                                       key=lambda change: change.namespace,
+                                                       share=lambda change: change.copy(update={'values': {}}))
+
+    async def database(self) -> 'Database':
+        """
+        Database of the storage (default database is connected and migrated on first call)
+        """
+        return await self.__db()
 
     async def save(self, value: BaseModel):
         """
@@ -92,13 +124,20 @@ class KV:
         Sav multiple values into storage. All values should be serializable to JSON.
         """
         db = await self.__db()
-        await db.execute_many('INSERT OR REPLACE INTO kv(namespace, key, value) VALUES (:ns, :key, :value)', values=[
+        serialized = {
+            key: (value.json() if isinstance(value, BaseModel) else dumps(value, ensure_ascii=False))
+            for key, value in values.items()
+        }
+        await db.execute_many('''INSERT INTO kv(namespace, key, value) VALUES (:ns, :key, :value)
+                                 ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value''', values=[
             {
                 'ns': self.__namespace,
                 'key': key,
-                'value': (value.json() if isinstance(value, BaseModel) else dumps(value, ensure_ascii=False))
-            } for key, value in values.items()
+                'value': value
+            } for key, value in serialized.items()
         ])
+        self.key_changed.emit(KeyChange(namespace=self.__namespace, changed=list(serialized),
+                                        values={key: loads(value) for key, value in serialized.items()}))
 
     async def remove(self, *names: str):
         """
@@ -108,6 +147,7 @@ class KV:
         await db.execute_many('DELETE FROM kv WHERE namespace = :ns AND key = :key', values=[
             {'ns': self.__namespace, 'key': name} for name in names
         ])
+        self.key_changed.emit(KeyChange(namespace=self.__namespace, removed=list(names)))
 
     async def get(self, name: str) -> Optional[Union[str, int, float, bool, dict]]:
         """
@@ -122,6 +162,14 @@ class KV:
             return None
         return loads(value['value'])
 
+    async def keys(self) -> List[str]:
+        """
+        Fetch all keys in namespace.
+        """
+        db = await self.__db()
+        value = await db.fetch_all('SELECT key FROM kv WHERE namespace = :ns', values={'ns': self.__namespace})
+        return [x['key'] for x in value]
+
     async def namespaces(self) -> List[str]:
         """
         Fetch all namespaces in selected database.
@@ -138,4 +186,5 @@ class KV:
         """
         kv = KV(namespace=namespace, db=None)
         kv.__db = self.__db
+        kv.key_changed = self.key_changed
         return kv
@@ -0,0 +1,38 @@
+CREATE TABLE journal
+(
+    id          BIGSERIAL   NOT NULL PRIMARY KEY,
+    operation   TEXT        NOT NULL,
+    description TEXT        NOT NULL,
+    started_at  TIMESTAMPTZ NOT NULL DEFAULT current_timestamp,
+    error       TEXT,
+    duration    DOUBLE PRECISION,
+    finished_at TIMESTAMPTZ
+);
+
+CREATE TABLE record
+(
+    id         BIGSERIAL   NOT NULL PRIMARY KEY,
+    journal_id BIGINT      NOT NULL REFERENCES journal (id),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT current_timestamp,
+    message    TEXT        NOT NULL
+);
+
+
+CREATE TABLE record_field
+(
+    record_id BIGINT NOT NULL REFERENCES record (id),
+    name      TEXT   NOT NULL,
+    value     TEXT,
+    PRIMARY KEY (record_id, name)
+);
+
+CREATE TABLE kv
+(
+    namespace TEXT NOT NULL,
+    key       TEXT NOT NULL,
+    value     TEXT,
+    PRIMARY KEY (namespace, key)
+);
+
+CREATE INDEX record_journal_idx ON record (journal_id);
+CREATE INDEX record_field_record_idx ON record_field (record_id);
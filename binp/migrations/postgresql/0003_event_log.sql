@@ -0,0 +1,10 @@
+CREATE TABLE event_log
+(
+    id         BIGSERIAL   NOT NULL PRIMARY KEY,
+    origin     TEXT        NOT NULL,
+    channel    TEXT        NOT NULL,
+    payload    TEXT        NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT current_timestamp
+);
+
+CREATE INDEX event_log_created_at_idx ON event_log (created_at);
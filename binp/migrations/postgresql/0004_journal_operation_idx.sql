@@ -0,0 +1,2 @@
+-- binp: online
+CREATE INDEX CONCURRENTLY IF NOT EXISTS journal_operation_idx ON journal (operation);
@@ -0,0 +1,84 @@
+-- repeated strings are stored once and referenced by ID
+CREATE TABLE operation_name
+(
+    id    BIGSERIAL NOT NULL PRIMARY KEY,
+    value TEXT      NOT NULL UNIQUE
+);
+
+-- descriptions could be longer than btree entry limit: uniqueness by hash
+CREATE TABLE operation_description
+(
+    id    BIGSERIAL NOT NULL PRIMARY KEY,
+    value TEXT      NOT NULL
+);
+
+CREATE UNIQUE INDEX operation_description_value_idx ON operation_description (md5(value));
+
+CREATE TABLE field_name
+(
+    id    BIGSERIAL NOT NULL PRIMARY KEY,
+    value TEXT      NOT NULL UNIQUE
+);
+
+INSERT INTO operation_name (value) SELECT DISTINCT operation FROM journal;
+INSERT INTO operation_description (value) SELECT DISTINCT description FROM journal;
+INSERT INTO field_name (value) SELECT DISTINCT name FROM record_field;
+
+ALTER TABLE journal
+    ADD COLUMN operation_id   BIGINT REFERENCES operation_name (id),
+    ADD COLUMN description_id BIGINT REFERENCES operation_description (id);
+
+UPDATE journal
+SET operation_id   = operation_name.id,
+    description_id = operation_description.id
+FROM operation_name,
+     operation_description
+WHERE operation_name.value = journal.operation
+  AND operation_description.value = journal.description;
+
+ALTER TABLE journal
+    ALTER COLUMN operation_id SET NOT NULL,
+    ALTER COLUMN description_id SET NOT NULL;
+
+DROP INDEX IF EXISTS journal_operation_idx;
+
+ALTER TABLE journal
+    DROP COLUMN operation,
+    DROP COLUMN description;
+
+-- the same name as in 0004: the online migration becomes no-op
+CREATE INDEX journal_operation_idx ON journal (operation_id);
+
+ALTER TABLE record_field
+    ADD COLUMN name_id BIGINT REFERENCES field_name (id);
+
+UPDATE record_field
+SET name_id = field_name.id
+FROM field_name
+WHERE field_name.value = record_field.name;
+
+ALTER TABLE record_field
+    ALTER COLUMN name_id SET NOT NULL;
+
+-- primary key (record_id, name) is dropped with the column
+ALTER TABLE record_field
+    DROP COLUMN name;
+
+ALTER TABLE record_field
+    ADD PRIMARY KEY (record_id, name_id);
+
+-- primary key covers lookups by record: separate index is not needed anymore
+DROP INDEX IF EXISTS record_field_record_idx;
+
+-- journals with strings for ad-hoc queries
+CREATE VIEW journal_info AS
+SELECT journal.id,
+       operation_name.value        AS operation,
+       operation_description.value AS description,
+       journal.started_at,
+       journal.error,
+       journal.duration,
+       journal.finished_at
+FROM journal
+         INNER JOIN operation_name ON operation_name.id = journal.operation_id
+         INNER JOIN operation_description ON operation_description.id = journal.description_id;
@@ -0,0 +1,10 @@
+CREATE TABLE event_log
+(
+    id         INTEGER   NOT NULL PRIMARY KEY AUTOINCREMENT,
+    origin     TEXT      NOT NULL,
+    channel    TEXT      NOT NULL,
+    payload    TEXT      NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT current_timestamp
+);
+
+CREATE INDEX event_log_created_at_idx ON event_log (created_at);
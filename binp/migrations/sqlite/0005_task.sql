@@ -0,0 +1,14 @@
+CREATE TABLE task
+(
+    id           INTEGER   NOT NULL PRIMARY KEY AUTOINCREMENT,
+    queue        TEXT      NOT NULL,
+    payload      TEXT      NOT NULL,
+    attempts     INTEGER   NOT NULL DEFAULT 0,
+    -- unix time after which task could be claimed, NULL - failed permanently
+    available_at REAL,
+    lease        TEXT,
+    error        TEXT,
+    created_at   TIMESTAMP NOT NULL DEFAULT current_timestamp
+);
+
+CREATE INDEX task_queue_available_at_idx ON task (queue, available_at);
@@ -0,0 +1,79 @@
+-- repeated strings are stored once and referenced by ID
+CREATE TABLE operation_name
+(
+    id    INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    value TEXT    NOT NULL UNIQUE
+);
+
+CREATE TABLE operation_description
+(
+    id    INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    value TEXT    NOT NULL UNIQUE
+);
+
+CREATE TABLE field_name
+(
+    id    INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    value TEXT    NOT NULL UNIQUE
+);
+
+INSERT INTO operation_name (value) SELECT DISTINCT operation FROM journal;
+INSERT INTO operation_description (value) SELECT DISTINCT description FROM journal;
+INSERT INTO field_name (value) SELECT DISTINCT name FROM record_field;
+
+-- SQLite can't drop columns in older versions: tables are rebuilt
+CREATE TABLE journal_interned
+(
+    id             INTEGER   NOT NULL PRIMARY KEY AUTOINCREMENT,
+    operation_id   INTEGER   NOT NULL REFERENCES operation_name (id),
+    description_id INTEGER   NOT NULL REFERENCES operation_description (id),
+    started_at     TIMESTAMP NOT NULL DEFAULT current_timestamp,
+    error          TEXT,
+    duration       DOUBLE PRECISION,
+    finished_at    TIMESTAMPTZ
+);
+
+INSERT INTO journal_interned (id, operation_id, description_id, started_at, error, duration, finished_at)
+SELECT journal.id, operation_name.id, operation_description.id, started_at, error, duration, finished_at
+FROM journal
+         INNER JOIN operation_name ON operation_name.value = journal.operation
+         INNER JOIN operation_description ON operation_description.value = journal.description;
+
+-- IDs of removed journals should not be reused
+DELETE FROM sqlite_sequence WHERE name = 'journal_interned';
+INSERT INTO sqlite_sequence (name, seq) SELECT 'journal_interned', seq FROM sqlite_sequence WHERE name = 'journal';
+
+DROP TABLE journal;
+ALTER TABLE journal_interned RENAME TO journal;
+-- the same name as in 0004: the online migration becomes no-op
+CREATE INDEX journal_operation_idx ON journal (operation_id);
+
+CREATE TABLE record_field_interned
+(
+    record_id BIGINT  NOT NULL REFERENCES record (id),
+    name_id   INTEGER NOT NULL REFERENCES field_name (id),
+    value     TEXT,
+    PRIMARY KEY (record_id, name_id)
+);
+
+INSERT INTO record_field_interned (record_id, name_id, value)
+SELECT record_id, field_name.id, record_field.value
+FROM record_field
+         INNER JOIN field_name ON field_name.value = record_field.name;
+
+-- primary key covers lookups by record: separate index is not needed anymore
+DROP TABLE record_field;
+ALTER TABLE record_field_interned RENAME TO record_field;
+
+-- journals with strings for ad-hoc queries
+CREATE VIEW journal_info AS
+SELECT journal.id,
+       operation_name.value        AS operation,
+       operation_description.value AS description,
+       journal.started_at,
+       journal.error,
+       journal.duration,
+       journal.finished_at
+FROM journal
+         INNER JOIN operation_name ON operation_name.id = journal.operation_id
+         INNER JOIN operation_description ON operation_description.id = journal.description_id;
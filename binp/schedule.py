@@ -0,0 +1,319 @@
+from asyncio import Event, Task, get_event_loop, wait_for, TimeoutError
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from heapq import heappush, heappop
+from itertools import count
+from logging import getLogger
+from math import ceil
+from random import uniform
+from time import time
+from typing import Callable, Awaitable, Optional, Dict, List, Set, Tuple
+
+from binp.journals import Journals
+from binp.service import Service
+
+_MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+
+def _parse_field(value: str, low: int, high: int) -> Set[int]:
+    result: Set[int] = set()
+    for part in value.split(','):
+        step = 1
+        if '/' in part:
+            part, step_value = part.split('/', 1)
+            step = int(step_value)
+            if step < 1:
+                raise ValueError(f'invalid step in cron field {value!r}')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_value, end_value = part.split('-', 1)
+            start, end = int(start_value), int(end_value)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f'cron field {value!r} out of range {low}-{high}')
+        result.update(range(start, end + 1, step))
+    return result
+
+
+class Cron:
+    """
+    Minimal cron expression: ``minute hour day-of-month month day-of-week``.
+
+    Supports ``*``, lists (``1,2``), ranges (``1-5``), steps (``*/5``, ``1-30/2``) and macros
+    (``@hourly``, ``@daily``, ...). Day of week is 0-7 where both 0 and 7 are Sunday.
+    As in classic cron, if both day of month and day of week are restricted, a day matching any of them is used.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = _MACROS.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f'cron expression {expression!r} should contain 5 fields')
+        minutes, hours, days, months, weekdays = fields
+        self.minutes = _parse_field(minutes, 0, 59)
+        self.hours = _parse_field(hours, 0, 23)
+        self.days = _parse_field(days, 1, 31)
+        self.months = _parse_field(months, 1, 12)
+        self.weekdays = {x % 7 for x in _parse_field(weekdays, 0, 7)}
+        self.__any_day = days == '*'
+        self.__any_weekday = weekdays == '*'
+
+    def next(self, after: datetime) -> datetime:
+        """
+        Find nearest time strictly after provided one
+        """
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self.__day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+                continue
+            if moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+                continue
+            return moment
+        raise ValueError(f'cron expression {self.expression!r} never matches')
+
+    def __day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.isoweekday() % 7) in self.weekdays
+        if self.__any_day or self.__any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def __str__(self):
+        return self.expression
+
+
+class Misfire(str, Enum):
+    """
+    What to do if job was not fired in time (event loop was blocked, host was suspended and so on)
+    """
+    #: run once as soon as possible, missed runs are coalesced
+    run_once = 'run_once'
+    #: skip missed run and wait for the next one
+    skip = 'skip'
+
+
+@dataclass
+class Job:
+    name: str
+    cron: Optional[Cron]
+    every: Optional[float]
+    jitter: float
+    misfire: Misfire
+    misfire_grace: float
+    #: planned time without jitter (unix time)
+    base: float = 0
+    #: planned time with jitter (unix time)
+    at: float = 0
+
+    def plan(self, now: float):
+        """
+        Plan next run strictly after provided time
+        """
+        if self.cron is not None:
+            self.base = self.cron.next(datetime.fromtimestamp(max(now, self.base))).timestamp()
+        elif self.base == 0:
+            self.base = now + self.every
+        else:
+            self.base += self.every * max(1, ceil((now - self.base) / self.every))
+        self.at = self.base + (uniform(0, self.jitter) if self.jitter > 0 else 0)
+
+
+class Schedule:
+    """
+    Run async function by time: by cron expression or with fixed interval.
+
+    All jobs are served by a single timer (heap of planned times), so there is no sleeping task per job.
+    Each job is registered as a manually started service, so it's visible in the UI (with next run time)
+    and could be stopped or started out of schedule like any other service. Runs are journaled automatically.
+
+    .. code-block:: python
+
+       from binp import BINP
+
+       binp = BINP()
+
+       @binp.schedule(cron="*/5 * * * *")
+       async def poll_something():
+           print("do something every 5 minutes....")
+
+       @binp.schedule(every=30, jitter=5)
+       async def check_health():
+           print("do something every 30-35 seconds....")
+
+    :Overlaps:
+
+    If the previous run is still in progress at the planned time, the run will be skipped.
+
+    :Pause:
+
+    Stopping the job's service cancels only the current run. To skip planned runs of a single job, pause it
+    (:meth:`binp.service.Service.pause` or from the UI): the job stays in the timer and will be run by the next
+    planned time after resume.
+
+    :Misfires:
+
+    If the timer was fired later than ``misfire_grace`` seconds after the planned time
+    (event loop was blocked, host was suspended), the job will be run once (``Misfire.run_once``, default)
+    or skipped (``Misfire.skip``). Missed runs are never replayed one by one.
+
+    :Cluster:
+
+    In multi-worker deployment (see :class:`binp.cluster.Cluster`) jobs are run by timer only in the leader process.
+
+    :Conflicts:
+
+    Jobs are indexed by name. If multiple jobs defined with the same name - the latest one will be used.
+    """
+
+    def __init__(self, journals: Optional[Journals] = None, services: Optional[Service] = None):
+        self.__journals = journals
+        self.__services = services or Service()
+        self.__jobs: Dict[str, Job] = {}
+        self.__heap: List[Tuple[float, int, Job]] = []
+        self.__sequence = count()
+        self.__wakeup: Optional[Event] = None
+        self.__task: Optional[Task] = None
+        self.__standby = False
+
+    def __call__(self, func: Optional[Callable[[], Awaitable]] = None, *,
+                 cron: Optional[str] = None,
+                 every: Optional[float] = None,
+                 name: Optional[str] = None,
+                 description: Optional[str] = None,
+                 jitter: float = 0,
+                 misfire: Misfire = Misfire.run_once,
+                 misfire_grace: float = 60,
+                 journal: bool = True):
+        """
+        Run async function by schedule. Exactly one of ``cron`` or ``every`` should be defined.
+
+        :param cron: cron expression (ex: ``*/5 * * * *``)
+        :param every: interval between runs in seconds
+        :param name: job (and service) name, default is fully-qualified function name
+        :param description: job description, default is function doc-string
+        :param jitter: maximum random delay (in seconds) added to each run
+        :param misfire: policy for runs fired too late
+        :param misfire_grace: maximum delay (in seconds) after which run is considered as misfired
+        :param journal: journal each run (disable if function already decorated by ``@binp.journal``)
+        """
+        if (cron is None) == (every is None):
+            raise ValueError('exactly one of cron or every should be defined')
+        if every is not None and every <= 0:
+            raise ValueError('interval should be positive')
+        parsed_cron = Cron(cron) if cron is not None else None
+
+        def register_function(fn: Callable[[], Awaitable]):
+            nonlocal name, description
+
+            if name is None:
+                name = fn.__qualname__
+            if description is None:
+                description = "\n".join(line.strip() for line in (fn.__doc__ or '').splitlines()).strip()
+
+            handler = fn
+            if journal and self.__journals is not None:
+                handler = self.__journals(operation=name, description=description)(fn)
+
+            self.__services(handler, name=name, description=description, autostart=False, restart=False)
+
+            job = Job(name=name, cron=parsed_cron, every=every, jitter=jitter, misfire=misfire,
+                      misfire_grace=misfire_grace)
+            self.__jobs[name] = job
+            self.__plan(job, time())
+            return fn
+
+        if func is None:
+            return register_function
+        return register_function(func)
+
+    def stop(self):
+        """
+        Stop timer. Running jobs are not affected.
+        """
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    def standby(self):
+        """
+        Do not run jobs by timer (ex: the process is not a leader in multi-worker deployment).
+        Jobs still could be started manually.
+        """
+        self.__standby = True
+        self.stop()
+
+    def activate(self):
+        """
+        Leave standby mode and run jobs by timer (ex: the process became a leader).
+        Jobs are planned from the current time: runs missed in standby are not fired.
+        """
+        if not self.__standby:
+            return
+        self.__standby = False
+        self.__heap.clear()
+        now = time()
+        for job in self.__jobs.values():
+            self.__plan(job, now)
+
+    def __plan(self, job: Job, now: float):
+        job.plan(now)
+        heappush(self.__heap, (job.at, next(self.__sequence), job))
+        self.__services.set_next_run(job.name, datetime.fromtimestamp(job.at))
+        if self.__standby:
+            return
+        if self.__task is None or self.__task.done():
+            self.__task = get_event_loop().create_task(self.__timer())
+        elif self.__wakeup is not None and self.__heap[0][2] is job:
+            self.__wakeup.set()
+
+    async def __timer(self):
+        self.__wakeup = Event()
+        while self.__heap:
+            at, _, job = self.__heap[0]
+            if self.__jobs.get(job.name) is not job:
+                # job redefined
+                heappop(self.__heap)
+                continue
+            delay = at - time()
+            if delay > 0:
+                self.__wakeup.clear()
+                try:
+                    await wait_for(self.__wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+            heappop(self.__heap)
+            self.__fire(job, -delay)
+            self.__plan(job, time())
+
+    def __fire(self, job: Job, late: float):
+        logger = getLogger('schedule:' + job.name)
+        if self.__services.is_paused(job.name):
+            logger.debug("job is paused - skipped")
+            return
+        if late > job.misfire_grace and job.misfire == Misfire.skip:
+            logger.warning("run misfired by %.3fs - skipped", late)
+            return
+        if not self.__services.start(job.name):
+            logger.warning("previous run is still in progress - skipped")
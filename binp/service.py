@@ -1,8 +1,12 @@
-from asyncio import Task, get_event_loop, sleep, CancelledError
-from dataclasses import dataclass
+from asyncio import Task, get_event_loop, sleep, CancelledError, wait
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from enum import Enum
 from logging import getLogger
-from typing import Callable, Awaitable, Optional, Dict, List
+from random import uniform
+from time import monotonic
+from typing import Callable, Awaitable, Optional, Dict, List, Deque
 
 from pydantic import BaseModel
 
@@ -21,6 +25,18 @@ class Status(str, Enum):
     running = 'running'
     #: service stopped, is waiting before restart
     restarting = 'restarting'
+    #: service stopped after too many failures (crash loop) and will not be restarted
+    failed = 'failed'
+
+
+class Failure(BaseModel):
+    """
+    Service failure
+    """
+    #: failure time
+    at: datetime
+    #: error message
+    error: str
 
 
 class Info(BaseModel):
@@ -39,6 +55,26 @@ class Info(BaseModel):
     restart: bool
     #: interval between restarts
     restart_delay: float
+    #: multiplier of restart delay after each consecutive failure (1 - fixed delay)
+    restart_backoff: float = 1
+    #: maximum interval between restarts
+    restart_max_delay: Optional[float] = None
+    #: fraction of restart delay added randomly to spread restarts
+    restart_jitter: float = 0
+    #: running time (in seconds) after which service considered healthy and backoff is reset
+    healthy_after: float = 60
+    #: number of failures within crash_window after which service will be marked as failed (None - never)
+    crash_limit: Optional[int] = None
+    #: time window (in seconds) for crash loop detection
+    crash_window: float = 60
+    #: number of failures since last healthy run
+    consecutive_failures: int = 0
+    #: latest failures, newest - last
+    failures: List[Failure] = []
+    #: next planned start (only for scheduled services)
+    next_run: Optional[datetime] = None
+    #: planned starts are skipped (only for scheduled services)
+    paused: bool = False
 
 
 @dataclass
@@ -47,33 +83,84 @@ class Handler:
     events: Emitter[Info]
     handler: Callable[[], Awaitable]
     task: Optional[Task] = None
+    #: how many failures to keep in info
+    history_size: int = 10
+    #: time of the latest start (not restart)
+    started_at: Optional[datetime] = None
+    #: times of the latest failures for crash loop detection (up to crash limit, independent of history size)
+    crashes: Deque[datetime] = field(default_factory=deque)
 
     async def __call__(self):
         logger = getLogger('service:' + self.info.name)
+        final_status = Status.stopped
+        self.started_at = datetime.now()
+        self.info.consecutive_failures = 0
         try:
             while True:
                 self.info.status = Status.running
                 self.events.emit(self.info)
+                started = monotonic()
                 try:
                     await self.handler()
+                    error = None
                 except (CancelledError, KeyboardInterrupt):
                     break
                 except Exception as ex:
-                    logger.warning("service stopped: %v", ex, exc_info=ex)
+                    logger.warning("service stopped: %s", ex, exc_info=ex)
+                    error = ex
+                if monotonic() - started >= self.info.healthy_after:
+                    self.info.consecutive_failures = 0
+                if error is not None and self.__failed(error):
+                    logger.error("service failed %d times in %.1fs - crash loop detected, restarts disabled",
+                                 self.info.crash_limit, self.info.crash_window)
+                    final_status = Status.failed
+                    break
                 if not self.info.restart:
                     break
                 self.info.status = Status.restarting
                 self.events.emit(self.info)
-                await sleep(self.info.restart_delay)
+                await sleep(self.delay)
         finally:
-            self.info.status = Status.stopped
+            self.info.status = final_status
             self.events.emit(self.info)
 
+    @property
+    def delay(self) -> float:
+        """
+        Delay before next restart: exponential backoff by number of consecutive failures with jitter
+        """
+        info = self.info
+        delay = info.restart_delay
+        if info.consecutive_failures > 1:
+            delay *= info.restart_backoff ** (info.consecutive_failures - 1)
+        if info.restart_max_delay is not None:
+            delay = min(delay, info.restart_max_delay)
+        if info.restart_jitter > 0:
+            delay += uniform(0, delay * info.restart_jitter)
+        return delay
+
+    def __failed(self, error: Exception) -> bool:
+        """
+        Register failure and check for crash loop
+        """
+        now = datetime.now()
+        info = self.info
+        info.consecutive_failures += 1
+        info.failures = info.failures[-(self.history_size - 1):] + [Failure(at=now, error=str(error))]
+        if info.crash_limit is None:
+            return False
+        self.crashes.append(now)
+        while len(self.crashes) > info.crash_limit:
+            self.crashes.popleft()
+        window_start = max(now - timedelta(seconds=info.crash_window), self.started_at or now)
+        recent = sum(1 for at in self.crashes if at >= window_start)
+        return recent >= info.crash_limit
+
 
 class Service:
     """
     Annotate async function as service (background task). Supports automatic (default) and manual start,
-    restarts, restarts delays.
+    restarts, restarts delays with exponential backoff and crash loop detection.
 
     Useful to interact with environment in unpredictable schedule (ex: listen for low-level network requests).
 
@@ -92,25 +179,36 @@ class Service:
 
 
 
-    For scheduling by time better use `aiocron` instead:
+    For scheduling by time use ``@binp.schedule`` (see ``binp.schedule.Schedule``) instead:
 
-    .. code-block::
-
-        pip install aiocron
-
-    .. highlight:: python
     .. code-block:: python
 
         from binp import BINP
-        from aiocron import crontab
 
         binp = BINP()
 
-        @crontab("*/5 * * * *")
-        @binp.journal
+        @binp.schedule(cron="*/5 * * * *")
         async def poll_something():
             print("do something every 5 minutes....")
 
+    Scheduled jobs are listed as services with next run time.
+
+    :Restarts:
+
+    By default, service is restarted after fixed ``restart_delay``. For services which may fail repeatedly
+    (ex: upstream is down) delay could grow exponentially after each consecutive failure and be limited:
+
+    .. code-block:: python
+
+        @binp.service(restart_delay=1, restart_backoff=2, restart_max_delay=300, restart_jitter=0.1,
+                      crash_limit=10, crash_window=60)
+        async def listen_upstream():
+            ...
+
+    Backoff is reset once service is running longer than ``healthy_after`` seconds.
+    If service failed ``crash_limit`` times within ``crash_window`` seconds, it's marked as ``failed``
+    and will not be restarted until started manually. Latest failures are exposed in ``Info.failures``.
+
     :Conflicts:
 
     Services are indexed by name. If multiple services defined with the same name - the old one will be stopped and
@@ -123,18 +221,35 @@ class Service:
     """
 
     def __init__(self):
-        self.service_changed: Emitter[Info] = Emitter()
+        self.service_changed: Emitter[Info] = Emitter('service_changed', Info.parse_obj, key=lambda info: info.name)
         self.__services: Dict[str, Handler] = {}
+        self.__standby = False
 
     def __call__(self, func: Optional[Callable[[], Awaitable]] = None, *,
                  name: Optional[str] = None,
                  description: Optional[str] = None,
                  restart: bool = True,
                  autostart: bool = True,
-                 restart_delay: float = 3):
+                 restart_delay: float = 3,
+                 restart_backoff: float = 1,
+                 restart_max_delay: Optional[float] = None,
+                 restart_jitter: float = 0,
+                 healthy_after: float = 60,
+                 crash_limit: Optional[int] = None,
+                 crash_window: float = 60):
         """
         Mark async function as service
+
+        :param restart_delay: delay before restart (and base for backoff)
+        :param restart_backoff: multiplier of restart delay after each consecutive failure
+        :param restart_max_delay: maximum delay before restart
+        :param restart_jitter: fraction of restart delay added randomly
+        :param healthy_after: running time in seconds after which backoff is reset
+        :param crash_limit: failures within crash window to mark service as failed (None - never)
+        :param crash_window: time window in seconds for crash loop detection
         """
+        if restart_backoff < 1:
+            raise ValueError('restart backoff should be at least 1')
 
         def register_function(fn: Callable[[], Awaitable]):
             nonlocal name, description
@@ -158,14 +273,20 @@ class Service:
                     status=Status.stopped,
                     autostart=autostart,
                     restart=restart,
-                    restart_delay=restart_delay
+                    restart_delay=restart_delay,
+                    restart_backoff=restart_backoff,
+                    restart_max_delay=restart_max_delay,
+                    restart_jitter=restart_jitter,
+                    healthy_after=healthy_after,
+                    crash_limit=crash_limit,
+                    crash_window=crash_window,
                 ),
                 events=self.service_changed,
                 handler=fn
             )
 
             self.__services[name] = handler
-            if autostart:
+            if autostart and not self.__standby:
                 self.start(name)
             else:
                 self.service_changed.emit(handler.info)
@@ -176,28 +297,103 @@ class Service:
             return register_function
         return register_function(func)
 
-    def start(self, name: str):
+    def start(self, name: str) -> bool:
         """
-        Starts single service by name. Does nothing if no such service or service not yet stopped.
+        Starts single service by name. Does nothing if no such service or service not yet stopped (or failed).
+
+        :return: true if service started
         """
         service = self.__services.get(name)
         if service is None:
-            return
-        if service.info.status != Status.stopped:
-            return
+            return False
+        if service.info.status not in (Status.stopped, Status.failed):
+            return False
         service.info.status = Status.starting
         service.task = get_event_loop().create_task(service())
         self.service_changed.emit(service.info)
+        return True
 
     def stop(self, name: str):
         """
         Stops service by name. Does nothing if no such service or service stopped.
         """
         service = self.__services.get(name)
-        if service is None or service.info.status == Status.stopped or service.task is None:
+        if service is None or service.info.status in (Status.stopped, Status.failed) or service.task is None:
             return
         service.task.cancel()
 
+    def standby(self):
+        """
+        Do not start services automatically (ex: the process is not a leader in multi-worker deployment).
+        Already started services are not affected.
+        """
+        self.__standby = True
+
+    @property
+    def is_standby(self) -> bool:
+        """
+        Services are not started automatically: another process (leader) is running them
+        """
+        return self.__standby
+
+    def activate(self):
+        """
+        Leave standby mode and start all services marked as autostart (ex: the process became a leader).
+        """
+        self.__standby = False
+        for name, service in self.__services.items():
+            if service.info.autostart and service.info.status == Status.stopped:
+                self.start(name)
+
+    async def shutdown(self, timeout: float = 10):
+        """
+        Stop all services in reverse order of definition and wait for them to finish.
+        Services which are not finished after timeout are left cancelled and reported to log.
+
+        :param timeout: maximum time (in seconds) to wait for all services in total
+        """
+        deadline = monotonic() + timeout
+        for service in reversed(list(self.__services.values())):
+            task = service.task
+            if task is None or task.done():
+                continue
+            task.cancel()
+            await wait({task}, timeout=max(0.0, deadline - monotonic()))
+            if not task.done():
+                getLogger(self.__class__.__qualname__).warning("service %r not stopped in time", service.info.name)
+
+    def set_next_run(self, name: str, next_run: Optional[datetime]):
+        """
+        Update next planned start of service. Used by scheduler.
+        """
+        service = self.__services.get(name)
+        if service is None:
+            return
+        service.info.next_run = next_run
+        self.service_changed.emit(service.info)
+
+    def pause(self, name: str, paused: bool = True) -> bool:
+        """
+        Pause or resume planned starts of service. Manual starts and the current run are not affected.
+        Checked by scheduler before each planned run.
+
+        :return: true if service exists
+        """
+        service = self.__services.get(name)
+        if service is None:
+            return False
+        if service.info.paused != paused:
+            service.info.paused = paused
+            self.service_changed.emit(service.info)
+        return True
+
+    def is_paused(self, name: str) -> bool:
+        """
+        Planned starts of service are paused
+        """
+        service = self.__services.get(name)
+        return service is not None and service.info.paused
+
     @property
     def services(self) -> List[Info]:
         """
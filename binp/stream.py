@@ -0,0 +1,164 @@
+from asyncio import Queue, get_event_loop
+from contextlib import ExitStack
+from json import dumps
+from typing import Dict, List, Tuple, Any, Optional
+
+from pydantic import BaseModel
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from websockets import ConnectionClosed
+
+from binp.journals import Journals
+from binp.kv import KV
+from binp.service import Service
+
+#: maximum number of messages in one frame
+FRAME_SIZE = 100
+
+
+def _topics(value: Any) -> List[str]:
+    # topic or list of topics
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return []
+
+
+class _Topic:
+    # queue-like adapter which tags payloads by topic
+    def __init__(self, topic: str, queue: Queue):
+        self.__topic = topic
+        self.__queue = queue
+
+    def put_nowait(self, payload: Any):
+        self.__queue.put_nowait(None if payload is None else (self.__topic, payload))
+
+
+class Stream:
+    """
+    Multiplexed subscriptions over single websocket. Client subscribes and unsubscribes to topics
+    by JSON messages, server sends updates as JSON arrays of messages (several updates per frame).
+
+    Topics:
+
+    * ``journals`` - headlines of created or updated journals;
+    * ``journal:<id>`` - single journal with records;
+    * ``services`` - services information;
+    * ``kv:<namespace>`` - changed and removed keys in the namespace (see ``KeyChange``).
+
+    Client messages:
+
+    .. code-block:: json
+
+       {"subscribe": ["journals", "journal:12", "services"]}
+       {"unsubscribe": ["journal:12"]}
+
+    Server frames:
+
+    .. code-block:: json
+
+       [{"topic": "journal:12", "data": {"id": 12, "records": [], ...}},
+        {"topic": "services", "data": {"name": "listener", "status": "running", ...}},
+        {"topic": "journal:13", "error": "unknown topic"}]
+
+    Bursts of updates are coalesced: only the latest state of each journal or service is sent.
+    """
+
+    def __init__(self, journals: Journals, kv: KV, services: Service):
+        self.__journals = journals
+        self.__kv = kv
+        self.__services = services
+
+    async def __call__(self, websocket: WebSocket):
+        await websocket.accept()
+        queue: Queue = Queue()
+        subscriptions: Dict[str, ExitStack] = {}
+
+        async def read():
+            try:
+                while True:
+                    queue.put_nowait(('', await websocket.receive_json()))
+            except (WebSocketDisconnect, ConnectionClosed, ValueError):
+                queue.put_nowait(None)
+
+        reader = get_event_loop().create_task(read())
+        try:
+            while True:
+                items = [await queue.get()]
+                while not queue.empty() and len(items) < FRAME_SIZE:
+                    items.append(queue.get_nowait())
+                if None in items:
+                    break
+                frame = await self.__frame(items, subscriptions, queue)
+                if frame:
+                    await websocket.send_text('[' + ','.join(frame) + ']')
+            if not reader.done():
+                # emitters closed (ex: shutdown)
+                await websocket.close(code=1001)
+        except (WebSocketDisconnect, ConnectionClosed):
+            pass
+        finally:
+            reader.cancel()
+            for subscription in subscriptions.values():
+                subscription.close()
+
+    async def __frame(self, items: List[Tuple[str, Any]], subscriptions: Dict[str, ExitStack],
+                      queue: Queue) -> List[str]:
+        frame = []
+        # coalesce updates by topic and entity, keep order of the first update
+        updates: Dict[Tuple[str, Any], Any] = {}
+        for topic, payload in items:
+            if topic:
+                # journals by ID, services by name, KV changes are not coalesced
+                entity = payload.name if topic == 'services' else payload if isinstance(payload, int) else id(payload)
+                updates[(topic, entity)] = payload
+                continue
+            if not isinstance(payload, dict):
+                continue
+            for name in _topics(payload.get('unsubscribe')):
+                subscription = subscriptions.pop(name, None)
+                if subscription is not None:
+                    subscription.close()
+            for name in _topics(payload.get('subscribe')):
+                if name in subscriptions:
+                    continue
+                subscription = self.__subscribe(name, queue)
+                if subscription is None:
+                    frame.append(dumps({'topic': name, 'error': 'unknown topic'}))
+                else:
+                    subscriptions[name] = subscription
+        for (topic, _), payload in updates.items():
+            if topic not in subscriptions:
+                # unsubscribed in the same batch
+                continue
+            data = await self.__data(topic, payload)
+            if data is not None:
+                frame.append(f'{{"topic": {dumps(topic)}, "data": {data}}}')
+        return frame
+
+    def __subscribe(self, topic: str, queue: Queue) -> Optional[ExitStack]:
+        target = _Topic(topic, queue)
+        stack = ExitStack()
+        kind, _, argument = topic.partition(':')
+        if topic == 'journals':
+            stack.enter_context(self.__journals.journal_updated.subscribe(target))
+        elif kind == 'journal' and argument.isdigit():
+            journal_id = int(argument)
+            stack.enter_context(self.__journals.journal_updated.subscribe(target, journal_id))
+            stack.enter_context(self.__journals.record_added.subscribe(target, journal_id))
+        elif topic == 'services':
+            stack.enter_context(self.__services.service_changed.subscribe(target))
+        elif kind == 'kv' and argument:
+            stack.enter_context(self.__kv.key_changed.subscribe(target, argument))
+        else:
+            return None
+        return stack
+
+    async def __data(self, topic: str, payload: Any) -> Optional[str]:
+        if isinstance(payload, BaseModel):
+            return payload.json()
+        if topic == 'journals':
+            headline = await self.__journals.headline(payload)
+            return headline.json() if headline is not None else None
+        journal = await self.__journals.get(payload)
+        return journal.json() if journal is not None else None
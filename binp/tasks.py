@@ -0,0 +1,436 @@
+from asyncio import Event, Future, Queue, Task, CancelledError, TimeoutError, get_event_loop, wait_for, gather, \
+    shield
+from inspect import signature, Parameter, isclass
+from json import dumps, loads
+from logging import getLogger
+from time import time
+from typing import Callable, Awaitable, Optional, Dict, List, Any, Tuple, Iterable, Union, TYPE_CHECKING
+from uuid import uuid4
+
+from pydantic.main import BaseModel
+
+from binp.db import ensure, spawn, insert_many, returning, dialect, POSTGRESQL
+from binp.journals import Journals
+from binp.service import Service
+
+if TYPE_CHECKING:
+    from databases import Database
+
+
+class TaskStats(BaseModel):
+    """
+    Number of tasks in queue
+    """
+    #: waiting or in progress tasks
+    pending: int
+    #: tasks failed after all attempts
+    failed: int
+
+
+class _Batcher:
+    """
+    Collects operations and applies them in one transaction (group commit): operations submitted
+    while the previous batch is committing are applied together by the next one.
+    """
+
+    def __init__(self, db: Callable[[], Awaitable['Database']],
+                 apply: Callable[['Database', List[Any]], Awaitable[None]],
+                 on_commit: Optional[Callable[[], None]] = None):
+        self.__db = db
+        self.__apply = apply
+        self.__on_commit = on_commit
+        self.__buffer: List[Tuple[Any, Future]] = []
+        self.__task: Optional[Task] = None
+
+    def submit(self, item: Any) -> Future:
+        """
+        Add operation to the next batch. Returned future is resolved once the batch is committed.
+        """
+        future = get_event_loop().create_future()
+        self.__buffer.append((item, future))
+        if self.__task is None or self.__task.done():
+            self.__task = spawn(self.__run())
+        return future
+
+    async def close(self):
+        """
+        Wait for pending operations
+        """
+        if self.__task is not None:
+            await self.__task
+
+    async def __run(self):
+        while self.__buffer:
+            batch, self.__buffer = self.__buffer, []
+            try:
+                db = await self.__db()
+                async with db.transaction():
+                    await self.__apply(db, [item for item, _ in batch])
+            except Exception as ex:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(ex)
+                continue
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+            if self.__on_commit is not None:
+                self.__on_commit()
+
+
+class TaskQueue:
+    """
+    Durable queue of single task type. Created by :class:`Tasks` decorator.
+    """
+
+    def __init__(self, name: str, handler: Callable[[int, int, Any], Awaitable],
+                 db: Callable[[], Awaitable['Database']], workers: int, prefetch: int, batch_size: int,
+                 visibility: float, max_attempts: int, retry_delay: float, retry_backoff: float,
+                 retry_max_delay: float, poll_interval: float):
+        self.name = name
+        self.__handler = handler
+        self.__db = db
+        self.__workers = workers
+        self.__prefetch = prefetch
+        self.__batch_size = batch_size
+        self.__visibility = visibility
+        self.__max_attempts = max_attempts
+        self.__retry_delay = retry_delay
+        self.__retry_backoff = retry_backoff
+        self.__retry_max_delay = retry_max_delay
+        self.__poll_interval = poll_interval
+        self.__wakeup: Optional[Event] = None
+        self.__freed: Optional[Event] = None
+        #: claimed tasks (ID -> lease)
+        self.__claimed: Dict[int, str] = {}
+        self.__enqueue = _Batcher(db, self.__insert, self.__notify)
+        self.__complete = _Batcher(db, self.__finish)
+
+    async def __call__(self, payload: Any):
+        """
+        Execute task immediately, without queue
+        """
+        return await self.__handler(0, 1, loads(self.__serialize(payload)))
+
+    async def enqueue(self, payload: Union[BaseModel, Any]):
+        """
+        Put task to queue. Returns once the task is saved: enqueues from concurrent callers are saved
+        by one transaction.
+
+        :param payload: task argument, should be JSON serializable or pydantic model
+        """
+        await self.__enqueue.submit(self.__serialize(payload))
+
+    async def enqueue_many(self, payloads: Iterable[Union[BaseModel, Any]]):
+        """
+        Put several tasks to queue by one transaction
+        """
+        futures = [self.__enqueue.submit(self.__serialize(payload)) for payload in payloads]
+        await gather(*futures)
+
+    async def stats(self) -> TaskStats:
+        """
+        Count pending and failed tasks
+        """
+        db = await self.__db()
+        row = await db.fetch_one('''SELECT count(available_at), count(*) - count(available_at)
+                                    FROM task WHERE queue = :queue''', values={'queue': self.name})
+        return TaskStats(pending=row[0], failed=row[1])
+
+    async def close(self):
+        """
+        Wait for pending enqueues and completions to be saved
+        """
+        await self.__enqueue.close()
+        await self.__complete.close()
+
+    async def consume(self):
+        """
+        Claim tasks by batches and execute them by pool of workers until cancelled. Used as service.
+        """
+        # created on start: event loop is not yet running when tasks are defined
+        self.__wakeup = Event()
+        self.__freed = Event()
+        local: Queue = Queue()
+        # workers are using database concurrently: each should have own connection
+        workers = [spawn(self.__worker(local)) for _ in range(self.__workers)]
+        try:
+            while True:
+                free = self.__workers + self.__prefetch - len(self.__claimed)
+                if free <= 0:
+                    self.__freed.clear()
+                    await self.__freed.wait()
+                    continue
+                self.__wakeup.clear()
+                limit = min(self.__batch_size, free)
+                claim = spawn(self.__claim(limit))
+                try:
+                    tasks = await shield(claim)
+                except CancelledError:
+                    # stopped while claiming: the claim is finished (cancelled connect leaks database thread)
+                    # and claimed tasks are released
+                    claimed = (await gather(claim, return_exceptions=True))[0]
+                    for task in (claimed if isinstance(claimed, list) else ()):
+                        self.__claimed[task[0]] = task[3]
+                    raise
+                for task in tasks:
+                    self.__claimed[task[0]] = task[3]
+                    local.put_nowait(task)
+                if len(tasks) < limit:
+                    # queue drained: wait for new tasks from this process or poll for others
+                    try:
+                        await wait_for(self.__wakeup.wait(), self.__poll_interval)
+                    except TimeoutError:
+                        pass
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await gather(*workers, return_exceptions=True)
+            await self.__release()
+
+    def __notify(self):
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+    def __serialize(self, payload: Any) -> str:
+        return payload.json() if isinstance(payload, BaseModel) else dumps(payload, ensure_ascii=False)
+
+    async def __worker(self, local: Queue):
+        logger = getLogger('task:' + self.name)
+        while True:
+            task_id, payload, attempt, lease = await local.get()
+            try:
+                await self.__handler(task_id, attempt, loads(payload))
+            except CancelledError:
+                raise
+            except Exception as ex:
+                if attempt >= self.__max_attempts:
+                    logger.error("task %d failed after %d attempts: %s", task_id, attempt, ex, exc_info=ex)
+                    available_at = None
+                else:
+                    logger.warning("task %d failed (attempt %d): %s", task_id, attempt, ex)
+                    delay = min(self.__retry_delay * self.__retry_backoff ** (attempt - 1), self.__retry_max_delay)
+                    available_at = time() + delay
+                result = (task_id, lease, available_at, str(ex))
+            else:
+                result = (task_id, lease, None, None)
+            # completion is saved even if the worker is stopped meanwhile: the task should not be released
+            self.__claimed.pop(task_id, None)
+            self.__freed.set()
+            try:
+                await self.__complete.submit(result)
+            except Exception as ex:
+                logger.warning("failed to save result of task %d, it will be available after visibility timeout: %s",
+                               task_id, ex)
+
+    async def __insert(self, db: 'Database', payloads: List[str]):
+        now = time()
+        await insert_many(db, 'task', ('queue', 'payload', 'available_at'),
+                          [(self.name, payload, now) for payload in payloads])
+
+    async def __finish(self, db: 'Database', results: List[Tuple[int, str, Optional[float], Optional[str]]]):
+        done = [(task_id, lease) for task_id, lease, _, error in results if error is None]
+        if done:
+            # each task is removed only by its own lease (results may come from different claims)
+            pairs = ' OR '.join(f'(id = :id_{i} AND lease = :lease_{i})' for i in range(len(done)))
+            args = {f'id_{i}': task_id for i, (task_id, _) in enumerate(done)}
+            args.update({f'lease_{i}': lease for i, (_, lease) in enumerate(done)})
+            await db.execute(f'DELETE FROM task WHERE {pairs}', values=args)
+        for task_id, lease, available_at, error in results:
+            if error is None:
+                continue
+            await db.execute('''UPDATE task SET available_at = :available_at, error = :error, lease = NULL
+                                WHERE id = :id AND lease = :lease''', values={
+                'available_at': available_at,
+                'error': error,
+                'id': task_id,
+                'lease': lease,
+            })
+
+    async def __claim(self, limit: int) -> List[Tuple[int, str, int, str]]:
+        db = await self.__db()
+        now = time()
+        lease = uuid4().hex
+        values = {'queue': self.name, 'now': now, 'limit': limit, 'until': now + self.__visibility, 'lease': lease}
+        candidates = '''SELECT id FROM task WHERE queue = :queue AND available_at <= :now
+                        ORDER BY available_at, id LIMIT :limit'''
+        if dialect(db) == POSTGRESQL:
+            # concurrent consumers (other processes) skip rows claimed right now
+            candidates += ' FOR UPDATE SKIP LOCKED'
+        claim = f'''UPDATE task SET lease = :lease, attempts = attempts + 1, available_at = :until
+                    WHERE id IN ({candidates})'''
+        if returning(db):
+            rows = await db.fetch_all(claim + ' RETURNING id, payload, attempts', values=values)
+        else:
+            async with db.transaction():
+                await db.execute(claim, values=values)
+                rows = await db.fetch_all('SELECT id, payload, attempts FROM task WHERE lease = :lease',
+                                          values={'lease': lease})
+        return sorted((row[0], row[1], row[2], lease) for row in rows)
+
+    async def __release(self):
+        # return claimed but not finished tasks to queue (ex: on stop) without counting attempt
+        claimed, self.__claimed = self.__claimed, {}
+        if not claimed:
+            return
+        try:
+            db = await self.__db()
+            await db.execute_many('''UPDATE task SET available_at = :now, attempts = attempts - 1, lease = NULL
+                                     WHERE id = :id AND lease = :lease''', values=[
+                {'now': time(), 'id': task_id, 'lease': lease} for task_id, lease in claimed.items()
+            ])
+        except Exception as ex:
+            getLogger('task:' + self.name).warning("failed to release %d tasks, they will be available after "
+                                                   "visibility timeout: %s", len(claimed), ex)
+
+
+class Tasks:
+    """
+    Durable background tasks: tasks are saved to the database (table ``task``) and executed by pool
+    of workers, so they are not lost on restart.
+
+    Useful to move work out of request handlers (ex: webhooks).
+
+    .. code-block:: python
+
+       from binp import BINP
+       from pydantic import BaseModel
+
+       binp = BINP()
+
+       class Order(BaseModel):
+           id: int
+           email: str
+
+       @binp.task(workers=4)
+       async def send_receipt(order: Order):
+           ...
+
+       @binp.app.post('/order')
+       async def create_order(order: Order):
+           await send_receipt.enqueue(order)
+
+    The decorated function receives payload: parsed JSON or pydantic model if the argument is annotated by model.
+    Each task queue is a service (with the same name), so it's visible in UI and could be stopped and started.
+    Each execution is journaled (with task ID and attempt).
+
+    :Delivery:
+
+    Tasks are claimed by batches and become invisible to other workers for ``visibility`` seconds.
+    If a process dies, its tasks will be executed again after visibility timeout, so tasks should be idempotent
+    and finish within visibility timeout (at-least-once delivery). Stopped service returns claimed tasks to queue.
+
+    :Retries:
+
+    Failed task is retried after ``retry_delay`` seconds, the delay is multiplied by ``retry_backoff`` after each
+    attempt (up to ``retry_max_delay``). After ``max_attempts`` task is marked as failed and kept in the database
+    with error message.
+
+    :Throughput:
+
+    Concurrent enqueues (ex: from parallel requests) as well as completions are saved by one transaction
+    per batch, so thousands of tasks per second could be enqueued even with SQLite. Use ``enqueue_many``
+    to save several tasks from a single caller at once.
+
+    :Conflicts:
+
+    Tasks are indexed by name. If multiple tasks defined with the same name - the latest one will be used.
+    """
+
+    def __init__(self, journals: Optional[Journals] = None, services: Optional[Service] = None,
+                 db: Optional['Database'] = None):
+        self.__journals = journals
+        self.__services = services or Service()
+        self.__db = ensure(db)
+        self.__queues: Dict[str, TaskQueue] = {}
+
+    def __call__(self, func: Optional[Callable[[Any], Awaitable]] = None, *,
+                 name: Optional[str] = None,
+                 description: Optional[str] = None,
+                 workers: int = 1,
+                 prefetch: Optional[int] = None,
+                 batch_size: int = 100,
+                 visibility: float = 300,
+                 max_attempts: int = 5,
+                 retry_delay: float = 1,
+                 retry_backoff: float = 2,
+                 retry_max_delay: float = 300,
+                 poll_interval: float = 1,
+                 journal: bool = True):
+        """
+        Define task handler. Returns :class:`TaskQueue` to enqueue tasks.
+
+        :param name: task (and service) name, default is fully-qualified function name
+        :param description: task description, default is function doc-string
+        :param workers: number of tasks executed in parallel
+        :param prefetch: number of tasks claimed in advance, above number of workers (default - number of workers)
+        :param batch_size: maximum number of tasks claimed by one query
+        :param visibility: time (in seconds) during which claimed task is not visible to other workers
+        :param max_attempts: number of attempts before the task is marked as failed
+        :param retry_delay: delay (in seconds) before first retry
+        :param retry_backoff: multiplier of retry delay after each attempt
+        :param retry_max_delay: maximum delay (in seconds) between retries
+        :param poll_interval: interval (in seconds) of checking for tasks enqueued by other processes or retried
+        :param journal: journal each execution
+        """
+        if workers < 1:
+            raise ValueError('at least one worker required')
+        if max_attempts < 1:
+            raise ValueError('at least one attempt required')
+
+        def register_function(fn: Callable[[Any], Awaitable]) -> TaskQueue:
+            nonlocal name, description
+
+            if name is None:
+                name = fn.__qualname__
+            if description is None:
+                description = "\n".join(line.strip() for line in (fn.__doc__ or '').splitlines()).strip()
+
+            parse = _payload_parser(fn)
+
+            async def handler(task_id: int, attempt: int, payload: Any):
+                if journaled:
+                    await self.__journals.record('task', id=task_id, attempt=attempt)
+                return await fn(parse(payload))
+
+            journaled = journal and self.__journals is not None
+            if journaled:
+                handler = self.__journals(operation=name, description=description)(handler)
+
+            queue = TaskQueue(name, handler, self.__db, workers=workers,
+                              prefetch=prefetch if prefetch is not None else workers, batch_size=batch_size,
+                              visibility=visibility, max_attempts=max_attempts, retry_delay=retry_delay,
+                              retry_backoff=retry_backoff, retry_max_delay=retry_max_delay,
+                              poll_interval=poll_interval)
+            self.__queues[name] = queue
+            self.__services(queue.consume, name=name, description=description, autostart=True, restart=True)
+            return queue
+
+        if func is None:
+            return register_function
+        return register_function(func)
+
+    @property
+    def queues(self) -> List[TaskQueue]:
+        """
+        All defined task queues
+        """
+        return list(self.__queues.values())
+
+    async def close(self):
+        """
+        Wait for pending enqueues and completions to be saved
+        """
+        for queue in self.__queues.values():
+            await queue.close()
+
+
+def _payload_parser(fn: Callable[[Any], Awaitable]) -> Callable[[Any], Any]:
+    # payload is parsed to pydantic model if the first argument is annotated by model
+    params = list(signature(fn).parameters.values())
+    if not params or params[0].annotation is Parameter.empty:
+        return lambda payload: payload
+    annotation = params[0].annotation
+    if isclass(annotation) and issubclass(annotation, BaseModel):
+        return annotation.parse_obj
+    return lambda payload: payload
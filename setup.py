@@ -33,4 +33,11 @@ setuptools.setup(name="binp",
                      'fastapi~=0.63.0',
                      'aiofiles~=0.6.0',
                      'databases[sqlite]~=0.4.1'
-                 ])
+                 ],
+                 entry_points={
+                     'console_scripts': ['binp=binp.__main__:main']
+                 },
+                 extras_require={
+                     'postgresql': ['databases[postgresql]~=0.4.1'],
+                     'brotli': ['brotli>=1.0']
+                 })
@@ -1,12 +1,18 @@
-from _asyncio import get_event_loop
-from asyncio import get_event_loop
+from asyncio import Queue, Task, CancelledError, TimeoutError, get_event_loop, wait_for
+from atexit import register
+from functools import lru_cache
 from logging import basicConfig, INFO
+from os import getenv
 from pathlib import Path
+from shutil import which, rmtree
+from subprocess import run, DEVNULL
+from tempfile import mkdtemp
+from typing import Optional, Dict, List, Tuple
 from unittest import TestCase
 
 from databases import Database
 
-from binp.db import migrate
+from binp.db import migrate, dialect, spawn, POSTGRESQL
 
 
 def atest(fn):
@@ -16,6 +22,153 @@ def atest(fn):
     return wrapper
 
 
+async def call(app, path: str, headers: List[Tuple[str, str]] = (), method: str = 'GET',
+               body: bytes = b'') -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Make request to ASGI application without server.
+
+    :return: status, response headers and body
+    """
+    status = 0
+    response_headers = {}
+    chunks = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            response_headers.update((k.decode(), v.decode()) for k, v in message['headers'])
+        else:
+            chunks.append(message.get('body', b''))
+
+    await app({'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'root_path': '',
+               'headers': [(k.lower().encode(), v.encode()) for k, v in headers]}, receive, send)
+    return status, response_headers, b''.join(chunks)
+
+
+class EventStream:
+    """
+    Server-sent events from ASGI application without server. Stream is closed on exit.
+
+    .. code-block:: python
+
+        async with EventStream(app, '/journals/events') as stream:
+            event = await stream.next()
+    """
+
+    def __init__(self, app, path: str, headers: List[Tuple[str, str]] = ()):
+        self.status = 0
+        self.headers: Dict[str, str] = {}
+        self.__app = app
+        self.__scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+                        'headers': [(k.lower().encode(), v.encode()) for k, v in headers]}
+        self.__chunks: Queue = Queue()
+        self.__buffer = ''
+        self.__task: Optional[Task] = None
+
+    async def __aenter__(self) -> 'EventStream':
+        async def receive():
+            # client is never disconnecting: the stream is cancelled on exit
+            await get_event_loop().create_future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                self.status = message['status']
+                self.headers.update((k.decode(), v.decode()) for k, v in message['headers'])
+            else:
+                self.__chunks.put_nowait(message.get('body', b'').decode())
+
+        self.__task = spawn(self.__app(self.__scope, receive, send))
+        return self
+
+    async def __aexit__(self, *_):
+        # let pending events be sent (stream is idle after keep-alive): cancelled database connection leaks thread
+        try:
+            while not (await wait_for(self.__chunks.get(), 0.1)).startswith(':'):
+                pass
+        except TimeoutError:
+            pass
+        self.__task.cancel()
+        try:
+            await self.__task
+        except CancelledError:
+            pass
+
+    async def next(self, timeout: float = 1) -> Dict[str, str]:
+        """
+        Wait for the next event (or comment)
+
+        :return: event fields (comment is returned as field with empty name)
+        """
+        while '\n\n' not in self.__buffer:
+            self.__buffer += await wait_for(self.__chunks.get(), timeout)
+        block, self.__buffer = self.__buffer.split('\n\n', 1)
+        fields = {}
+        for line in block.splitlines():
+            name, _, value = line.partition(':')
+            fields[name] = value.strip()
+        return fields
+
+
+async def indexes(db: Database) -> List[str]:
+    """
+    Names of indexes in database (SQLite or PostgreSQL), excluding implicit indexes of SQLite
+    """
+    if dialect(db) == POSTGRESQL:
+        rows = await db.fetch_all("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")
+    else:
+        rows = await db.fetch_all("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+    return sorted(row[0] for row in rows)
+
+
+async def set_sequence(db: Database, table: str, value: int):
+    """
+    Set the latest generated ID of table (SQLite or PostgreSQL)
+    """
+    if dialect(db) == POSTGRESQL:
+        await db.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), {value})")
+        return
+    await db.execute("DELETE FROM sqlite_sequence WHERE name = :name", values={'name': table})
+    await db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)",
+                     values={'name': table, 'seq': value})
+
+
+@lru_cache()
+def temporary_postgres() -> Optional[str]:
+    """
+    Start temporary PostgreSQL cluster (if PostgreSQL binaries are available) and stop it on exit.
+    """
+    if which('initdb') is None or which('pg_ctl') is None:
+        return None
+    data = Path(mkdtemp(prefix='binp-pg-'))
+    run(['initdb', '-D', str(data), '-A', 'trust', '-U', 'postgres'], check=True, stdout=DEVNULL)
+    run(['pg_ctl', '-D', str(data), '-w', '-o', f"-k {data} -c listen_addresses=''", 'start'],
+        check=True, stdout=DEVNULL)
+
+    def cleanup():
+        run(['pg_ctl', '-D', str(data), '-w', '-m', 'immediate', 'stop'], stdout=DEVNULL)
+        rmtree(data, ignore_errors=True)
+
+    register(cleanup)
+    return f'postgresql://postgres@/postgres?host={data}'
+
+
+def database_url() -> Optional[str]:
+    """
+    Database for tests: ``TEST_DB_URL`` environment or temporary PostgreSQL cluster if ``TEST_POSTGRES=true``.
+    If nothing defined - SQLite file will be used.
+    """
+    url = getenv('TEST_DB_URL')
+    if url:
+        return url
+    if getenv('TEST_POSTGRES', '') == 'true':
+        return temporary_postgres()
+    return None
+
+
 class TestWithDB(TestCase):
     db_file = Path() / 'data.db'
 
@@ -23,12 +176,20 @@ class TestWithDB(TestCase):
         super().setUp()
         basicConfig(level=INFO)
 
-        self.db_file.unlink(missing_ok=True)
-        self.db = Database(f'sqlite:///{self.db_file}')
+        url = database_url()
+        if url is None:
+            self.db_file.unlink(missing_ok=True)
+            url = f'sqlite:///{self.db_file}'
+        self.db = Database(url)
 
         async def init():
             await self.db.connect()
-            await migrate(self.db)
+            if dialect(self.db) == POSTGRESQL:
+                await self.db.execute('DROP SCHEMA public CASCADE')
+                await self.db.execute('CREATE SCHEMA public')
+            online = await migrate(self.db)
+            if online is not None:
+                await online
 
         get_event_loop().run_until_complete(init())
 
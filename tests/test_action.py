@@ -1,7 +1,11 @@
+from asyncio import Event, gather, sleep, new_event_loop, wait_for
 from unittest import TestCase
 
-from binp.action import Action, ActionInfo
-from tests import atest
+from pydantic import ValidationError
+
+from binp.action import Action, ActionInfo, ActionBusy
+from binp.journals import Journals
+from tests import atest, TestWithDB
 
 
 class TestAction(TestCase):
@@ -43,3 +47,188 @@ class TestAction(TestCase):
             ActionInfo(name='handler-2', description='Some help'),
             ActionInfo(name='handler-3', description='some operation')
         ]
+
+    @atest
+    async def test_max_concurrency(self):
+        action = Action()
+        running = 0
+        peak = 0
+
+        @action(name='limited', max_concurrency=2)
+        async def limited():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await sleep(0.01)
+            running -= 1
+
+        await gather(*[action.invoke('limited') for _ in range(5)])
+        assert peak == 2, peak
+
+    def test_max_concurrency_new_loop(self):
+        action = Action()
+
+        # decorated without running loop (ex: on import)
+        @action(name='limited', max_concurrency=1)
+        async def limited():
+            await sleep(0.01)
+
+        async def invoke():
+            await gather(*[action.invoke('limited') for _ in range(3)])
+
+        loop = new_event_loop()
+        try:
+            loop.run_until_complete(invoke())
+        finally:
+            loop.close()
+
+    @atest
+    async def test_queue_size(self):
+        action = Action()
+        release = Event()
+
+        @action(name='busy', max_concurrency=1, queue_size=1)
+        async def busy():
+            await release.wait()
+
+        first = gather(action.invoke('busy'), action.invoke('busy'))
+        await sleep(0.001)
+        try:
+            await action.invoke('busy')
+            assert False, 'should be rejected'
+        except ActionBusy:
+            pass
+        release.set()
+        assert await first == [True, True]
+
+    @atest
+    async def test_single_flight(self):
+        action = Action()
+        calls = 0
+
+        @action(name='shared', single_flight=True)
+        async def shared():
+            nonlocal calls
+            calls += 1
+            await sleep(0.01)
+
+        await gather(*[action.invoke('shared') for _ in range(5)])
+        assert calls == 1, calls
+
+        await action.invoke('shared')
+        assert calls == 2, calls
+
+    @atest
+    async def test_params(self):
+        action = Action()
+        targets = []
+
+        @action(name='deploy')
+        async def deploy(target: str, retries: int = 1):
+            targets.append((target, retries))
+
+        await action.invoke('deploy', {'target': 'staging'})
+        await action.invoke('deploy', {'target': 'prod', 'retries': '3'})
+        assert targets == [('staging', 1), ('prod', 3)]
+
+        for bad in (None, {'retries': 2}, {'target': 'x', 'unknown': 1}):
+            try:
+                await action.invoke('deploy', bad)
+                assert False, 'should be rejected'
+            except ValidationError:
+                pass
+
+        info = action.actions[0]
+        assert info.parameters['required'] == ['target']
+        assert set(info.parameters['properties']) == {'target', 'retries'}
+
+    def test_params_names(self):
+        action = Action()
+
+        async def shadowing(json: str):
+            pass
+
+        async def schema(schema):
+            pass
+
+        async def private(_token: str):
+            pass
+
+        for handler in (shadowing, schema, private):
+            with self.assertRaises(ValueError):
+                action(handler)
+        assert action.actions == []
+
+    @atest
+    async def test_validate(self):
+        action = Action()
+
+        @action(name='deploy')
+        async def deploy(target: str):
+            pass
+
+        assert action.validate('unknown', {}) is None
+        with self.assertRaises(ValidationError):
+            action.validate('deploy', {})
+        args = action.validate('deploy', {'target': 'prod'})
+        assert args.target == 'prod'
+        # validated arguments are passed as-is
+        assert action.validate('deploy', args) is args
+        assert await action.invoke('deploy', args)
+
+    @atest
+    async def test_single_flight_params(self):
+        action = Action()
+        calls = []
+
+        @action(name='shared', single_flight=True)
+        async def shared(target: str):
+            calls.append(target)
+            await sleep(0.01)
+
+        await gather(*[action.invoke('shared', {'target': t}) for t in ('a', 'b', 'a', 'b')])
+        assert sorted(calls) == ['a', 'b'], calls
+
+
+class TestActionBackground(TestWithDB):
+
+    @atest
+    async def test_submit(self):
+        action = Action()
+        journal = Journals(self.db)
+        release = Event()
+        done = Event()
+
+        @action(name='slow')
+        @journal
+        async def slow():
+            await release.wait()
+            done.set()
+
+        found, journal_id = await action.submit('slow')
+        assert found
+        assert journal_id is not None
+
+        headline = await journal.headline(journal_id)
+        assert headline.finished_at is None
+
+        release.set()
+        await done.wait()
+
+        assert await action.submit('unknown') == (False, None)
+
+    @atest
+    async def test_submit_not_sampled(self):
+        action = Action()
+        journal = Journals(self.db)
+        release = Event()
+
+        @action(name='sampled')
+        @journal(slow=10)
+        async def sampled():
+            await release.wait()
+
+        # journal is not opened, but caller is not waiting for completion
+        assert await wait_for(action.submit('sampled'), 1) == (True, None)
+        release.set()
+        await action.drain()
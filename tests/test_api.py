@@ -0,0 +1,125 @@
+from json import loads
+from unittest.mock import patch
+
+from pydantic import ValidationError
+
+from binp.action import Action, ActionInfo
+from binp.api import create_internal
+from binp.journals import Journals, current_journal
+from binp.kv import KV
+from binp.service import Service
+from tests import atest, call, EventStream, TestWithDB
+
+
+class TestJournalEvents(TestWithDB):
+    def setUp(self) -> None:
+        super().setUp()
+        self.journals = Journals(self.db, replay=5)
+        self.app = create_internal(self.journals, KV(db=self.db), Action(), Service())
+
+        @self.journals(operation='sample')
+        async def sample():
+            await self.journals.record('step', value=1)
+            return current_journal.get()
+
+        self.sample = sample
+
+    @atest
+    async def test_stream(self):
+        async with EventStream(self.app, '/journals/events') as stream:
+            assert (await stream.next()) == {'retry': '3000'}
+            assert stream.status == 200
+            assert stream.headers['content-type'].startswith('text/event-stream')
+            assert stream.headers['cache-control'] == 'no-cache'
+            journal_id = await self.sample()
+            event = await stream.next()
+            assert event['event'] == 'journal'
+            assert loads(event['data'])['id'] == journal_id
+            instance, sequence = event['id'].split('.')
+            assert int(sequence) <= self.journals.journal_updated.version
+
+    @atest
+    async def test_coalesce(self):
+        first = await self.sample()
+        second = await self.sample()
+        with patch('binp.api.KEEPALIVE', 0.05):
+            async with EventStream(self.app, '/journals/events') as stream:
+                await stream.next()
+                # burst of updates: the latest state of each journal is sent once
+                for journal_id in (first, first, second, first):
+                    self.journals.journal_updated.emit(journal_id)
+                events = [await stream.next(), await stream.next()]
+                assert [loads(event['data'])['id'] for event in events] == [first, second]
+                assert events[0]['id'] == events[1]['id']
+                assert events[0]['id'].endswith(f'.{self.journals.journal_updated.version}')
+                assert (await stream.next()) == {'': 'keep-alive'}
+
+    @atest
+    async def test_resume(self):
+        async with EventStream(self.app, '/journals/events') as stream:
+            await stream.next()
+            self.journals.journal_updated.emit(await self.sample())
+            # begin, end and manual update of the same journal could be delivered separately
+            last_id = (await stream.next())['id']
+            while last_id.split('.')[1] != str(self.journals.journal_updated.version):
+                last_id = (await stream.next())['id']
+
+        missed = await self.sample()
+        async with EventStream(self.app, '/journals/events', [('Last-Event-ID', last_id)]) as stream:
+            assert (await stream.next()) == {'retry': '3000'}
+            event = await stream.next()
+            assert event['event'] == 'journal'
+            assert loads(event['data'])['id'] == missed
+
+    @atest
+    async def test_reset(self):
+        instance = None
+        async with EventStream(self.app, '/journals/events') as stream:
+            await stream.next()
+            await self.sample()
+            instance = (await stream.next())['id'].split('.')[0]
+
+        expired = f'{instance}.1'
+        for _ in range(5):
+            await self.sample()
+        for last_id in ('foreign.1', expired, f'{instance}.x', f'{instance}.1.2'):
+            async with EventStream(self.app, '/journals/events', [('Last-Event-ID', last_id)]) as stream:
+                await stream.next()
+                event = await stream.next()
+                assert event['event'] == 'reset', last_id
+                assert event['id'] == f'{instance}.{self.journals.journal_updated.version}'
+
+    @atest
+    async def test_single_journal(self):
+        journal_id = await self.sample()
+        other_id = await self.sample()
+        async with EventStream(self.app, f'/journal/{journal_id}/events') as stream:
+            await stream.next()
+            self.journals.record_added.emit(other_id)
+            self.journals.record_added.emit(journal_id)
+            event = await stream.next()
+            assert loads(event['data'])['id'] == journal_id
+            # position of both emitters: journal updates and records
+            assert len(event['id'].split('.')) == 3
+
+
+class TestInvokeAction(TestWithDB):
+    @atest
+    async def test_validation(self):
+        actions = Action()
+
+        @actions(name='deploy')
+        async def deploy(target: str):
+            # validation error of internal data, not of the action arguments
+            ActionInfo.parse_obj({'name': target})
+
+        app = create_internal(Journals(self.db), KV(db=self.db), actions, Service())
+        headers = [('Content-Type', 'application/json')]
+        status, _, content = await call(app, '/action/deploy', headers, 'POST', b'{}')
+        assert status == 422
+        assert loads(content)['detail'][0]['loc'] == ['target']
+        status, _, _ = await call(app, '/action/unknown', headers, 'POST', b'{}')
+        assert status == 404
+        # error raised by the action is not reported as invalid input (server error)
+        with self.assertRaises(ValidationError):
+            await call(app, '/action/deploy', headers, 'POST', b'{"target": "prod"}')
@@ -0,0 +1,134 @@
+from asyncio import get_event_loop
+from datetime import datetime
+from pathlib import Path
+from shutil import copy
+from tempfile import TemporaryDirectory
+
+from binp.archive import Archive
+from binp.db import migrate
+from binp.journals import Journals, current_journal
+from tests import atest, TestWithDB, set_sequence
+
+MIGRATIONS = Path(__file__).absolute().parent.parent / 'binp' / 'migrations' / 'sqlite'
+
+
+class TestArchive(TestWithDB):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = TemporaryDirectory()
+        self.archive = Archive(Path(self.tmp.name), self.db, batch_size=2)
+        self.journal = Journals(self.db, archive=self.archive)
+
+    def tearDown(self) -> None:
+        get_event_loop().run_until_complete(self.archive.close())
+        super().tearDown()
+        self.tmp.cleanup()
+
+    async def make(self, started_at: str) -> int:
+        journal = self.journal
+
+        @journal(operation='sample')
+        async def sample():
+            await journal.labels('month-' + started_at[:7])
+            await journal.record('step', value=started_at)
+            return current_journal.get()
+
+        journal_id = await sample()
+        await self.db.execute('UPDATE journal SET started_at = :started_at WHERE id = :id', values={
+            'started_at': started_at,
+            'id': journal_id,
+        })
+        return journal_id
+
+    @atest
+    async def test_rotate(self):
+        old = [await self.make('2020-01-10 10:00:00'), await self.make('2020-01-20 10:00:00'),
+               await self.make('2020-02-01 00:00:00')]
+        recent = [await self.make('2020-03-05 10:00:00'), await self.make('2020-03-06 10:00:00')]
+
+        moved = await self.archive.rotate(now=datetime(2020, 3, 15))
+        assert moved == 3
+        assert self.archive.partitions() == ['2020-02', '2020-01']
+        rows = await self.db.fetch_all('SELECT id FROM journal')
+        assert sorted(row['id'] for row in rows) == recent
+        assert len(await self.db.fetch_all('SELECT * FROM record')) == 2
+        # nothing to move
+        assert await self.archive.rotate(now=datetime(2020, 3, 15)) == 0
+
+        # transparent history, newest first, with paging across partitions
+        expected = list(reversed(old + recent))
+        assert [x.id for x in await self.journal.history(limit=100)] == expected
+        for offset in range(len(expected) + 1):
+            page = await self.journal.history(offset=offset, limit=2)
+            assert [x.id for x in page] == expected[offset:offset + 2], offset
+
+        # search across partitions
+        res = await self.journal.search(labels=['month-2020-01'])
+        assert [x.id for x in res] == list(reversed(old[:2]))
+        res = await self.journal.search(operation='sample', offset=3, limit=10)
+        assert [x.id for x in res] == list(reversed(old[:2]))
+
+        # get archived journal
+        info = await self.journal.get(old[0])
+        assert info is not None
+        assert info.labels == ['month-2020-01']
+        assert info.records[0].params == {'value': '2020-01-10 10:00:00'}
+        assert (await self.journal.headline(old[2])).id == old[2]
+        assert await self.journal.get(100500) is None
+
+        # drop is removing file
+        await self.archive.drop('2020-01')
+        assert self.archive.partitions() == ['2020-02']
+        assert await self.journal.get(old[0]) is None
+        assert [x.id for x in await self.journal.history(limit=100)] == list(reversed(old[2:] + recent))
+
+    @atest
+    async def test_keep(self):
+        await self.make('2020-01-10 10:00:00')
+        archive = Archive(Path(self.tmp.name), self.db, keep=3)
+        assert await archive.rotate(now=datetime(2020, 3, 15)) == 0
+        assert await archive.rotate(now=datetime(2020, 4, 1)) == 1
+        await archive.close()
+
+    @atest
+    async def test_legacy_partition(self):
+        from databases import Database
+
+        # partition created before strings were interned: IDs of strings are assigned by the partition itself
+        with TemporaryDirectory() as legacy_migrations:
+            for path in sorted(MIGRATIONS.glob('*.sql'))[:5]:
+                copy(path, legacy_migrations)
+            legacy = Database(f'sqlite:///{Path(self.tmp.name) / "journal-2020-01.db"}')
+            await legacy.connect()
+            try:
+                online = await migrate(legacy, Path(legacy_migrations))
+                if online is not None:
+                    await online
+                for journal_id, operation, field in ((1, 'legacy', 'size'), (2, 'sample', 'value')):
+                    await legacy.execute(f"""INSERT INTO journal (id, operation, description, started_at, finished_at)
+                                             VALUES ({journal_id}, '{operation}', '', '2020-01-01 10:00:00',
+                                                     '2020-01-01 10:00:01')""")
+                    await legacy.execute(f"""INSERT INTO record (id, journal_id, message)
+                                             VALUES ({journal_id}, {journal_id}, 'step')""")
+                    await legacy.execute(f"""INSERT INTO record_field (record_id, name, value)
+                                             VALUES ({journal_id}, '{field}', '{journal_id}')""")
+            finally:
+                await legacy.disconnect()
+
+        # IDs of journals and records are shared by current database and partitions
+        await set_sequence(self.db, 'journal', 10)
+        await set_sequence(self.db, 'record', 10)
+        moved = await self.make('2020-01-10 10:00:00')
+        assert await self.archive.rotate(now=datetime(2020, 3, 15)) == 1
+
+        legacy_journal = await self.journal.get(1)
+        assert legacy_journal.operation == 'legacy'
+        assert legacy_journal.records[0].params == {'size': 1}
+        sample = await self.journal.get(2)
+        assert sample.operation == 'sample'
+        assert sample.records[0].params == {'value': 2}
+        info = await self.journal.get(moved)
+        assert info.operation == 'sample'
+        assert info.records[0].params == {'value': '2020-01-10 10:00:00'}
+        res = await self.journal.search(operation='sample')
+        assert [x.id for x in res] == [moved, 2]
@@ -0,0 +1,26 @@
+from unittest import TestCase
+
+from benchmarks.common import generate_journals, stats
+from benchmarks.suite import BENCHMARKS
+from tests import atest
+
+
+class TestBenchmarks(TestCase):
+    def test_dataset(self):
+        first = [journal.dict() for journal in generate_journals(20, seed=1)]
+        second = [journal.dict() for journal in generate_journals(20, seed=1)]
+        assert first == second
+        assert first != [journal.dict() for journal in generate_journals(20, seed=2)]
+
+    def test_stats(self):
+        result = stats([i / 1000 for i in range(1, 101)])
+        assert result['count'] == 100
+        assert result['p50_ms'] == 51
+        assert result['max_ms'] == 100
+
+    @atest
+    async def test_smoke(self):
+        for name, fn in BENCHMARKS.items():
+            result = await fn(50, 42)
+            assert result, name
+            assert result.get('lost', 0) == 0, name
@@ -0,0 +1,106 @@
+from os import utime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+
+from binp.action import Action
+from binp.api import create_internal
+from binp.blobs import BlobStore
+from binp.export import serialize, Format, parse_ndjson
+from binp.journals import Journals
+from binp.kv import KV
+from binp.service import Service
+from tests import atest, call, TestWithDB
+from tests.test_export import collect
+
+
+class TestBlobs(TestWithDB):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = TemporaryDirectory()
+        self.blobs = BlobStore(Path(self.tmp.name), threshold=1024)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.tmp.cleanup()
+
+    @atest
+    async def test_offload(self):
+        journals = Journals(self.db, blobs=self.blobs)
+        body = {'items': ['x' * 100] * 100}
+
+        @journals
+        async def fetch():
+            await journals.record('fetched', body=body, status=200)
+            await journals.record('again', body=body)
+
+        await fetch()
+        journal = (await journals.search(operation=fetch.__qualname__))[0]
+        journal = await journals.get(journal.id)
+        second, first = journal.records
+        assert first.params['status'] == 200
+        reference = first.params['body']
+        digest = self.blobs.digest(reference)
+        assert digest is not None and second.params['body'] == reference
+        # deduplicated
+        assert len(list(Path(self.tmp.name).glob('??/*'))) == 1
+        assert await self.blobs.load(reference) == body
+        assert await self.blobs.load(200) == 200
+        assert self.blobs.path('../../data.db') is None
+
+        app = create_internal(journals, KV(db=self.db), Action(), Service())
+        status, headers, content = await call(app, f'/blob/{digest}')
+        assert status == 200
+        assert headers['content-type'] == 'application/json'
+        assert 'immutable' in headers['cache-control']
+        assert len(content) == reference['size']
+        status, _, _ = await call(app, '/blob/' + '0' * 64)
+        assert status == 404
+
+    @atest
+    async def test_sweep(self):
+        journals = Journals(self.db, blobs=self.blobs)
+
+        @journals
+        async def fetch(value: str):
+            await journals.record('fetched', body=value)
+
+        await fetch('a' * 2000)
+        await fetch('b' * 2000)
+        assert await journals.sweep_blobs() == 0
+        await self.db.execute("DELETE FROM record_field")
+        await fetch('a' * 2000)
+        # recently written blobs are kept
+        assert await journals.sweep_blobs() == 0
+        for path in Path(self.tmp.name).glob('??/*'):
+            utime(path, (time() - 7200, time() - 7200))
+        assert await journals.sweep_blobs() == 1
+        assert len(list(Path(self.tmp.name).glob('??/*'))) == 1
+
+    @atest
+    async def test_export_import(self):
+        journals = Journals(self.db, blobs=self.blobs)
+        body = {'items': ['x' * 100] * 100}
+
+        @journals
+        async def fetch():
+            await journals.record('fetched', body=body, status=200)
+
+        await fetch()
+        data = await collect(serialize(journals.export(records=True), Format.ndjson))
+        # export is self-contained: blobs are inlined
+        assert b'$blob' not in data
+
+        with TemporaryDirectory() as target:
+            restored = Journals(self.db, blobs=BlobStore(Path(target), threshold=1024))
+            remap = {}
+
+            async def chunks():
+                yield data
+
+            await restored.load(parse_ndjson(chunks()), remap=remap.__setitem__)
+            journal = await restored.get(list(remap.values())[0])
+            params = journal.records[0].params
+            assert params['status'] == 200
+            assert restored.blobs.digest(params['body']) is not None
+            assert await restored.blobs.load(params['body']) == body
@@ -0,0 +1,193 @@
+from asyncio import sleep, gather, get_event_loop
+from unittest import TestCase
+
+from pydantic.main import BaseModel
+
+from binp.cache import Cache
+from binp.kv import KV
+from tests import atest, TestWithDB
+
+
+class User(BaseModel):
+    id: int
+    name: str
+
+
+class TestCache(TestCase):
+    @atest
+    async def test_memoize(self):
+        cache = Cache()
+        calls = []
+
+        @cache(maxsize=2)
+        async def square(value: int, power: int = 2):
+            calls.append(value)
+            return value ** power
+
+        assert await square(2) == 4
+        assert await square(2) == 4
+        assert await square(value=2, power=2) == 4
+        assert calls == [2]
+        assert await square(3) == 9
+        assert await square(2) == 4
+        # least recently used (3) is evicted
+        assert await square(4) == 16
+        assert await square(2) == 4
+        assert await square(3) == 9
+        assert calls == [2, 3, 4, 3]
+
+        info = cache.caches[0]
+        assert info.name == square.__qualname__
+        assert info.hits == 4 and info.misses == 4
+        assert info.size == 2
+
+        await square.invalidate(3)
+        await square(3)
+        assert calls == [2, 3, 4, 3, 3]
+
+    @atest
+    async def test_ttl(self):
+        cache = Cache()
+        calls = 0
+
+        @cache(ttl=0.05)
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await fetch() == 1
+        assert await fetch() == 1
+        await sleep(0.06)
+        assert await fetch() == 2
+
+    @atest
+    async def test_single_flight(self):
+        cache = Cache()
+        calls = 0
+
+        @cache
+        async def slow(value: int):
+            nonlocal calls
+            calls += 1
+            await sleep(0.02)
+            return value
+
+        assert await gather(*[slow(1) for _ in range(10)]) == [1] * 10
+        assert calls == 1
+        assert cache.caches[0].misses == 1 and cache.caches[0].hits == 9
+
+    @atest
+    async def test_invalidate_inflight(self):
+        cache = Cache()
+        calls = 0
+
+        @cache
+        async def slow():
+            nonlocal calls
+            calls += 1
+            call = calls
+            await sleep(0.02)
+            return call
+
+        for reset in (lambda: slow.invalidate(), lambda: slow.clear()):
+            await slow.clear()
+            pending = get_event_loop().create_task(slow())
+            await sleep(0.01)
+            await reset()
+            # new callers don't join stale execution
+            fresh = get_event_loop().create_task(slow())
+            assert await pending == calls - 1
+            assert await fresh == calls
+            # stale result is not cached after invalidation
+            assert await slow() == calls
+
+    @atest
+    async def test_errors(self):
+        cache = Cache()
+        calls = 0
+
+        @cache
+        async def fail():
+            nonlocal calls
+            calls += 1
+            raise RuntimeError('upstream unavailable')
+
+        for _ in range(2):
+            try:
+                await fail()
+                assert False
+            except RuntimeError:
+                pass
+        assert calls == 2
+
+    def test_validation(self):
+        for kwargs in ({'ttl': 0}, {'maxsize': 0}, {'persist': True}):
+            try:
+                Cache()(**kwargs)
+                assert False, kwargs
+            except ValueError:
+                pass
+
+
+class TestPersistentCache(TestWithDB):
+    @atest
+    async def test_persist(self):
+        calls = 0
+
+        async def get_user(user_id: int) -> User:
+            nonlocal calls
+            calls += 1
+            return User(id=user_id, name=f'user {user_id}')
+
+        first = Cache(KV(db=self.db))(get_user, name='users', persist=True, ttl=60)
+        assert await first(1) == User(id=1, name='user 1')
+        assert calls == 1
+
+        # another process (or restart)
+        second = Cache(KV(db=self.db))(get_user, name='users', persist=True, ttl=60)
+        user = await second(1)
+        assert isinstance(user, User) and user.name == 'user 1'
+        assert calls == 1
+        assert second.info.hits == 1 and second.info.misses == 0
+
+        await second.clear()
+        third = Cache(KV(db=self.db))(get_user, name='users', persist=True, ttl=60)
+        await third(1)
+        assert calls == 2
+
+    @atest
+    async def test_stale_persisted(self):
+        kv = KV(db=self.db)
+        calls = 0
+
+        async def get_user(user_id: int) -> User:
+            nonlocal calls
+            calls += 1
+            if calls > 3:
+                raise RuntimeError('upstream unavailable')
+            return User(id=user_id, name=f'user {user_id}')
+
+        users = Cache(kv)(get_user, name='users', persist=True, maxsize=1, ttl=0.05)
+        storage = kv.select('cache:users')
+        await users(1)
+        await users(2)
+        # least recently used result is removed from storage too
+        keys = await storage.keys()
+        assert len(keys) == 1
+
+        # incompatible result (ex: saved by previous version) is a miss
+        await storage.set(**{keys[0]: {'expires_at': None, 'value': {'id': 'two'}}})
+        restarted = Cache(kv)(get_user, name='users', persist=True, maxsize=1, ttl=0.05)
+        assert await restarted(2) == User(id=2, name='user 2')
+        assert calls == 3
+
+        # expired result is removed from storage
+        await sleep(0.06)
+        restarted = Cache(kv)(get_user, name='users', persist=True, maxsize=1, ttl=0.05)
+        try:
+            await restarted(2)
+            assert False
+        except RuntimeError:
+            pass
+        assert await storage.keys() == []
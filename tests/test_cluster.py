@@ -0,0 +1,120 @@
+from asyncio import wait_for, sleep
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from binp.action import Action
+from binp.api import create_internal
+from binp.cluster import SQLiteBus, FileLeader, Cluster
+from binp.events import Emitter
+from binp.journals import Journals
+from binp.kv import KV
+from binp.schedule import Schedule
+from binp.service import Service, Status
+from tests import atest, call, TestWithDB
+
+
+class TestSQLiteBus(TestWithDB):
+    @atest
+    async def test_deliver(self):
+        event: Emitter[dict] = Emitter('test_deliver')
+        sender = SQLiteBus(self.db, interval=0.01)
+        receiver = SQLiteBus(self.db, interval=0.01)
+        await sender.start()
+        await receiver.start()
+        try:
+            with event.subscribe() as queue:
+                sender.publish('test_deliver', {'hello': 'world'})
+                sender.publish('test_deliver', 2)
+                assert await wait_for(queue.get(), 1) == {'hello': 'world'}
+                assert await wait_for(queue.get(), 1) == 2
+                # own events are not delivered twice
+                assert queue.empty()
+        finally:
+            await sender.stop()
+            await receiver.stop()
+
+
+class TestFileLeader(TestCase):
+    def test_election(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'leader.lock'
+            first = FileLeader(path)
+            second = FileLeader(path)
+            assert first.acquire()
+            assert not second.acquire()
+            assert not second.is_leader
+            first.resign()
+            assert second.acquire()
+            assert second.is_leader
+            second.resign()
+
+    @atest
+    async def test_standby(self):
+        service = Service()
+        service.standby()
+
+        @service(name='leader-only')
+        async def leader_only():
+            pass
+
+        assert service.services[0].status == Status.stopped
+        service.activate()
+        assert service.services[0].status == Status.starting
+
+    @atest
+    async def test_manage_standby(self):
+        service = Service()
+        service.standby()
+
+        @service(name='leader-only')
+        async def leader_only():
+            pass
+
+        app = create_internal(Journals(), KV(), Action(), service)
+        headers = [('Content-Type', 'application/json')]
+        # follower doesn't start a second copy of the service
+        status, _, _ = await call(app, '/service/leader-only', headers, 'PUT', b'{"running": true}')
+        assert status == 409
+        assert service.services[0].status == Status.stopped
+        service.activate()
+        service.stop('leader-only')
+        await sleep(0.01)
+        status, _, _ = await call(app, '/service/leader-only', headers, 'PUT', b'{"running": true}')
+        assert status == 200
+        assert service.services[0].status != Status.stopped
+
+
+class TestCluster(TestWithDB):
+    @atest
+    async def test_schedule_leader(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'leader.lock'
+            runs = {'first': 0, 'second': 0}
+            workers = []
+            for name in runs:
+                cluster = Cluster(bus=SQLiteBus(self.db, interval=0.01), leader=FileLeader(path, interval=0.01))
+                schedule = Schedule()
+                cluster.follow(schedule)
+
+                @schedule(every=0.02, name='tick')
+                async def tick(worker=name):
+                    runs[worker] += 1
+
+                await cluster.start()
+                workers.append((cluster, schedule))
+
+            await sleep(0.15)
+            assert runs['first'] > 0 and runs['second'] == 0, runs
+
+            # leader is gone: another worker takes over the timer
+            first, first_schedule = workers[0]
+            first_schedule.stop()
+            await first.stop()
+            fired = runs['first']
+            await sleep(0.15)
+            assert runs['second'] > 0 and runs['first'] == fired, runs
+
+            second, second_schedule = workers[1]
+            second_schedule.stop()
+            await second.stop()
@@ -0,0 +1,98 @@
+from gzip import decompress
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from starlette.responses import Response
+
+from binp.assets import StaticAssets, precompress, IMMUTABLE, REVALIDATE
+from binp.compression import CompressionMiddleware, negotiate
+from tests import atest, call
+
+
+class TestCompression(TestCase):
+    def test_negotiate(self):
+        assert negotiate('gzip, deflate', ['br', 'gzip']) == 'gzip'
+        assert negotiate('gzip, br', ['br', 'gzip']) == 'br'
+        assert negotiate('br;q=0, gzip;q=0.5', ['br', 'gzip']) == 'gzip'
+        assert negotiate('identity', ['br', 'gzip']) is None
+        assert negotiate('', ['gzip']) is None
+
+    @atest
+    async def test_middleware(self):
+        payload = b'{"message": "hello world"}' * 100
+
+        async def app(scope, receive, send):
+            if scope['path'] == '/small':
+                response = Response(b'tiny', media_type='text/plain')
+            elif scope['path'] == '/stream':
+                await send({'type': 'http.response.start', 'status': 200,
+                            'headers': [(b'content-type', b'application/x-ndjson')]})
+                for i in range(3):
+                    await send({'type': 'http.response.body', 'body': payload, 'more_body': i < 2})
+                return
+            elif scope['path'] == '/image':
+                response = Response(payload, media_type='image/png')
+            else:
+                response = Response(payload, media_type='application/json')
+            await response(scope, receive, send)
+
+        compressed = CompressionMiddleware(app, minimum_size=100)
+
+        status, headers, body = await call(compressed, '/', [('Accept-Encoding', 'gzip')])
+        assert status == 200
+        assert headers['content-encoding'] == 'gzip'
+        assert headers['vary'] == 'Accept-Encoding'
+        assert int(headers['content-length']) == len(body) < len(payload)
+        assert decompress(body) == payload
+
+        _, headers, body = await call(compressed, '/stream', [('Accept-Encoding', 'gzip')])
+        assert headers['content-encoding'] == 'gzip'
+        assert decompress(body) == payload * 3
+
+        _, headers, body = await call(compressed, '/small', [('Accept-Encoding', 'gzip')])
+        assert 'content-encoding' not in headers
+        assert body == b'tiny'
+
+        _, headers, body = await call(compressed, '/image', [('Accept-Encoding', 'gzip')])
+        assert 'content-encoding' not in headers
+        assert body == payload
+
+        _, headers, body = await call(compressed, '/')
+        assert 'content-encoding' not in headers
+        assert body == payload
+
+
+class TestAssets(TestCase):
+    @atest
+    async def test_static(self):
+        with TemporaryDirectory() as tmp:
+            directory = Path(tmp)
+            (directory / 'build').mkdir()
+            script = b'console.log("hello world");\n' * 100
+            # hashed names are produced by bundler
+            name = 'main-0123abcd.js'
+            (directory / 'build' / name).write_bytes(script)
+            (directory / 'index.html').write_text(f'<script type="module" src="build/{name}"></script>')
+
+            created = precompress(directory)
+            assert directory / 'build' / (name + '.gz') in created
+            # too small
+            assert not (directory / 'index.html.gz').exists()
+
+            app = StaticAssets(directory=tmp)
+            status, headers, body = await call(app, '/build/' + name, [('Accept-Encoding', 'gzip')])
+            assert status == 200
+            assert headers['content-encoding'] == 'gzip'
+            assert 'javascript' in headers['content-type']
+            assert headers['cache-control'] == IMMUTABLE
+            assert decompress(body) == script
+
+            status, headers, body = await call(app, '/build/' + name)
+            assert 'content-encoding' not in headers
+            assert headers['vary'] == 'Accept-Encoding'
+            assert body == script
+
+            status, headers, body = await call(app, '/index.html', [('Accept-Encoding', 'gzip')])
+            assert headers['cache-control'] == REVALIDATE
+            assert 'content-encoding' not in headers
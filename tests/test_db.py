@@ -0,0 +1,88 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import TestCase
+
+from databases import Database, DatabaseURL
+
+from binp.db import migrate, scan, dialect, SQLITE, POSTGRESQL
+from tests import atest
+
+
+class TestMigrate(TestCase):
+    db_file = Path() / 'migrate.db'
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.db_file.unlink(missing_ok=True)
+        self.tmp = TemporaryDirectory()
+        self.src = Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.tmp.cleanup()
+        self.db_file.unlink(missing_ok=True)
+        scan.cache_clear()
+
+    def write(self, name: str, sql: str):
+        (self.src / name).write_text(sql)
+        scan.cache_clear()
+
+    @atest
+    async def test_migrate(self):
+        self.write('0001_a.sql', 'CREATE TABLE a (id INTEGER); CREATE TABLE b (id INTEGER);')
+        self.write('0002_b.sql', '-- binp: online\nCREATE INDEX IF NOT EXISTS a_idx ON a (id);')
+        async with Database(f'sqlite:///{self.db_file}') as db:
+            online = await migrate(db, self.src)
+            assert online is not None
+            await online
+            rows = await db.fetch_all('SELECT name, checksum FROM _migration ORDER BY name')
+            assert [row['name'] for row in rows] == ['0001_a.sql', '0002_b.sql']
+            assert all(row['checksum'] for row in rows)
+            # up to date
+            assert await migrate(db, self.src) is None
+            index = await db.fetch_one("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'a_idx'")
+            assert index is not None
+
+            self.write('0003_c.sql', 'CREATE TABLE c (id INTEGER);')
+            assert await migrate(db, self.src) is None
+            await db.execute('INSERT INTO c (id) VALUES (1)')
+
+    @atest
+    async def test_rollback(self):
+        self.write('0001_a.sql', 'CREATE TABLE a (id INTEGER);')
+        self.write('0002_b.sql', 'CREATE TABLE b (id INTEGER); CREATE TABLE a (id INTEGER);')
+        async with Database(f'sqlite:///{self.db_file}') as db:
+            try:
+                await migrate(db, self.src)
+                assert False, 'migration should fail'
+            except Exception:
+                pass
+            tables = await db.fetch_all("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('a', 'b')")
+            assert len(tables) == 0
+            assert len(await db.fetch_all('SELECT * FROM _migration')) == 0
+
+    @atest
+    async def test_legacy(self):
+        self.write('0001_a.sql', 'CREATE TABLE a (id INTEGER);')
+        self.write('0002_b.sql', 'CREATE TABLE b (id INTEGER);')
+        async with Database(f'sqlite:///{self.db_file}') as db:
+            await db.execute('CREATE TABLE _migration (name TEXT NOT NULL, namespace TEXT NOT NULL, '
+                             'PRIMARY KEY(name,namespace))')
+            await db.execute('CREATE TABLE a (id INTEGER)')
+            await db.execute("INSERT INTO _migration (name, namespace) VALUES ('0001_a.sql', 'default')")
+
+            await migrate(db, self.src)
+            rows = await db.fetch_all('SELECT name, checksum FROM _migration ORDER BY name')
+            assert [row['name'] for row in rows] == ['0001_a.sql', '0002_b.sql']
+            assert all(row['checksum'] for row in rows)
+
+    def test_dialects(self):
+        root = Path(__file__).absolute().parent.parent / 'binp' / 'migrations'
+        sqlite = [migration.name for migration in scan(root / 'sqlite')[0]]
+        postgresql = [migration.name for migration in scan(root / 'postgresql')[0]]
+        assert sqlite == postgresql
+        assert dialect(Database('sqlite:///data.db')) == SQLITE
+        # driver for PostgreSQL may be not installed
+        assert dialect(SimpleNamespace(url=DatabaseURL('postgres://localhost/binp'))) == POSTGRESQL
+        assert dialect(SimpleNamespace(url=DatabaseURL('postgresql://localhost/binp'))) == POSTGRESQL
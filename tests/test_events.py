@@ -1,7 +1,7 @@
-from asyncio import get_event_loop, Event
+from asyncio import get_event_loop, Event, sleep
 from unittest import TestCase
 
-from binp.events import Emitter
+from binp.events import Emitter, EventsLost
 from tests import atest
 
 
@@ -31,6 +31,32 @@ class TestEmitter(TestCase):
 
         await done.wait()
 
+    @atest
+    async def test_close(self):
+        event: Emitter[int] = Emitter()
+        received = []
+        done = Event()
+
+        @event
+        async def listener(value: int):
+            received.append(value)
+
+        async def consumer():
+            with event.subscribe() as queue:
+                while True:
+                    value = await queue.get()
+                    if value is None:
+                        break
+            done.set()
+
+        get_event_loop().create_task(consumer())
+        await sleep(0)
+        event.emit(1)
+        event.emit(2)
+        event.close()
+        await done.wait()
+        assert received == [1, 2]
+
     def test_decorator_without_loop(self):
         event: Emitter[str] = Emitter()
         done = Event()
@@ -45,3 +71,56 @@ class TestEmitter(TestCase):
             await done.wait()
 
         get_event_loop().run_until_complete(main())
+
+    @atest
+    async def test_resume(self):
+        event: Emitter[str] = Emitter(replay=3)
+        with event.resume() as queue:
+            for value in 'abcd':
+                event.emit(value)
+            received = [queue.get_nowait() for _ in range(4)]
+        assert [item.sequence for item in received] == [1, 2, 3, 4]
+        assert [item.payload for item in received] == list('abcd')
+        assert received[0].emitter is event
+
+        with event.resume(after=2) as queue:
+            event.emit('e')
+            event.close()
+            received = []
+            item = await queue.get()
+            while item is not None:
+                received.append((item.sequence, item.payload))
+                item = await queue.get()
+        assert received == [(3, 'c'), (4, 'd'), (5, 'e')]
+
+        assert event.since(5) == []
+        with self.assertRaises(EventsLost):
+            event.since(1)
+        with self.assertRaises(EventsLost):
+            # unknown sequence (ex: emitter re-created after restart)
+            event.since(10)
+
+        plain: Emitter[str] = Emitter()
+        assert plain.since(0) == []
+        plain.emit('a')
+        with self.assertRaises(EventsLost):
+            plain.since(0)
+
+    @atest
+    async def test_keyed(self):
+        event: Emitter[dict] = Emitter(key=lambda payload: payload['id'], replay=10)
+        with event.subscribe(key=1) as first, event.subscribe(key=2) as second, event.subscribe() as everything:
+            event.emit({'id': 1})
+            event.emit({'id': 3})
+            event.emit({'id': 1})
+            assert first.qsize() == 2
+            assert second.qsize() == 0
+            assert everything.qsize() == 3
+            with event.resume(after=0, key=3) as resumed:
+                assert resumed.get_nowait().sequence == 2
+                event.emit({'id': 3})
+                assert resumed.get_nowait().sequence == 4
+            event.close()
+            assert second.get_nowait() is None
+        # unsubscribed keys are removed
+        event.emit({'id': 1})
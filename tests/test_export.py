@@ -0,0 +1,111 @@
+from csv import reader
+from gzip import decompress
+from io import StringIO
+from json import loads
+
+from binp.export import serialize, Format, parse_ndjson
+from binp.journals import Journals, current_journal
+from tests import atest, TestWithDB, indexes
+
+
+async def collect(chunks) -> bytes:
+    return b''.join([chunk async for chunk in chunks])
+
+
+class TestExport(TestWithDB):
+    async def fill(self, journal: Journals, count: int):
+        @journal(operation='sample')
+        async def sample(i: int):
+            await journal.labels('even' if i % 2 == 0 else 'odd')
+            await journal.record('step', index=i)
+            await journal.record('done')
+            return current_journal.get()
+
+        return [await sample(i) for i in range(count)]
+
+    @atest
+    async def test_export(self):
+        journal = Journals(self.db)
+        ids = await self.fill(journal, 7)
+
+        items = [item async for item in journal.export(batch_size=2)]
+        assert [item.id for item in items] == ids
+        assert not hasattr(items[0], 'records')
+        assert items[0].labels == ['even']
+
+        items = [item async for item in journal.export(records=True, labels=['odd'], batch_size=2)]
+        assert [item.id for item in items] == ids[1::2]
+        assert [record.message for record in items[0].records] == ['step', 'done']
+        assert items[0].records[0].params == {'index': 1}
+
+        items = [item async for item in journal.export(after=ids[4])]
+        assert [item.id for item in items] == ids[5:]
+
+        started_at = (await journal.headline(ids[3])).started_at
+        await self.db.execute('UPDATE journal SET started_at = :started_at WHERE id <= :id', values={
+            'started_at': '2000-01-01 00:00:00',
+            'id': ids[2],
+        })
+        items = [item async for item in journal.export(since=started_at.replace(microsecond=0))]
+        assert [item.id for item in items] == ids[3:]
+
+    @atest
+    async def test_formats(self):
+        journal = Journals(self.db)
+        ids = await self.fill(journal, 3)
+
+        data = await collect(serialize(journal.export(records=True), Format.ndjson))
+        lines = [loads(line) for line in data.decode().splitlines()]
+        assert [line['id'] for line in lines] == ids
+        assert lines[0]['records'][0]['params'] == {'index': 0}
+
+        data = await collect(serialize(journal.export(), Format.csv, compress=True))
+        rows = list(reader(StringIO(decompress(data).decode())))
+        assert rows[0][0] == 'id'
+        assert [int(row[0]) for row in rows[1:]] == ids
+        assert rows[1][7] == 'even'
+        assert rows[1][8] == ''
+
+    @atest
+    async def test_import(self):
+        journal = Journals(self.db)
+        ids = await self.fill(journal, 5)
+        data = await collect(serialize(journal.export(records=True), Format.ndjson, compress=True))
+        before = await indexes(self.db)
+
+        async def chunks():
+            # split to small chunks to check parsing across boundaries
+            for offset in range(0, len(data), 7):
+                yield data[offset:offset + 7]
+
+        remap = {}
+        stats = await journal.load(parse_ndjson(chunks()), batch_size=2, rebuild_indexes=True,
+                                   remap=remap.__setitem__)
+        assert stats.journals == 5
+        assert stats.records == 10
+        assert list(remap.keys()) == ids
+        assert all(new_id > max(ids) for new_id in remap.values())
+        assert await indexes(self.db) == before
+
+        for old_id, new_id in remap.items():
+            original = await journal.get(old_id)
+            imported = await journal.get(new_id)
+            assert imported.dict(exclude={'id'}) == original.dict(exclude={'id'})
+
+        # new journals are not conflicting with imported
+        new_id = (await self.fill(journal, 1))[0]
+        assert new_id > max(remap.values())
+
+    @atest
+    async def test_import_headlines(self):
+        journal = Journals(self.db)
+        await self.fill(journal, 2)
+        data = await collect(serialize(journal.export(), Format.ndjson))
+
+        async def chunks():
+            yield data
+
+        stats = await journal.load(parse_ndjson(chunks()))
+        assert stats.journals == 2
+        assert stats.records == 0
+        assert len(await journal.history()) == 4
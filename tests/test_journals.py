@@ -1,7 +1,20 @@
-from asyncio import sleep, get_event_loop, Event
+from asyncio import sleep, get_event_loop, Event, CancelledError
+from json import loads
+from pathlib import Path
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
 
-from binp.journals import Journals, current_journal
-from tests import atest, TestWithDB
+from databases import Database
+
+from binp.action import Action
+from binp.api import create_internal
+from binp.db import migrate, scan
+from binp.journals import Journals, Versions, OperationStats, current_journal
+from binp.kv import KV
+from binp.service import Service
+from tests import atest, call, TestWithDB
 
 
 class TestJournals(TestWithDB):
@@ -20,7 +33,7 @@ class TestJournals(TestWithDB):
         res = await sample()
         assert res > 0
 
-        records = await self.db.fetch_all('SELECT * FROM journal WHERE id = :id', values={'id': res})
+        records = await self.db.fetch_all('SELECT * FROM journal_info WHERE id = :id', values={'id': res})
         assert len(records) == 1
         assert records[0]['operation'] == 'sample'
         assert records[0]['description'] == 'Some description'
@@ -42,7 +55,7 @@ class TestJournals(TestWithDB):
 
         res = await sample()
 
-        records = await self.db.fetch_one('SELECT * FROM journal WHERE id = :id', values={'id': res})
+        records = await self.db.fetch_one('SELECT * FROM journal_info WHERE id = :id', values={'id': res})
         assert records['operation'] == 'sample'
         assert records['description'] == 'Foo bar'
 
@@ -59,7 +72,7 @@ class TestJournals(TestWithDB):
 
         res = await sample()
 
-        records = await self.db.fetch_one('SELECT * FROM journal WHERE id = :id', values={'id': res})
+        records = await self.db.fetch_one('SELECT * FROM journal_info WHERE id = :id', values={'id': res})
         assert records['operation'] == sample.__qualname__
         assert records['description'] == 'Some description'
 
@@ -206,3 +219,291 @@ class TestJournals(TestWithDB):
         res = await journal.search(labels=['alfa'])
         assert len(res) == 3, len(res)
         assert set(x.operation for x in res) == {'sample', failed.__qualname__}
+
+    @atest
+    async def test_cancel_and_close(self):
+        journal = Journals(self.db)
+        started = Event()
+
+        @journal(operation='cancelled')
+        async def cancelled():
+            started.set()
+            await sleep(10000)
+
+        task = get_event_loop().create_task(cancelled())
+        await started.wait()
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
+
+        res = await journal.search(operation='cancelled')
+        assert len(res) == 1
+        assert res[0].error == 'cancelled'
+        assert res[0].finished_at is not None
+
+        started.clear()
+
+        @journal(operation='pending')
+        async def pending():
+            started.set()
+            await sleep(10000)
+
+        task = get_event_loop().create_task(pending())
+        await started.wait()
+        await journal.close()
+
+        res = await journal.search(pending=True)
+        assert len(res) == 0
+        res = await journal.search(operation='pending')
+        assert res[0].error == 'interrupted by shutdown'
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
+        # the function finished after close doesn't overwrite its journal
+        res = await journal.search(operation='pending')
+        assert res[0].error == 'interrupted by shutdown'
+
+    @atest
+    async def test_remove_dead(self):
+        journal = Journals(self.db)
+        started = Event()
+
+        @journal(operation='dead')
+        async def dead():
+            await journal.labels('alfa')
+            await journal.record('step', value=1)
+            started.set()
+            await sleep(10000)
+
+        task = get_event_loop().create_task(dead())
+        await started.wait()
+        await journal.remove_dead()
+        assert len(await journal.history()) == 0
+        assert len(await self.db.fetch_all('SELECT * FROM record')) == 0
+        assert len(await self.db.fetch_all('SELECT * FROM record_field')) == 0
+        assert len(await self.db.fetch_all('SELECT * FROM journal_label')) == 0
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
+
+    @atest
+    async def test_many_fields(self):
+        journal = Journals(self.db)
+        fields = {f'field_{i}': i for i in range(1000)}
+
+        @journal
+        async def sample():
+            await journal.record('many fields', **fields)
+            await journal.record('no fields')
+            return current_journal.get()
+
+        journal_id = await sample()
+        info = await journal.get(journal_id)
+        assert [record.message for record in info.records] == ['no fields', 'many fields']
+        assert info.records[1].params == fields
+
+    @atest
+    async def test_versions(self):
+        journal = Journals(self.db)
+        started = Event()
+        proceed = Event()
+
+        @journal(operation='sample')
+        async def sample():
+            started.set()
+            await proceed.wait()
+            await journal.record('step')
+            await journal.labels('alfa')
+            return current_journal.get()
+
+        initial = journal.version()
+        task = get_event_loop().create_task(sample())
+        await started.wait()
+        journal_id = (await journal.history())[0].id
+        versions = {journal.version(journal_id)}
+        assert journal.version() != initial
+
+        proceed.set()
+        assert await task == journal_id
+        assert journal.version(journal_id) not in versions
+        versions.add(journal.version(journal_id))
+        assert journal.version(journal_id) == journal.version(journal_id)
+
+        # untouched journal is not affected
+        other = await sample()
+        assert journal.version(journal_id) in versions
+        assert journal.version(other) != journal.version(journal_id)
+
+    def test_versions_eviction(self):
+        versions = Versions(capacity=2)
+        versions.bump(1)
+        first = versions.get(1)
+        versions.bump(2)
+        versions.bump(3)
+        # evicted journal is never reported with version lower than actual
+        assert versions.get(1) >= first
+        assert versions.get(3) == versions.current
+        old = versions.get(4)
+        versions.bump(4)
+        assert versions.get(4) > old
+        versions.reset()
+        assert versions.get(2) == versions.current
+
+    @atest
+    async def test_sampling(self):
+        journal = Journals(self.db)
+        seen = []
+
+        @journal(operation='hot', sample=3)
+        async def hot(fail: bool = False):
+            seen.append(current_journal.get())
+            await journal.record('handled', value=1)
+            await journal.labels('hot')
+            if fail:
+                raise RuntimeError('broken')
+
+        for _ in range(7):
+            await hot()
+        try:
+            await hot(fail=True)
+            assert False, 'exception should be re-raised'
+        except RuntimeError:
+            pass
+
+        # 1st, 4th and 7th calls are journaled during execution, failed call - after completion
+        assert [x is not None for x in seen] == [True, False, False, True, False, False, True, False]
+        found = await journal.search(operation='hot', limit=100)
+        assert len(found) == 4
+        failed = await journal.get(found[0].id)
+        assert failed.error == 'broken' and failed.labels == ['hot'] and failed.duration is not None
+        assert [(x.message, x.params) for x in failed.records] == [('handled', {'value': 1})]
+        # not sampled records are not written
+        assert (await self.db.fetch_one('SELECT count(*) FROM record'))[0] == 4
+
+        stats = journal.operations[0]
+        assert stats.operation == 'hot' and stats.sample == 3
+        assert stats.calls == 8 and stats.failed == 1 and stats.journaled == 4
+        assert stats.duration >= stats.max_duration > 0
+
+        app = create_internal(journal, KV(db=self.db), Action(), Service())
+        status, _, content = await call(app, '/journals/operations')
+        assert status == 200
+        assert [OperationStats.parse_obj(x) for x in loads(content)] == journal.operations
+
+    @atest
+    async def test_sampling_replay_failed(self):
+        journal = Journals(self.db)
+
+        @journal(operation='lossy', slow=0)
+        async def lossy(fail: bool = False):
+            if fail:
+                raise ValueError('original')
+            return 42
+
+        async def broken(*_):
+            raise RuntimeError('database is locked')
+
+        with patch.object(Journals, '_Journals__replay', broken):
+            # failure of journaling doesn't replace result or exception of the call
+            assert await lossy() == 42
+            with self.assertRaises(ValueError):
+                await lossy(fail=True)
+        assert journal.operations[0].calls == 2
+
+    @atest
+    async def test_sampling_slow(self):
+        journal = Journals(self.db)
+
+        @journal(operation='parent')
+        async def parent():
+            await child(0)
+            await journal.record('parent done')
+
+        @journal(operation='child', slow=0.05)
+        async def child(delay: float):
+            await sleep(delay)
+            # inside not sampled call, records are not added to parent journal
+            await journal.record('child done', delay=delay)
+
+        await parent()
+        await child(0.06)
+        assert await journal.search(operation='child', limit=100) == [await journal.headline(2)]
+        slow = await journal.get(2)
+        assert slow.duration >= 0.05 and slow.error is None and slow.finished_at is not None
+        assert [x.params for x in slow.records] == [{'delay': 0.06}]
+        assert [x.message for x in (await journal.get(1)).records] == ['parent done']
+        assert {x.operation: x.journaled for x in journal.operations} == {'parent': 1, 'child': 1}
+
+        for kwargs in ({'sample': 0}, {'slow': -1}):
+            try:
+                journal(**kwargs)
+                assert False, kwargs
+            except ValueError:
+                pass
+
+
+class TestInternedMigration(TestCase):
+    db_file = Path() / 'interned.db'
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.db_file.unlink(missing_ok=True)
+        self.tmp = TemporaryDirectory()
+        self.src = Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.tmp.cleanup()
+        self.db_file.unlink(missing_ok=True)
+        scan.cache_clear()
+
+    def copy(self, *names: str):
+        root = Path(__file__).absolute().parent.parent / 'binp' / 'migrations' / 'sqlite'
+        for name in names:
+            copyfile(root / name, self.src / name)
+        scan.cache_clear()
+
+    @atest
+    async def test_legacy_data(self):
+        self.copy('0001_init.sql', '0002_journal_label.sql', '0003_event_log.sql', '0004_journal_operation_idx.sql',
+                  '0005_task.sql')
+        async with Database(f'sqlite:///{self.db_file}') as db:
+            online = await migrate(db, self.src)
+            if online is not None:
+                await online
+            await db.execute("INSERT INTO journal (id, operation, description, error) VALUES "
+                             "(1, 'fetch', 'Fetch data', NULL), (2, 'fetch', 'Fetch data', 'failed'), "
+                             "(5, 'push', 'Push data', NULL)")
+            await db.execute("INSERT INTO record (id, journal_id, message) VALUES (1, 1, 'fetched'), (2, 5, 'sent')")
+            await db.execute("INSERT INTO record_field (record_id, name, value) VALUES "
+                             "(1, 'status', '200'), (1, 'url', '\"http://example.com\"'), (2, 'status', '201')")
+
+            self.copy('0006_intern_names.sql')
+            assert await migrate(db, self.src) is None
+
+            journals = Journals(db)
+            assert [x.id for x in await journals.search(operation='fetch')] == [2, 1]
+            assert await journals.search(operation='unknown') == []
+            journal = await journals.get(1)
+            assert journal.operation == 'fetch' and journal.description == 'Fetch data'
+            assert journal.records[0].params == {'status': 200, 'url': 'http://example.com'}
+            assert (await journals.get(5)).records[0].params == {'status': 201}
+
+            # new journals reuse interned names and don't reuse IDs
+            @journals(operation='push', description='Push data')
+            async def push():
+                await journals.record('sent', status=202, attempt=1)
+                return current_journal.get()
+
+            assert await push() == 6
+            assert [x.id for x in await journals.search(operation='push')] == [6, 5]
+            assert (await db.fetch_one('SELECT COUNT(*) AS n FROM operation_name'))['n'] == 2
+            assert (await db.fetch_one('SELECT COUNT(*) AS n FROM field_name'))['n'] == 3
+            row = await db.fetch_one('SELECT operation, description FROM journal_info WHERE id = 6')
+            assert row['operation'] == 'push' and row['description'] == 'Push data'
@@ -1,5 +1,6 @@
 from pydantic.main import BaseModel
 
+from binp.events import Bus, use_bus
 from binp.kv import KV
 from tests import TestWithDB, atest
 
@@ -93,3 +94,26 @@ class TestKV(TestWithDB):
 
         names = set(await kv.namespaces())
         assert names == (names & {'alfa', 'beta'})
+
+    @atest
+    async def test_shared_changes(self):
+        published = []
+
+        class Recorder(Bus):
+            def publish(self, channel, payload):
+                published.append((channel, payload.dict()))
+
+        kv = KV(db=self.db)
+        use_bus(Recorder())
+        try:
+            with kv.key_changed.subscribe() as queue:
+                await kv.set(foo='bar' * 1000)
+                await kv.remove('foo')
+                assert queue.get_nowait().values == {'foo': 'bar' * 1000}
+        finally:
+            use_bus(None)
+        # values are not sent to other processes
+        assert published == [
+            ('key_changed', {'namespace': 'default', 'changed': ['foo'], 'values': {}, 'removed': []}),
+            ('key_changed', {'namespace': 'default', 'changed': [], 'values': {}, 'removed': ['foo']}),
+        ]
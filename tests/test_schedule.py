@@ -0,0 +1,129 @@
+from asyncio import Event, sleep
+from datetime import datetime
+from unittest import TestCase
+
+from binp.action import Action
+from binp.api import create_internal
+from binp.journals import Journals
+from binp.kv import KV
+from binp.schedule import Cron, Schedule
+from binp.service import Service, Status
+from tests import atest, TestWithDB, call
+
+
+class TestCron(TestCase):
+    def test_next(self):
+        start = datetime(2021, 2, 10, 12, 7, 30)
+        assert Cron('*/5 * * * *').next(start) == datetime(2021, 2, 10, 12, 10)
+        assert Cron('0 12 * * *').next(start) == datetime(2021, 2, 11, 12, 0)
+        assert Cron('@monthly').next(start) == datetime(2021, 3, 1, 0, 0)
+        assert Cron('30 8 * * 1-5').next(datetime(2021, 2, 12, 9, 0)) == datetime(2021, 2, 15, 8, 30)
+        assert Cron('0 0 29 2 *').next(start) == datetime(2024, 2, 29, 0, 0)
+        # day of month OR day of week
+        assert Cron('0 0 13 * 0').next(start) == datetime(2021, 2, 13, 0, 0)
+
+    def test_invalid(self):
+        for expression in ('* * * *', '60 * * * *', '*/0 * * * *', '0 0 31 2 *'):
+            try:
+                Cron(expression).next(datetime(2021, 1, 1))
+                assert False, expression
+            except ValueError:
+                pass
+
+
+class TestSchedule(TestCase):
+    @atest
+    async def test_every(self):
+        services = Service()
+        schedule = Schedule(services=services)
+        runs = 0
+        done = Event()
+
+        @schedule(every=0.01, name='tick')
+        async def tick():
+            nonlocal runs
+            runs += 1
+            if runs == 3:
+                done.set()
+
+        info = services.services[0]
+        assert info.name == 'tick'
+        assert info.next_run is not None
+        assert not info.autostart
+
+        await done.wait()
+        schedule.stop()
+
+    @atest
+    async def test_overlap(self):
+        services = Service()
+        schedule = Schedule(services=services)
+        runs = 0
+
+        @schedule(every=0.01)
+        async def slow():
+            nonlocal runs
+            runs += 1
+            await sleep(0.1)
+
+        await sleep(0.05)
+        schedule.stop()
+        assert runs == 1, runs
+        assert services.services[0].status == Status.running
+
+    @atest
+    async def test_pause(self):
+        services = Service()
+        schedule = Schedule(services=services)
+        runs = 0
+
+        @schedule(every=0.01, name='tick')
+        async def tick():
+            nonlocal runs
+            runs += 1
+
+        app = create_internal(Journals(), KV(), Action(), services)
+        headers = [('Content-Type', 'application/json')]
+        status, _, _ = await call(app, '/service/tick', headers, 'PUT', b'{"paused": true}')
+        assert status == 200
+        assert services.services[0].paused
+        await sleep(0.05)
+        assert runs == 0, runs
+        # stopping the (idle) service doesn't resume the job
+        services.stop('tick')
+        await sleep(0.05)
+        assert runs == 0, runs
+
+        assert services.pause('tick', False)
+        await sleep(0.05)
+        schedule.stop()
+        assert runs > 0
+        assert not services.pause('unknown')
+
+    def test_validation(self):
+        schedule = Schedule()
+        for kwargs in ({}, {'cron': '* * * * *', 'every': 1}, {'every': 0}):
+            try:
+                schedule(**kwargs)
+                assert False, kwargs
+            except ValueError:
+                pass
+
+
+class TestScheduleJournal(TestWithDB):
+    @atest
+    async def test_journal(self):
+        journals = Journals(self.db)
+        schedule = Schedule(journals=journals, services=Service())
+        done = Event()
+
+        @schedule(every=0.01, name='job')
+        async def job():
+            done.set()
+
+        await done.wait()
+        schedule.stop()
+        await sleep(0.01)
+
+        res = await journals.search(operation='job')
+        assert len(res) >= 1
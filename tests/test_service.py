@@ -1,7 +1,7 @@
 from asyncio import Event, sleep, get_event_loop
 from unittest import TestCase
 
-from binp.service import Service, Status, Info
+from binp.service import Service, Status, Info, Handler
 from tests import atest
 
 
@@ -86,3 +86,88 @@ class TestService(TestCase):
 
         await bad_run.wait()
         assert len(service.services) == 1
+
+    @atest
+    async def test_crash_loop(self):
+        service = Service()
+        runs = 0
+
+        @service(name='crashing', restart_delay=0.001, crash_limit=3, crash_window=10)
+        async def crashing():
+            nonlocal runs
+            runs += 1
+            raise RuntimeError(f'crash {runs}')
+
+        for _ in range(100):
+            if service.services[0].status == Status.failed:
+                break
+            await sleep(0.01)
+
+        info = service.services[0]
+        assert info.status == Status.failed, info.status
+        assert runs == 3
+        assert [x.error for x in info.failures] == ['crash 1', 'crash 2', 'crash 3']
+        assert info.consecutive_failures == 3
+
+        # manual start resets crash loop detection
+        assert service.start('crashing')
+        await sleep(0.0001)
+        assert service.services[0].status != Status.failed
+
+    @atest
+    async def test_crash_limit_above_history(self):
+        service = Service()
+        runs = 0
+
+        @service(name='crashing', restart_delay=0.001, crash_limit=15, crash_window=10)
+        async def crashing():
+            nonlocal runs
+            runs += 1
+            raise RuntimeError(f'crash {runs}')
+
+        for _ in range(300):
+            if service.services[0].status == Status.failed:
+                break
+            await sleep(0.01)
+
+        info = service.services[0]
+        assert info.status == Status.failed, info.status
+        assert runs == 15
+        # displayed history is still limited
+        assert len(info.failures) == 10
+
+    def test_backoff(self):
+        service = Service()
+
+        @service(name='backoff', autostart=False, restart_delay=1, restart_backoff=2, restart_max_delay=5)
+        async def backoff():
+            pass
+
+        handler = Handler(info=service.services[0], events=service.service_changed, handler=backoff)
+        delays = []
+        for failures in range(6):
+            handler.info.consecutive_failures = failures
+            delays.append(handler.delay)
+        assert delays == [1, 1, 2, 4, 5, 5], delays
+
+        handler.info.restart_jitter = 0.5
+        handler.info.consecutive_failures = 2
+        assert 2 <= handler.delay <= 3
+
+    @atest
+    async def test_shutdown(self):
+        service = Service()
+        stopped = []
+
+        for name in ('first', 'second'):
+            @service(name=name)
+            async def worker(name=name):
+                try:
+                    await sleep(100)
+                finally:
+                    stopped.append(name)
+
+        await sleep(0.0001)
+        await service.shutdown(1)
+        assert stopped == ['second', 'first'], stopped
+        assert all(x.status == Status.stopped for x in service.services)
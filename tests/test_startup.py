@@ -0,0 +1,68 @@
+import sys
+from os import getenv, environ
+from pathlib import Path
+from subprocess import run
+from tempfile import TemporaryDirectory
+from typing import Dict
+from unittest import TestCase
+
+#: total import time budget (in milliseconds) to construct BINP instance, override by environment on slow hosts
+STARTUP_BUDGET_MS = float(getenv('BINP_STARTUP_BUDGET_MS', '1000'))
+
+HEAVY_MODULES = ('fastapi', 'databases', 'sqlalchemy')
+
+
+def import_times(code: str) -> Dict[str, int]:
+    """
+    Run code in a fresh interpreter with ``-X importtime`` and collect self import time (in microseconds)
+    of each module.
+    """
+    res = run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+              cwd=str(Path(__file__).absolute().parent.parent))
+    assert res.returncode == 0, res.stderr
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_time)
+    return times
+
+
+class TestStartup(TestCase):
+    def test_import(self):
+        times = import_times('import binp')
+        assert 'binp' in times
+        loaded = [name for name in HEAVY_MODULES if name in times]
+        assert not loaded, f'heavy modules imported by binp: {loaded}'
+
+    def test_construct(self):
+        times = import_times('from binp import BINP; BINP()')
+        loaded = [name for name in HEAVY_MODULES if name in times]
+        assert not loaded, f'heavy modules imported by BINP(): {loaded}'
+        total = sum(times.values()) / 1000
+        assert total < STARTUP_BUDGET_MS, f'startup took {total:.0f}ms, budget {STARTUP_BUDGET_MS:.0f}ms'
+
+    def test_custom_database(self):
+        code = '''
+from asyncio import get_event_loop
+from databases import Database
+from binp import BINP, Journals, KV
+
+db = Database('sqlite:///custom.db')
+
+async def main():
+    await db.connect()
+    binp = BINP(journal=Journals(db), kv=KV(db=db), cluster=None)
+    await binp.startup()
+    await binp.shutdown()
+    await db.disconnect()
+
+get_event_loop().run_until_complete(main())
+'''
+        with TemporaryDirectory() as tmp:
+            res = run([sys.executable, '-c', code], capture_output=True, text=True, cwd=tmp,
+                      env={**environ, 'PYTHONPATH': str(Path(__file__).absolute().parent.parent)})
+            assert res.returncode == 0, res.stderr
+            # default database is not used
+            assert not (Path(tmp) / 'data.db').exists()
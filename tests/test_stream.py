@@ -0,0 +1,108 @@
+from asyncio import Queue, get_event_loop, wait_for, sleep
+from json import loads
+
+from starlette.websockets import WebSocketDisconnect
+
+from binp.journals import Journals
+from binp.kv import KV
+from binp.service import Service
+from binp.stream import Stream
+from tests import atest, TestWithDB
+
+
+class Socket:
+    def __init__(self):
+        self.incoming = Queue()
+        self.frames = Queue()
+        self.closed = None
+
+    async def accept(self):
+        pass
+
+    async def receive_json(self):
+        message = await self.incoming.get()
+        if message is None:
+            raise WebSocketDisconnect()
+        return message
+
+    async def send_text(self, text: str):
+        self.frames.put_nowait(loads(text))
+
+    async def close(self, code: int = 1000):
+        self.closed = code
+
+    async def frame(self):
+        return await wait_for(self.frames.get(), 5)
+
+
+class TestStream(TestWithDB):
+    @atest
+    async def test_topics(self):
+        journals = Journals(self.db)
+        kv = KV(db=self.db)
+        services = Service()
+        socket = Socket()
+        task = get_event_loop().create_task(Stream(journals, kv, services)(socket))
+
+        socket.incoming.put_nowait({'subscribe': ['journals', 'kv:default', 'unknown']})
+        assert await socket.frame() == [{'topic': 'unknown', 'error': 'unknown topic'}]
+
+        @journals(operation='sample')
+        async def sample():
+            await journals.record('step', index=1)
+            return journals.current
+
+        journal_id = await sample()
+        messages = await socket.frame()
+        # begin and end of the same journal are coalesced or sent in order
+        assert {message['topic'] for message in messages} == {'journals'}
+        while messages[-1]['data']['finished_at'] is None:
+            messages = await socket.frame()
+        assert messages[-1]['data']['id'] == journal_id
+        assert 'records' not in messages[-1]['data']
+
+        await kv.set(name='binp')
+        await kv.select('other').set(name='ignored')
+        await kv.remove('name')
+        messages = await socket.frame()
+        while len(messages) < 2:
+            messages += await socket.frame()
+        assert messages == [
+            {'topic': 'kv:default', 'data': {'namespace': 'default', 'changed': ['name'], 'values': {'name': 'binp'},
+                                             'removed': []}},
+            {'topic': 'kv:default', 'data': {'namespace': 'default', 'changed': [], 'values': {}, 'removed': ['name']}},
+        ]
+
+        socket.incoming.put_nowait({'unsubscribe': 'journals', 'subscribe': f'journal:{journal_id}'})
+        await sleep(0.01)
+        journals.record_added.emit(journal_id)
+        journals.record_added.emit(journal_id + 1)
+        messages = await socket.frame()
+        assert [message['topic'] for message in messages] == [f'journal:{journal_id}']
+        assert messages[0]['data']['records'][0]['params'] == {'index': 1}
+
+        socket.incoming.put_nowait({'subscribe': 'services'})
+        await sleep(0.01)
+
+        @services(autostart=False)
+        async def listener():
+            pass
+
+        messages = await socket.frame()
+        assert messages[0]['topic'] == 'services'
+        assert messages[0]['data']['name'].endswith('listener')
+
+        socket.incoming.put_nowait(None)
+        await wait_for(task, 5)
+        assert socket.closed is None
+
+    @atest
+    async def test_shutdown(self):
+        journals = Journals(self.db)
+        socket = Socket()
+        task = get_event_loop().create_task(Stream(journals, KV(db=self.db), Service())(socket))
+        socket.incoming.put_nowait({'subscribe': 'journals'})
+        await sleep(0.01)
+        journals.journal_updated.close()
+        await wait_for(task, 5)
+        assert socket.closed == 1001
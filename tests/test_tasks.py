@@ -0,0 +1,164 @@
+from asyncio import Event, sleep, gather, wait_for
+from unittest.mock import patch
+
+from pydantic import BaseModel
+
+from binp.journals import Journals
+from binp.service import Service
+from binp.tasks import Tasks, TaskQueue
+from tests import atest, TestWithDB
+
+
+class Order(BaseModel):
+    id: int
+    email: str
+
+
+async def drain(queue: TaskQueue):
+    for _ in range(500):
+        stats = await queue.stats()
+        if stats.pending == 0:
+            return
+        await sleep(0.01)
+
+
+class TestTasks(TestWithDB):
+    @atest
+    async def test_enqueue(self):
+        services = Service()
+        journals = Journals(self.db)
+        tasks = Tasks(journals, services, self.db)
+        received = []
+        done = Event()
+
+        @tasks(name='receipt', workers=4, poll_interval=0.05)
+        async def receipt(order: Order):
+            received.append(order)
+            if len(received) == 50:
+                done.set()
+
+        assert services.services[0].name == 'receipt'
+        await gather(*[receipt.enqueue(Order(id=i, email=f'{i}@example.com')) for i in range(50)])
+        await wait_for(done.wait(), 5)
+        await drain(receipt)
+        services.stop('receipt')
+        await sleep(0.05)
+        await tasks.close()
+
+        assert sorted(order.id for order in received) == list(range(50))
+        assert all(isinstance(order, Order) for order in received)
+        stats = await receipt.stats()
+        assert stats.pending == 0 and stats.failed == 0
+        res = await journals.search(operation='receipt', limit=100)
+        assert len(res) == 50
+
+    @atest
+    async def test_retry(self):
+        services = Service()
+        tasks = Tasks(services=services, db=self.db)
+        attempts = []
+        done = Event()
+
+        @tasks(name='flaky', retry_delay=0.01, max_attempts=3, poll_interval=0.01)
+        async def flaky(payload):
+            attempts.append(payload)
+            if payload['fail'] or len(attempts) < 2:
+                if len(attempts) == 4:
+                    done.set()
+                raise RuntimeError('try again')
+            done.set()
+
+        await flaky.enqueue({'fail': False})
+        await wait_for(done.wait(), 5)
+        assert len(attempts) == 2
+        await sleep(0.05)
+        stats = await flaky.stats()
+        assert stats.pending == 0 and stats.failed == 0
+
+        done.clear()
+        await flaky.enqueue({'fail': True})
+        await wait_for(done.wait(), 5)
+        await sleep(0.05)
+        services.stop('flaky')
+        await sleep(0.05)
+        await tasks.close()
+        # 3 attempts, then marked as failed and not retried
+        assert len(attempts) == 5
+        stats = await flaky.stats()
+        assert stats.pending == 0 and stats.failed == 1
+        row = await self.db.fetch_one("SELECT attempts, error FROM task WHERE queue = 'flaky'")
+        assert row[0] == 3 and row[1] == 'try again'
+
+    @atest
+    async def test_completion_failed(self):
+        services = Service()
+        tasks = Tasks(services=services, db=self.db)
+        executed = []
+        finish = TaskQueue._TaskQueue__finish
+        failures = [RuntimeError('database is locked')]
+
+        async def unreliable_finish(queue, db, results):
+            if failures:
+                raise failures.pop()
+            await finish(queue, db, results)
+
+        with patch.object(TaskQueue, '_TaskQueue__finish', unreliable_finish):
+            @tasks(name='unsaved', visibility=0.1, poll_interval=0.01)
+            async def unsaved(payload):
+                executed.append(payload)
+
+        await unsaved.enqueue(1)
+        await drain(unsaved)
+        # result is lost, but the worker is alive: task is executed again after visibility timeout
+        assert executed == [1, 1]
+        await unsaved.enqueue(2)
+        await drain(unsaved)
+        services.stop('unsaved')
+        await sleep(0.05)
+        await tasks.close()
+        assert executed == [1, 1, 2]
+        stats = await unsaved.stats()
+        assert stats.pending == 0 and stats.failed == 0
+
+    @atest
+    async def test_release(self):
+        services = Service()
+        tasks = Tasks(services=services, db=self.db)
+        started = Event()
+
+        @tasks(name='slow', poll_interval=0.01)
+        async def slow(payload):
+            started.set()
+            await sleep(10)
+
+        await slow.enqueue_many([1, 2, 3])
+        await wait_for(started.wait(), 5)
+        services.stop('slow')
+        await sleep(0.05)
+
+        # stopped before finish: tasks are returned to queue without counting attempt
+        rows = await self.db.fetch_all("SELECT attempts, lease FROM task WHERE queue = 'slow' ORDER BY id")
+        assert [(row[0], row[1]) for row in rows] == [(0, None)] * 3
+        stats = await slow.stats()
+        assert stats.pending == 3
+
+    @atest
+    async def test_finish_by_lease(self):
+        services = Service()
+        tasks = Tasks(services=services, db=self.db)
+
+        @tasks(name='leased')
+        async def leased(payload):
+            pass
+
+        services.stop('leased')
+        await leased.enqueue_many([1, 2])
+        rows = await self.db.fetch_all("SELECT id FROM task WHERE queue = 'leased' ORDER BY id")
+        first, second = rows[0][0], rows[1][0]
+        # the first task was re-claimed after visibility timeout: the old lease is not valid anymore
+        await self.db.execute("UPDATE task SET lease = 'new' WHERE queue = 'leased'")
+        await TaskQueue._TaskQueue__finish(leased, self.db, [(first, 'old', None, None), (second, 'new', None, None)])
+
+        rows = await self.db.fetch_all("SELECT id FROM task WHERE queue = 'leased'")
+        assert [row[0] for row in rows] == [first]
+        await tasks.close()
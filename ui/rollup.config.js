@@ -4,7 +4,8 @@ import resolve from '@rollup/plugin-node-resolve';
 import commonjs from '@rollup/plugin-commonjs';
 import livereload from 'rollup-plugin-livereload';
 import {terser} from 'rollup-plugin-terser';
-import {copySync, removeSync} from 'fs-extra'
+import {copySync, removeSync, readFileSync, writeFileSync, renameSync} from 'fs-extra'
+import {createHash} from 'crypto'
 import {spassr} from 'spassr'
 import getConfig from '@roxi/routify/lib/utils/config'
 import autoPreprocess from 'svelte-preprocess'
@@ -39,6 +40,21 @@ const copyToDist = () => ({
         copySync(assetsDir, distDir)
     }
 })
+// content-hashed names of styles and entry script: they are cached by browsers forever.
+// Only exact attribute values in index.html are replaced; chunks import the entry by its hashed name already
+const fingerprint = () => ({
+    writeBundle(options, bundle) {
+        const entry = Object.values(bundle).find(chunk => chunk.isEntry)
+        const digest = createHash('sha256').update(readFileSync(`${buildDir}/bundle.css`)).digest('hex')
+        const styles = `bundle-${digest.slice(0, 8)}.css`
+        renameSync(`${buildDir}/bundle.css`, `${buildDir}/${styles}`)
+        const page = `${distDir}/index.html`
+        const html = readFileSync(page, 'utf-8')
+            .replace(/(src|href)=(["'])build\/main\.js\2/g, `$1=$2build/${entry.fileName}$2`)
+            .replace(/href=(["'])build\/bundle\.css\1/g, `href=$1build/${styles}$1`)
+        writeFileSync(page, html)
+    }
+})
 
 
 export default {
@@ -49,6 +65,7 @@ export default {
         format: 'esm',
         dir: buildDir,
         // for performance, disabling filename hashing in development
+        entryFileNames: `[name]${production && '-[hash]' || ''}.js`,
         chunkFileNames: `[name]${production && '-[hash]' || ''}.js`
     },
     plugins: [
@@ -92,6 +109,7 @@ export default {
             mode: 'production'
         }),
         production && copyToDist(),
+        production && fingerprint(),
     ],
     watch: {
         clearScreen: false,
@@ -62,6 +62,18 @@ export interface Info {
      * @memberof Info
      */
     restartDelay: number;
+    /**
+     * 
+     * @type {Date}
+     * @memberof Info
+     */
+    nextRun?: Date;
+    /**
+     * 
+     * @type {boolean}
+     * @memberof Info
+     */
+    paused?: boolean;
 }
 
 export function InfoFromJSON(json: any): Info {
@@ -80,6 +92,8 @@ export function InfoFromJSONTyped(json: any, ignoreDiscriminator: boolean): Info
         'autostart': json['autostart'],
         'restart': json['restart'],
         'restartDelay': json['restart_delay'],
+        'nextRun': !exists(json, 'next_run') ? undefined : (json['next_run'] === null ? null : new Date(json['next_run'])),
+        'paused': !exists(json, 'paused') ? undefined : json['paused'],
     };
 }
 
@@ -98,6 +112,8 @@ export function InfoToJSON(value?: Info | null): any {
         'autostart': value.autostart,
         'restart': value.restart,
         'restart_delay': value.restartDelay,
+        'next_run': value.nextRun === undefined ? undefined : (value.nextRun === null ? null : value.nextRun.toISOString()),
+        'paused': value.paused,
     };
 }
 
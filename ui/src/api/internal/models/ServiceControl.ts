@@ -24,7 +24,13 @@ export interface ServiceControl {
      * @type {boolean}
      * @memberof ServiceControl
      */
-    running: boolean;
+    running?: boolean;
+    /**
+     * 
+     * @type {boolean}
+     * @memberof ServiceControl
+     */
+    paused?: boolean;
 }
 
 export function ServiceControlFromJSON(json: any): ServiceControl {
@@ -37,7 +43,8 @@ export function ServiceControlFromJSONTyped(json: any, ignoreDiscriminator: bool
     }
     return {
         
-        'running': json['running'],
+        'running': !exists(json, 'running') ? undefined : json['running'],
+        'paused': !exists(json, 'paused') ? undefined : json['paused'],
     };
 }
 
@@ -51,6 +58,7 @@ export function ServiceControlToJSON(value?: ServiceControl | null): any {
     return {
         
         'running': value.running,
+        'paused': value.paused,
     };
 }
 
@@ -21,7 +21,8 @@ export enum Status {
     Stopped = 'stopped',
     Starting = 'starting',
     Running = 'running',
-    Restarting = 'restarting'
+    Restarting = 'restarting',
+    Failed = 'failed'
 }
 
 export function StatusFromJSON(json: any): Status {
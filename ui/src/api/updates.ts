@@ -2,62 +2,166 @@ import type {Headline, Info, Journal} from "./internal";
 import {apiURL} from "./index";
 import {HeadlineFromJSON, InfoFromJSON, JournalFromJSON} from "./internal";
 
-export class Updates<T> {
+type Listener = (data: any) => any;
+
+/**
+ * Single websocket (/internal/stream) shared by all live views. Views subscribe to topics,
+ * subscriptions are restored after reconnect. Connection is closed once there are no subscribers.
+ */
+class Stream {
     private ws?: WebSocket = null;
     private scheduler?: number = null;
+    private readonly listeners = new Map<string, Set<Listener>>();
 
     constructor(private readonly url: string,
-                private readonly callback: (value) => any,
-                private readonly factory: (json: any) => T,
                 private readonly interval: number = 3000) {
-        if (url) {
-            this.connect();
+    }
+
+    subscribe(topic: string, listener: Listener) {
+        let listeners = this.listeners.get(topic);
+        if (!listeners) {
+            listeners = new Set<Listener>();
+            this.listeners.set(topic, listeners);
+            this.send({subscribe: [topic]});
         }
+        listeners.add(listener);
+        this.connect();
     }
 
-    close() {
-        if (this.ws) {
-            this.ws.close()
-            this.ws = null;
+    unsubscribe(topic: string, listener: Listener) {
+        const listeners = this.listeners.get(topic);
+        if (!listeners) {
+            return
         }
-        if (this.scheduler) {
-            clearTimeout(this.scheduler);
+        listeners.delete(listener);
+        if (listeners.size > 0) {
+            return
+        }
+        this.listeners.delete(topic);
+        this.send({unsubscribe: [topic]});
+        if (this.listeners.size === 0) {
+            this.disconnect();
+        }
+    }
+
+    private send(message: any) {
+        if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+            this.ws.send(JSON.stringify(message));
         }
     }
 
     private connect() {
-        this.scheduler = null;
-        if (!this.url) {
+        if (this.ws || this.scheduler) {
             return
         }
-        this.ws = new WebSocket(this.url);
-
-        this.ws.onclose = () => {
+        const ws = new WebSocket(this.url);
+        ws.onopen = () => {
+            ws.send(JSON.stringify({subscribe: Array.from(this.listeners.keys())}));
+        }
+        ws.onclose = () => {
+            if (this.ws !== ws) {
+                return
+            }
             this.ws = null;
-            this.scheduler = setTimeout(this.connect, this.interval);
+            if (this.listeners.size > 0) {
+                this.scheduler = setTimeout(() => {
+                    this.scheduler = null;
+                    this.connect();
+                }, this.interval);
+            }
+        }
+        ws.onmessage = (event) => {
+            for (const message of JSON.parse(event.data)) {
+                if (message.error) {
+                    console.warn(`stream topic ${message.topic}: ${message.error}`);
+                    continue
+                }
+                const listeners = this.listeners.get(message.topic);
+                if (listeners) {
+                    listeners.forEach((listener) => listener(message.data));
+                }
+            }
+        }
+        this.ws = ws;
+    }
+
+    private disconnect() {
+        if (this.scheduler) {
+            clearTimeout(this.scheduler);
+            this.scheduler = null;
         }
-        this.ws.onmessage = (event) => {
-            const pd = this.factory(JSON.parse(event.data));
-            this.callback(pd);
+        if (this.ws) {
+            const ws = this.ws;
+            this.ws = null;
+            ws.close();
         }
     }
 }
 
 function wsURL(resource: string): string {
     let url = new URL(apiURL + resource, document.baseURI);
-    url.protocol = url.protocol === "https" ? "wss" : "ws";
+    url.protocol = url.protocol === "https:" ? "wss:" : "ws:";
     return url.href.toString()
 }
 
-export function journalsHeadlines(callback: (value: Headline) => any): Updates<Headline> {
-    return new Updates<Headline>(wsURL("/internal/journals/updates"), callback, HeadlineFromJSON)
+const stream = new Stream(wsURL("/internal/stream"));
+
+// class (not interface): views import it with functions as a value
+export abstract class Updates<T> {
+    abstract close();
 }
 
-export function journalUpdates(id: number, callback: (value: Journal) => any): Updates<Journal> {
-    return new Updates<Journal>(wsURL(`/internal/journal/${id}/updates`), callback, JournalFromJSON)
+/**
+ * Updates of topic from the shared stream
+ */
+class Topic<T> extends Updates<T> {
+    private readonly listener: Listener;
+
+    constructor(private readonly topic: string,
+                callback: (value: T) => any,
+                factory: (json: any) => T) {
+        super();
+        this.listener = (data) => callback(factory(data));
+        stream.subscribe(topic, this.listener);
+    }
+
+    close() {
+        stream.unsubscribe(this.topic, this.listener);
+    }
+}
+
+/**
+ * Resumable server-sent events of journals. Browser reconnects with Last-Event-ID and receives
+ * journals updated while it was disconnected. If missed updates are not available anymore (ex: server restarted),
+ * reset callback is invoked: the view should reload its state.
+ */
+class Events<T> extends Updates<T> {
+    private readonly source: EventSource;
+
+    constructor(resource: string,
+                callback: (value: T) => any,
+                factory: (json: any) => T,
+                reset: () => any) {
+        super();
+        this.source = new EventSource(new URL(apiURL + resource, document.baseURI).href);
+        this.source.addEventListener('journal', (event: MessageEvent) => callback(factory(JSON.parse(event.data))));
+        this.source.addEventListener('reset', () => reset());
+    }
+
+    close() {
+        this.source.close();
+    }
+}
+
+export function journalsHeadlines(callback: (value: Headline) => any, reset: () => any): Updates<Headline> {
+    return new Events<Headline>("/internal/journals/events", callback, HeadlineFromJSON, reset)
+}
+
+export function journalUpdates(id: number, callback: (value: Journal) => any, reset: () => any): Updates<Journal> {
+    return new Events<Journal>(`/internal/journal/${id}/events`, callback, JournalFromJSON, reset)
 }
 
 
 export function servicesUpdates(callback: (value: Info) => any): Updates<Info> {
-    return new Updates<Info>(wsURL(`/internal/services/updates`), callback, InfoFromJSON)
-}
\ No newline at end of file
+    return new Topic<Info>("services", callback, InfoFromJSON)
+}